@@ -0,0 +1,1002 @@
+"""Offline benchmarks for the airdrop bot
+
+Usage:
+    python benchmark.py store [--users N]
+    python benchmark.py render [--renders N]
+    python benchmark.py ingest [--users N] [--updates FILE.jsonl]
+    python benchmark.py sends [--users N] [--flood-probability P]
+    python benchmark.py membership [--users N]
+    python benchmark.py scaleout [--users N] [--workers 1 2 4]
+    python benchmark.py metrics [--observations N]
+    python benchmark.py logging [--users N] [--log-write-delay SECONDS]
+    python benchmark.py load [--users N] [--think-time SECONDS] [--double-tap P] [--json FILE]
+    python benchmark.py maintenance [--users N]
+"""
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from telegram import ChatMemberLeft, ChatMemberMember, Update, User
+from telegram.ext import TypeHandler
+from telegram.request import BaseRequest
+
+import bot
+
+FAKE_TOKEN = '123456:offline-benchmark'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Airdrop Bot', 'username': 'airdrop_bench_bot'}
+
+
+class FakeTelegram(BaseRequest):
+    """Offline stand-in for the Bot API that answers every method locally
+
+    Outbound calls are counted per endpoint. getUpdates long-polls the updates
+    handed to push_update(), like the real API does. With flood_probability
+    set, message-sending calls randomly fail with 429 / retry_after.
+    """
+
+    def __init__(self, flood_probability=0.0, retry_after=1, seed=0):
+        self.flood_probability = flood_probability
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self.floods = 0
+        self.send_times = []
+        self.calls = Counter()
+        self._pending_updates = []
+        self._updates_event = asyncio.Event()
+        self._message_ids = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def push_update(self, data):
+        self._pending_updates.append(data)
+        self._updates_event.set()
+
+    def _message(self, params):
+        self._message_ids += 1
+        return {
+            'message_id': params.get('message_id', self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': params.get('chat_id', 0), 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+
+    async def _get_updates(self, params):
+        offset = params.get('offset', 0)
+        self._pending_updates = [u for u in self._pending_updates if u['update_id'] >= offset]
+        if not self._pending_updates and params.get('timeout'):
+            self._updates_event.clear()
+            try:
+                await asyncio.wait_for(self._updates_event.wait(), params['timeout'])
+            except asyncio.TimeoutError:
+                pass
+        return self._pending_updates[:params.get('limit', 100)]
+
+    async def answer(self, endpoint, params):
+        if endpoint == 'getMe':
+            return BOT_USER
+        if endpoint == 'getUpdates':
+            return await self._get_updates(params)
+        if endpoint in ('sendMessage', 'editMessageText', 'sendDocument'):
+            return self._message(params)
+        return True
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        params = request_data.parameters if request_data else {}
+        if endpoint.startswith(('send', 'edit')):
+            if self._rng.random() < self.flood_probability:
+                self.floods += 1
+                return 429, json.dumps({
+                    'ok': False,
+                    'error_code': 429,
+                    'description': f'Too Many Requests: retry after {self.retry_after}',
+                    'parameters': {'retry_after': self.retry_after},
+                }).encode()
+            self.send_times.append(time.monotonic())
+        result = await self.answer(endpoint, params)
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+class FakeMembershipBot:
+    """Bot stand-in whose get_chat_member answers after a Bot API-like latency
+
+    Every other user is a member. Calls and their start times are recorded.
+    """
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.calls = 0
+        self.call_times = []
+
+    async def get_chat_member(self, chat_id, user_id):
+        self.calls += 1
+        self.call_times.append(time.perf_counter())
+        await asyncio.sleep(self.latency)
+        user = User(id=user_id, first_name='Bench', is_bot=False)
+        return ChatMemberMember(user=user) if user_id % 2 else ChatMemberLeft(user=user)
+
+
+def _user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': 'User', 'username': f'user{user_id}'}
+
+
+def command_update(update_id, user_id, text):
+    command = text.split()[0]
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': _user(user_id),
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}],
+        },
+    }
+
+
+def text_update(update_id, user_id, text):
+    data = command_update(update_id, user_id, text)
+    del data['message']['entities']
+    return data
+
+
+def callback_update(update_id, user_id, callback_data, message_id=1):
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': _user(user_id),
+            'chat_instance': str(user_id),
+            'data': callback_data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': 'menu',
+            },
+        },
+    }
+
+
+def peak_per_second(times):
+    """Highest number of sorted timestamps within any one second"""
+    peak, left = 0, 0
+    for right in range(len(times)):
+        while times[right] - times[left] > 1.0:
+            left += 1
+        peak = max(peak, right - left + 1)
+    return peak
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+class LoopLagMonitor:
+    """Measures how long the event loop is stalled between ticks"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.max_lag = 0.0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.max_lag = max(self.max_lag, loop.time() - start - self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self._task.cancel()
+
+
+class InlineStore:
+    """The pre-UserStore access pattern: a fresh connection per call, on the loop"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def _run(self, fn, *args):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return fn(conn, *args)
+        finally:
+            conn.close()
+
+    def _commit(self, ops):
+        def apply(conn):
+            with conn:
+                for sql, params in ops:
+                    conn.execute(sql, params)
+        self._run(apply)
+
+    async def get_or_create_user(self, user_id, username, first_name):
+        if self._run(bot.UserStore._find_user, user_id):
+            self._commit([(bot.SQL_TOUCH_USER, (username, first_name, user_id))])
+        else:
+            self._commit([(bot.SQL_INSERT_USER, (user_id, username, first_name))])
+
+    async def get_user_progress(self, user_id, campaign=bot.MAIN_CAMPAIGN):
+        return self._run(bot.UserStore._get_user_progress, user_id, campaign)
+
+    async def mark_task_completed(self, user_id, task_num, campaign=bot.MAIN_CAMPAIGN):
+        self._commit(bot.UserStore.mark_task_ops(user_id, task_num, campaign))
+
+    def has_pending_writes(self, user_id):
+        return False
+
+    async def close(self):
+        pass
+
+
+async def simulate_user(user_id):
+    """One /start followed by verify_1 .. verify_N"""
+    await bot.UserManager.get_or_create_user(user_id, f"user{user_id}", "User")
+    await bot.UserManager.get_user_progress(user_id)
+    for task_num in range(1, len(bot.TASKS) + 1):
+        await bot.UserManager.mark_task_completed(user_id, task_num)
+        await bot.UserManager.get_user_progress(user_id)
+
+
+async def run_store_benchmark(users, mode):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        bot.init_db(db_path)
+        bot.progress_cache = bot.ProgressCache()
+        if mode == 'inline':
+            bot.user_store = InlineStore(db_path)
+        else:
+            bot.user_store = bot.UserStore(db_path, durability=mode)
+
+        monitor = LoopLagMonitor()
+        monitor.start()
+        await asyncio.sleep(0)
+        start = time.perf_counter()
+        await asyncio.gather(*(simulate_user(user_id) for user_id in range(1, users + 1)))
+        elapsed = time.perf_counter() - start
+        await asyncio.sleep(monitor.interval * 2)
+        monitor.stop()
+        await bot.user_store.close()
+        with sqlite3.connect(db_path) as conn:
+            completed = conn.execute(
+                'SELECT COUNT(*) FROM users WHERE tasks_mask & ?', (1 << (len(bot.TASKS) - 1),)
+            ).fetchone()[0]
+        assert completed == users, f"expected {users} completed users, found {completed}"
+
+    operations = users * (2 + 2 * len(bot.TASKS))
+    print(f"{mode:>8}: {users} users, {operations} ops in {elapsed:.2f}s "
+          f"({operations / elapsed:,.0f} ops/s), max loop stall {monitor.max_lag * 1000:.1f} ms, "
+          f"cache hit rate {bot.progress_cache.hit_rate * 100:.0f}%")
+
+
+def run_render_benchmark(renders):
+    """Per-render cost of the task and progress screens, uncached vs memoized"""
+    total_tasks = len(bot.TASKS)
+    rng = random.Random(0)
+    states = [
+        (rng.randint(1, total_tasks), rng.randrange(1 << total_tasks), rng.randint(1, total_tasks))
+        for _ in range(renders)
+    ]
+
+    def render_all(task_screen, progress_screen):
+        start = time.perf_counter()
+        for task_number, mask, current_step in states:
+            task_screen(task_number, mask)
+            progress_screen(mask, current_step)
+        return (time.perf_counter() - start) / (2 * renders)
+
+    uncached = render_all(bot.render_task_screen.__wrapped__, bot.render_progress_screen.__wrapped__)
+    bot.invalidate_render_cache()
+    cached = render_all(bot.render_task_screen, bot.render_progress_screen)
+    print(f"uncached: {uncached * 1e6:.1f} us/render")
+    print(f"  cached: {cached * 1e6:.1f} us/render ({uncached / cached:.0f}x faster), "
+          f"{bot.render_task_screen.cache_info().currsize + bot.render_progress_screen.cache_info().currsize} screens cached")
+
+
+def navigation_script(user_id, first_update_id):
+    """/start, then browse the task and progress screens"""
+    steps = [
+        lambda uid: command_update(uid, user_id, '/start'),
+        lambda uid: callback_update(uid, user_id, 'start_tasks'),
+        lambda uid: callback_update(uid, user_id, 'task_2'),
+        lambda uid: callback_update(uid, user_id, 'task_3'),
+        lambda uid: callback_update(uid, user_id, 'check_progress'),
+    ]
+    return [step(first_update_id + i) for i, step in enumerate(steps)]
+
+
+def load_recorded_updates(path):
+    """Group recorded update JSON lines into per-user click scripts"""
+    scripts = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                data = json.loads(line)
+                update = Update.de_json(data, None)
+                scripts.setdefault(update.effective_user.id, []).append(data)
+    return list(scripts.values())
+
+
+async def run_ingest_benchmark(mode, scripts, think_time=0.05):
+    """Handler latency from the moment a user clicks until the handler finished"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        bot.init_db(db_path)
+        bot.user_store = bot.UserStore(db_path)
+        bot.event_log = bot.EventLog(bot.user_store)
+        # Scripted users click faster than the abuse limits allow
+        bot.abuse_scorer = bot.AbuseScorer(max_clicks=10**6, min_verify_interval=0)
+        bot.progress_cache = bot.ProgressCache()
+
+        fake = FakeTelegram()
+        # Ingestion latency only, outbound limits are measured by the sends suite
+        unlimited = bot.SendScheduler(global_rate=1e6, per_chat_rate=1e6, per_chat_burst=10**6)
+        application = bot.build_application(FAKE_TOKEN, request=fake, rate_limiter=unlimited)
+        finished = {}
+
+        async def record_finished(update, context):
+            future = finished.get(update.update_id)
+            if future and not future.done():
+                future.set_result(time.perf_counter())
+
+        application.add_handler(TypeHandler(Update, record_finished), group=100)
+        await application.initialize()
+        await application.start()
+
+        session = server = poller = None
+        if mode == 'webhook':
+            import aiohttp
+            server = bot.WebhookServer(application, listen='127.0.0.1', port=0, secret_token='bench')
+            await server.start()
+            session = aiohttp.ClientSession()
+            url = f'http://127.0.0.1:{server.port}{server.path}'
+
+            async def deliver(data):
+                async with session.post(url, json=data, headers={'X-Telegram-Bot-Api-Secret-Token': 'bench'}) as resp:
+                    assert resp.status == 200, resp.status
+        else:
+            poller = bot.UpdatePoller(application)
+            await poller.start()
+
+            async def deliver(data):
+                fake.push_update(data)
+
+        latencies = []
+        # Telegram numbers updates in arrival order, whatever the recorded ids were
+        update_ids = itertools.count(1)
+
+        async def replay(script):
+            for data in script:
+                data = dict(data, update_id=next(update_ids))
+                future = finished[data['update_id']] = asyncio.get_running_loop().create_future()
+                sent = time.perf_counter()
+                await deliver(data)
+                latencies.append(await future - sent)
+                del finished[data['update_id']]
+                await asyncio.sleep(think_time)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(replay(script) for script in scripts))
+        elapsed = time.perf_counter() - start
+
+        if session:
+            await session.close()
+        if server:
+            await server.stop()
+        if poller:
+            await poller.stop()
+        await application.stop()
+        if poller:
+            await poller.finish()
+        await application.shutdown()
+        await bot.event_log.flush()
+        await bot.user_store.close()
+
+    print(f"{mode:>8}: {len(latencies)} updates in {elapsed:.2f}s ({len(latencies) / elapsed:,.0f} updates/s), "
+          f"p50 {percentile(latencies, 50) * 1000:.1f} ms, p99 {percentile(latencies, 99) * 1000:.1f} ms")
+
+
+async def run_sends_benchmark(broadcast_chats, flood_probability):
+    """Broadcast to many chats while users keep clicking, through SendScheduler"""
+    fake = FakeTelegram(flood_probability=flood_probability)
+    scheduler = bot.SendScheduler()
+    application = bot.build_application(FAKE_TOKEN, request=fake, rate_limiter=scheduler)
+    await application.initialize()
+    bot_api = application.bot
+    latencies = {'interactive': [], 'broadcast': []}
+    failed = Counter()
+
+    async def send(chat_id, priority):
+        start = time.perf_counter()
+        try:
+            await bot_api.send_message(chat_id=chat_id, text='benchmark', rate_limit_args={'priority': priority})
+        except Exception:
+            failed[priority] += 1
+            return
+        latencies[priority].append(time.perf_counter() - start)
+
+    async def interactive_users():
+        # 10 users clicking every 500 ms while the broadcast is running
+        for round_number in range(20):
+            await asyncio.gather(*(send(-chat_id, 'interactive') for chat_id in range(1, 11)))
+            await asyncio.sleep(0.5)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(send(chat_id, 'broadcast') for chat_id in range(1, broadcast_chats + 1)),
+        interactive_users()
+    )
+    elapsed = time.perf_counter() - start
+    await application.shutdown()
+
+    times = fake.send_times
+    peak = peak_per_second(times)
+    print(f"{len(times)} messages delivered in {elapsed:.1f}s, peak {peak} msg/s "
+          f"(limit {bot.SEND_GLOBAL_RATE:.0f}), {fake.floods} injected 429s, {scheduler.flood_waits} retried, "
+          f"{sum(failed.values())} failed")
+    for priority, values in latencies.items():
+        print(f"{priority:>12}: p50 {percentile(values, 50) * 1000:,.0f} ms, p99 {percentile(values, 99) * 1000:,.0f} ms")
+
+
+async def run_membership_benchmark(users, cached, clicks=4, rounds=3):
+    """Click storm on the group/channel verify buttons, through MembershipVerifier"""
+    fake = FakeMembershipBot()
+    if cached:
+        verifier = bot.MembershipVerifier(fake)
+    else:
+        verifier = bot.MembershipVerifier(fake, ttl=0, negative_ttl=0)
+    chats = ('@bench_group', '@bench_channel')
+    latencies = []
+
+    async def check(chat_id, user_id):
+        start = time.perf_counter()
+        await verifier.is_member(chat_id, user_id)
+        latencies.append(time.perf_counter() - start)
+
+    async def storm(user_id):
+        # Each round the user hammers both verify buttons, then tries again a second later
+        for round_number in range(rounds):
+            await asyncio.gather(*(check(chat_id, user_id) for chat_id in chats for click in range(clicks)))
+            await asyncio.sleep(1)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(storm(user_id) for user_id in range(1, users + 1)))
+    elapsed = time.perf_counter() - start
+
+    label = 'cached' if cached else 'uncached'
+    print(f"{label:>8}: {len(latencies)} checks in {elapsed:.1f}s, {fake.calls} getChatMember calls "
+          f"({verifier.deduplicated} deduplicated), peak {peak_per_second(fake.call_times)} calls/s "
+          f"(limit {bot.MEMBERSHIP_CHECK_RATE:.0f}), p50 {percentile(latencies, 50) * 1000:,.0f} ms, "
+          f"p99 {percentile(latencies, 99) * 1000:,.0f} ms")
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def run_scaleout_worker(expected):
+    """One worker process of the scaleout suite, configured through the environment"""
+    # Scripted users click faster than the abuse limits allow
+    bot.abuse_scorer = bot.AbuseScorer(max_clicks=10**6, min_verify_interval=0)
+    unlimited = bot.SendScheduler(global_rate=1e6, per_chat_rate=1e6, per_chat_burst=10**6)
+    application = bot.build_application(FAKE_TOKEN, request=FakeTelegram(), rate_limiter=unlimited)
+    processor = application.update_processor
+    handled = 0
+    all_handled = asyncio.Event()
+
+    def check_done():
+        # Repeated clicks and clicks beyond the per-user queue are dropped, not handled
+        if handled + processor.dropped_updates >= expected:
+            all_handled.set()
+
+    async def count_handled(update, context):
+        nonlocal handled
+        handled += 1
+        check_done()
+
+    application.add_handler(TypeHandler(Update, count_handled), group=100)
+    await application.initialize()
+    await application.start()
+    server = bot.WebhookServer(application, listen='127.0.0.1')
+    await server.start()
+    print('ready', flush=True)
+
+    while expected and not all_handled.is_set():
+        check_done()
+        try:
+            await asyncio.wait_for(all_handled.wait(), 0.1)
+        except asyncio.TimeoutError:
+            pass
+    print(f"done {time.time():.6f} {handled} {processor.dropped_updates} {server.forwarded} {bot.user_store.calls}",
+          flush=True)
+    # Keep forwarding for the other workers until the driver closes stdin
+    await asyncio.get_running_loop().run_in_executor(None, sys.stdin.readline)
+
+    await server.stop()
+    await application.stop()
+    await application.shutdown()
+    await bot.event_log.flush()
+    await bot.user_store.close()
+
+
+async def run_scaleout_benchmark(users, workers):
+    """Updates/s through N webhook workers sharing one state server
+
+    Updates are spread round-robin over the workers like a load balancer
+    would, so most of them are forwarded to the worker owning the user.
+    """
+    import aiohttp
+
+    with tempfile.TemporaryDirectory() as tmp:
+        state_port = _free_port()
+        peers = [f'http://127.0.0.1:{_free_port()}/telegram' for _ in range(workers)]
+        env = dict(
+            os.environ,
+            DB_PATH=os.path.join(tmp, 'bench.db'),
+            CONFIG_PATH=os.path.join(tmp, 'defaults.yaml'),
+            STATE_SERVER_TOKEN='bench',
+            WEBHOOK_SECRET_TOKEN='bench',
+            STATE_BACKEND=f'http://127.0.0.1:{state_port}',
+            WORKER_PEERS=','.join(peers),
+            EVENT_BATCH_MAX_DELAY='0.2',
+        )
+        scripts = [navigation_script(user_id, user_id * 10) for user_id in range(1, users + 1)]
+        expected = Counter(bot.partition_of(user_id, workers) for user_id in range(1, users + 1) for _ in scripts[0])
+
+        state_server = await asyncio.create_subprocess_exec(
+            sys.executable, bot.__file__, 'state-server', '--listen', '127.0.0.1', '--port', str(state_port),
+            env=dict(env, STATE_BACKEND='sqlite'), stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+        )
+        processes = []
+        for index, peer in enumerate(peers):
+            processes.append(await asyncio.create_subprocess_exec(
+                sys.executable, __file__, 'scaleout-worker', str(expected[index]),
+                env=dict(env, WORKER_INDEX=str(index), WEBHOOK_PORT=peer.split(':')[2].split('/')[0]),
+                stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+            ))
+        try:
+            await _wait_for_port(state_port)
+            for process in processes:
+                assert (await process.stdout.readline()).strip() == b'ready'
+
+            balancer = itertools.cycle(peers)
+            async with aiohttp.ClientSession() as session:
+                async def replay(script):
+                    for data in script:
+                        async with session.post(next(balancer), json=data,
+                                                headers={'X-Telegram-Bot-Api-Secret-Token': 'bench'}) as response:
+                            assert response.status == 200, response.status
+
+                start = time.time()
+                await asyncio.gather(*(replay(script) for script in scripts))
+                reports = [(await process.stdout.readline()).split() for process in processes]
+            elapsed = max(float(report[1]) for report in reports) - start
+        finally:
+            for process in processes:
+                if process.returncode is None:
+                    process.stdin.close()
+            await asyncio.gather(*(process.wait() for process in processes))
+            state_server.send_signal(signal.SIGTERM)
+            await state_server.wait()
+
+    total = sum(int(report[2]) for report in reports)
+    dropped = sum(int(report[3]) for report in reports)
+    forwarded = sum(int(report[4]) for report in reports)
+    state_calls = sum(int(report[5]) for report in reports)
+    print(f"{workers} worker{'s' if workers > 1 else ' '}: {total} updates in {elapsed:.2f}s "
+          f"({total / elapsed:,.0f} updates/s), {dropped} clicks dropped, {forwarded} forwarded, "
+          f"{state_calls / total:.1f} state server calls per update")
+
+
+class SlowStream(io.TextIOWrapper):
+    """Text file whose writes block for delay seconds, like a pipe or terminal that is behind"""
+
+    def __init__(self, path, delay):
+        super().__init__(open(path, 'wb'))
+        self.delay = delay
+
+    def write(self, text):
+        time.sleep(self.delay)
+        return super().write(text)
+
+
+async def run_logging_benchmark(scripts, label, sample_rate=1.0, write_delay=0.0, **logging_options):
+    """Handler throughput with INFO records written to a file through the given logging setup"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        log_path = os.path.join(tmp, 'bot.log')
+        bot.init_db(db_path)
+        bot.user_store = bot.UserStore(db_path)
+        bot.event_log = bot.EventLog(bot.user_store)
+        bot.abuse_scorer = bot.AbuseScorer(max_clicks=10**6, min_verify_interval=0)
+        bot.progress_cache = bot.ProgressCache()
+
+        unlimited = bot.SendScheduler(global_rate=1e6, per_chat_rate=1e6, per_chat_burst=10**6)
+        application = bot.build_application(FAKE_TOKEN, request=FakeTelegram(), rate_limiter=unlimited)
+        finished = {}
+
+        async def record_finished(update, context):
+            finished.pop(update.update_id).set_result(None)
+
+        application.add_handler(TypeHandler(Update, record_finished), group=100)
+        await application.initialize()
+        await application.start()
+
+        async def replay(script):
+            for data in script:
+                future = finished[data['update_id']] = asyncio.get_running_loop().create_future()
+                await application.update_queue.put(Update.de_json(data, application.bot))
+                await future
+
+        with SlowStream(log_path, write_delay) as log_file:
+            bot.configure_logging(stream=log_file, level='INFO', **logging_options)
+            bot.click_sampler.rate = sample_rate
+            start = time.perf_counter()
+            await asyncio.gather(*(replay(script) for script in scripts))
+            elapsed = time.perf_counter() - start
+            bot.stop_logging()
+        with open(log_path) as log_file:
+            lines = sum(1 for _ in log_file)
+
+        bot.configure_logging(level='WARNING')
+        bot.click_sampler.rate = 1.0
+        await application.stop()
+        await application.shutdown()
+        await bot.event_log.flush()
+        await bot.user_store.close()
+
+    updates = sum(len(script) for script in scripts)
+    stream = f"{write_delay * 1000:g} ms/write" if write_delay else 'file'
+    print(f"{label:>22} ({stream}): {updates / elapsed:,.0f} updates/s, {lines} log lines")
+
+
+class CountingStore(bot.UserStore):
+    """UserStore counting every SQL statement its connections execute"""
+
+    def __init__(self, *args, **kwargs):
+        # One counter per connection, each only touched by the thread using that connection
+        self._statement_counts = []
+        super().__init__(*args, **kwargs)
+
+    def _connect(self):
+        conn = super()._connect()
+        count = [0]
+        self._statement_counts.append(count)
+
+        def trace(statement):
+            count[0] += 1
+
+        conn.set_trace_callback(trace)
+        return conn
+
+    @property
+    def statements(self):
+        return sum(count[0] for count in self._statement_counts)
+
+
+def load_script(user_id, first_update_id):
+    """A participant's full run: /start, every task verified, /progress, wallet, chat, restart"""
+    steps = [
+        lambda uid: command_update(uid, user_id, '/start'),
+        lambda uid: callback_update(uid, user_id, 'start_tasks'),
+    ]
+    for task_number in range(1, len(bot.TASKS) + 1):
+        steps.append(lambda uid, n=task_number: callback_update(uid, user_id, f'task_{n}'))
+        steps.append(lambda uid, n=task_number: callback_update(uid, user_id, f'verify_{n}'))
+    steps += [
+        lambda uid: command_update(uid, user_id, '/progress'),
+        lambda uid: text_update(uid, user_id, f'0x{user_id:040x}'),
+        lambda uid: text_update(uid, user_id, 'when payout?'),
+        lambda uid: callback_update(uid, user_id, 'check_progress'),
+        lambda uid: callback_update(uid, user_id, 'restart_airdrop'),
+    ]
+    return [step(first_update_id + i) for i, step in enumerate(steps)]
+
+
+def update_kind(data):
+    """Label an update for the latency breakdown: the command, the button without its number, or message"""
+    if 'callback_query' in data:
+        return data['callback_query']['data'].rstrip('0123456789').rstrip('_')
+    text = data['message']['text']
+    return text.split()[0] if text.startswith('/') else 'message'
+
+
+async def run_load_benchmark(users, think_time=0.05, json_path=None, double_tap=0.0):
+    """Every handler under N concurrent scripted users, with latency, DB and memory figures
+
+    With double_tap set, that share of button clicks is sent twice in a row,
+    like impatient users do; only the first of the two is timed.
+    """
+    import resource
+
+    scripts = [load_script(user_id, user_id * 100) for user_id in range(1, users + 1)]
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        bot.init_db(db_path)
+        bot.user_store = store = CountingStore(db_path)
+        bot.event_log = bot.EventLog(store)
+        # Scripted users click faster than the abuse limits allow
+        bot.abuse_scorer = bot.AbuseScorer(max_clicks=10**6, min_verify_interval=0)
+        bot.progress_cache = bot.ProgressCache()
+
+        fake = FakeTelegram()
+        unlimited = bot.SendScheduler(global_rate=1e6, per_chat_rate=1e6, per_chat_burst=10**6)
+        application = bot.build_application(FAKE_TOKEN, request=fake, rate_limiter=unlimited)
+        finished = {}
+
+        async def record_finished(update, context):
+            future = finished.pop(update.update_id, None)
+            if future is not None:
+                future.set_result(time.perf_counter())
+
+        application.add_handler(TypeHandler(Update, record_finished), group=100)
+        await application.initialize()
+        await application.start()
+        rng = random.Random(0)
+        repeat_ids = itertools.count(10**9)
+        api_calls_before = sum(fake.calls.values())
+        statements_before = store.statements
+        latencies = defaultdict(list)
+
+        async def replay(script):
+            for data in script:
+                future = finished[data['update_id']] = asyncio.get_running_loop().create_future()
+                sent = time.perf_counter()
+                await application.update_queue.put(Update.de_json(data, application.bot))
+                if 'callback_query' in data and rng.random() < double_tap:
+                    repeat = dict(data, update_id=next(repeat_ids))
+                    await application.update_queue.put(Update.de_json(repeat, application.bot))
+                latencies[update_kind(data)].append(await future - sent)
+                await asyncio.sleep(think_time)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(replay(script) for script in scripts))
+        elapsed = time.perf_counter() - start
+        # Let the last follow-up screens go out before the bot stops
+        while bot.screen_transitions:
+            await asyncio.sleep(0.05)
+
+        await application.stop()
+        await application.shutdown()
+        await bot.event_log.flush()
+        await store.close()
+        statements = store.statements - statements_before
+        api_calls = sum(fake.calls.values()) - api_calls_before
+
+    all_latencies = [latency for values in latencies.values() for latency in values]
+    updates = len(all_latencies)
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    results = {
+        'suite': 'load',
+        'users': users,
+        'updates': updates,
+        'think_time': think_time,
+        'double_tap': double_tap,
+        'elapsed_seconds': round(elapsed, 3),
+        'updates_per_second': round(updates / elapsed, 1),
+        'latency_ms': {'p50': round(percentile(all_latencies, 50) * 1000, 2),
+                       'p99': round(percentile(all_latencies, 99) * 1000, 2)},
+        'latency_ms_by_update': {
+            kind: {'count': len(values), 'p50': round(percentile(values, 50) * 1000, 2),
+                   'p99': round(percentile(values, 99) * 1000, 2)}
+            for kind, values in sorted(latencies.items())
+        },
+        'db_statements_per_update': round(statements / updates, 2),
+        'api_calls_per_update': round(api_calls / updates, 2),
+        'api_calls': dict(fake.calls),
+        'peak_rss_mb': round(peak_rss / 2**20, 1),
+    }
+
+    print(f"{updates} updates from {users} users in {elapsed:.2f}s ({results['updates_per_second']:,.0f} updates/s), "
+          f"p50 {results['latency_ms']['p50']:.1f} ms, p99 {results['latency_ms']['p99']:.1f} ms")
+    for kind, figures in results['latency_ms_by_update'].items():
+        print(f"  {kind:>16}: p50 {figures['p50']:8.1f} ms, p99 {figures['p99']:8.1f} ms ({figures['count']} updates)")
+    print(f"{results['db_statements_per_update']:.1f} SQL statements and {results['api_calls_per_update']:.1f} "
+          f"Bot API calls per update, peak RSS {results['peak_rss_mb']:.0f} MB")
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {json_path}")
+
+
+def run_metrics_benchmark(observations):
+    """Cost of recording a latency and of a timed() call, and of rendering /metrics"""
+    registry = bot.MetricsRegistry()
+    histogram = registry.histogram('bench_seconds', 'Benchmark latencies', ('handler',))
+    handlers = [f'handler_{i}' for i in range(20)]
+    rng = random.Random(0)
+    values = [(rng.expovariate(100), rng.choice(handlers)) for _ in range(observations)]
+
+    start = time.perf_counter()
+    for value, handler in values:
+        histogram.observe(value, handler)
+    observe = (time.perf_counter() - start) / observations
+
+    async def handler():
+        pass
+
+    async def call_all(fn):
+        start = time.perf_counter()
+        for _ in range(observations):
+            await fn()
+        return (time.perf_counter() - start) / observations
+
+    plain = asyncio.run(call_all(handler))
+    timed = asyncio.run(call_all(bot.timed(histogram)(handler)))
+
+    start = time.perf_counter()
+    lines = registry.render().count('\n')
+    render = time.perf_counter() - start
+    print(f"observe: {observe * 1e9:.0f} ns, timed() call overhead: {(timed - plain) * 1e9:.0f} ns")
+    print(f" render: {render * 1000:.2f} ms for {lines} lines")
+
+
+async def measure_writes(store, first_user_id, seconds):
+    """Latencies of committed single-user writes made for seconds"""
+    latencies = []
+    user_id = first_user_id
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        await store.get_or_create_user(user_id, 'bench', 'Bench')
+        await store.flush()
+        latencies.append(time.perf_counter() - start)
+        user_id += 1
+    return latencies
+
+
+async def run_maintenance_benchmark(users, inactive_share=0.5):
+    """Duration and pages reclaimed of each maintenance job, and writes during a snapshot"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        bot.init_db(db_path)
+        bot.progress_cache = bot.ProgressCache()
+        store = bot.user_store = bot.UserStore(db_path)
+        inactive = int(users * inactive_share)
+
+        def populate(conn, with_index):
+            if with_index:
+                conn.execute('CREATE INDEX idx_user_id ON users(user_id)')
+            start = time.perf_counter()
+            with conn:
+                conn.executemany(bot.SQL_INSERT_USER, ((user_id, f'user{user_id}', 'Bench') for user_id in range(1, users + 1)))
+            elapsed = time.perf_counter() - start
+            with conn:
+                conn.execute("UPDATE users SET last_active = '2020-01-01 00:00:00' WHERE user_id <= ?", (inactive,))
+            if with_index:
+                conn.execute('DROP INDEX idx_user_id')
+            return elapsed
+
+        # The redundant index is recreated for one round to show what it cost every insert
+        with_index = await store.write(populate, True)
+        await store.write(lambda conn: conn.execute('DELETE FROM users') and conn.commit())
+        without_index = await store.write(populate, False)
+        print(f"insert {users} users: {with_index * 1000:.0f} ms with idx_user_id, {without_index * 1000:.0f} ms without")
+
+        maintenance = bot.DatabaseMaintenance(store, backup_dir=os.path.join(tmp, 'backups'), archive_days=30)
+        for job in ('archive_inactive', 'vacuum', 'analyze', 'checkpoint', 'backup'):
+            name = {'archive_inactive': 'archive'}.get(job, job)
+            pages_before = bot.MAINTENANCE_PAGES._values[(name,)]
+            start = time.perf_counter()
+            await getattr(maintenance, job)()
+            elapsed = time.perf_counter() - start
+            print(f"{name:>10}: {elapsed * 1000:8.1f} ms, {bot.MAINTENANCE_PAGES._values[(name,)] - pages_before} pages reclaimed")
+
+        idle = await measure_writes(store, 10**9, 1.0)
+        during, _ = await asyncio.gather(measure_writes(store, 2 * 10**9, 1.0), maintenance.backup())
+        await store.close()
+
+    print(f"committed writes: p50 {percentile(idle, 50) * 1000:.1f} ms, p99 {percentile(idle, 99) * 1000:.1f} ms idle; "
+          f"p50 {percentile(during, 50) * 1000:.1f} ms, p99 {percentile(during, 99) * 1000:.1f} ms during a snapshot")
+
+
+def main():
+    if sys.argv[1:2] == ['scaleout-worker']:
+        logging.getLogger().setLevel(logging.WARNING)
+        asyncio.run(run_scaleout_worker(int(sys.argv[2])))
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('suite', choices=['store', 'render', 'ingest', 'sends', 'membership', 'scaleout', 'metrics', 'logging', 'load', 'maintenance'])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--renders', type=int, default=20000)
+    parser.add_argument('--updates', help='JSONL file of recorded updates to replay (ingest)')
+    parser.add_argument('--flood-probability', type=float, default=0.02,
+                        help='share of sends answered with 429 (sends)')
+    parser.add_argument('--observations', type=int, default=200000)
+    parser.add_argument('--log-write-delay', type=float, default=0.0005,
+                        help='seconds each write to the slow log stream blocks (logging)')
+    parser.add_argument('--think-time', type=float, default=0.05,
+                        help='seconds a scripted user waits between clicks (load)')
+    parser.add_argument('--double-tap', type=float, default=0.0,
+                        help='share of button clicks sent twice in a row (load)')
+    parser.add_argument('--json', help='write the results to this file as JSON (load)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4],
+                        help='worker process counts to compare (scaleout)')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.suite == 'store':
+        for mode in ('inline', 'strict', 'batched'):
+            asyncio.run(run_store_benchmark(args.users, mode))
+    elif args.suite == 'render':
+        run_render_benchmark(args.renders)
+    elif args.suite == 'ingest':
+        if args.updates:
+            scripts = load_recorded_updates(args.updates)
+        else:
+            scripts = [navigation_script(user_id, user_id * 10) for user_id in range(1, args.users + 1)]
+        for mode in ('polling', 'webhook'):
+            asyncio.run(run_ingest_benchmark(mode, scripts))
+    elif args.suite == 'sends':
+        asyncio.run(run_sends_benchmark(args.users, args.flood_probability))
+    elif args.suite == 'membership':
+        for cached in (False, True):
+            asyncio.run(run_membership_benchmark(args.users, cached))
+    elif args.suite == 'scaleout':
+        for workers in args.workers:
+            asyncio.run(run_scaleout_benchmark(args.users, workers))
+    elif args.suite == 'metrics':
+        run_metrics_benchmark(args.observations)
+    elif args.suite == 'maintenance':
+        asyncio.run(run_maintenance_benchmark(args.users))
+    elif args.suite == 'load':
+        asyncio.run(run_load_benchmark(args.users, args.think_time, args.json, args.double_tap))
+    elif args.suite == 'logging':
+        scripts = [navigation_script(user_id, user_id * 10) for user_id in range(1, args.users + 1)]
+        for write_delay in (0.0, args.log_write_delay):
+            for label, options in (
+                ('text, synchronous', dict(fmt='text', queue_size=0)),
+                ('text, writer thread', dict(fmt='text')),
+                ('json, writer thread', dict(fmt='json')),
+                ('json, 10% of clicks', dict(fmt='json', sample_rate=0.1)),
+            ):
+                asyncio.run(run_logging_benchmark(scripts, label, write_delay=write_delay, **options))
+
+
+if __name__ == '__main__':
+    main()
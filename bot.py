@@ -1,28 +1,295 @@
 import logging
 import os
+import re
+import atexit
+from abc import ABC, abstractmethod
+from array import array
 import asyncio
+import hashlib
+import hmac
+import io
+import json
+import signal
 import sqlite3
-from datetime import datetime
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict, deque
+from functools import lru_cache, wraps
+from logging.handlers import QueueHandler, QueueListener
+from pathlib import Path
+from queue import Full, Queue
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from types import MappingProxyType
+from typing import NamedTuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
+from telegram.constants import ChatMemberStatus
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from telegram.ext import Application, BaseRateLimiter, BaseUpdateProcessor, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
 
 # Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Records go through a queue to a writer thread, which formats them as text
+# or as one JSON object per line (LOG_FORMAT=json), so handlers never wait on
+# the log stream. Per-click records are sampled per user with
+# LOG_CLICK_SAMPLE_RATE; LOG_QUEUE_SIZE=0 writes synchronously instead.
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_CLICK_SAMPLE_RATE = float(os.getenv('LOG_CLICK_SAMPLE_RATE', '1.0'))
+LOG_TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and the fields passed as extra="""
+    
+    STANDARD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+    
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in self.STANDARD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves all formatting to the listener thread
+
+    Records never leave the process, so msg, args and exc_info are queued as
+    they are instead of being rendered on the logging thread. When the queue
+    is full the record is dropped and counted rather than blocking the loop.
+    """
+    
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+    
+    def prepare(self, record):
+        return record
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+class UserSampleFilter(logging.Filter):
+    """Keeps rate of the users' records: all of a sampled user's, none of the others'
+
+    Records without a user_id extra field always pass.
+    """
+    
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+        self.sampled_out = 0
+    
+    def filter(self, record):
+        user_id = getattr(record, 'user_id', None)
+        if self.rate >= 1 or user_id is None:
+            return True
+        # Low bits of a Fibonacci hash, independent of the top bits partition_of uses
+        if (user_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFF < self.rate * 0x100000000:
+            return True
+        self.sampled_out += 1
+        return False
+
+_log_listener = None
+log_queue_handler = None
+
+def configure_logging(fmt=None, level=None, stream=None, queue_size=None):
+    """Point the root logger at stream (stderr), through a writer thread unless queue_size is 0
+
+    Replaces earlier handlers, so it can be called again to reconfigure.
+    """
+    global _log_listener, log_queue_handler
+    fmt = fmt or LOG_FORMAT
+    queue_size = LOG_QUEUE_SIZE if queue_size is None else queue_size
+    
+    root = logging.getLogger()
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    
+    stream_handler = logging.StreamHandler(stream)
+    stream_handler.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(LOG_TEXT_FORMAT))
+    if queue_size > 0:
+        log_queue_handler = DeferredQueueHandler(Queue(queue_size))
+        _log_listener = QueueListener(log_queue_handler.queue, stream_handler)
+        _log_listener.start()
+        root.addHandler(log_queue_handler)
+    else:
+        log_queue_handler = None
+        root.addHandler(stream_handler)
+    root.setLevel(level or LOG_LEVEL)
+
+def stop_logging():
+    """Write out records still queued and stop the writer thread"""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+configure_logging()
+atexit.register(stop_logging)
 logger = logging.getLogger(__name__)
+# Per-click records, sampled per user
+click_logger = logging.getLogger(f'{__name__}.clicks')
+click_sampler = UserSampleFilter(LOG_CLICK_SAMPLE_RATE)
+click_logger.addFilter(click_sampler)
 
 # Use a relative path for the database
-DB_PATH = "airdrop_bot.db"
+DB_PATH = os.getenv('DB_PATH', "airdrop_bot.db")
+
+# Storage tuning
+DB_READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', '4'))
+DB_STATEMENT_CACHE_SIZE = 128
+DB_BUSY_TIMEOUT_MS = 5000
+
+# Write durability: 'batched' coalesces writes and commits them together every
+# DB_BATCH_MAX_DELAY seconds or DB_BATCH_MAX_SIZE writes, 'strict' commits
+# (with a full fsync) before every click is acknowledged
+DB_DURABILITY = os.getenv('DB_DURABILITY', 'batched')
+DB_BATCH_MAX_SIZE = int(os.getenv('DB_BATCH_MAX_SIZE', '500'))
+DB_BATCH_MAX_DELAY = float(os.getenv('DB_BATCH_MAX_DELAY', '0.05'))
+
+# Database maintenance (see DatabaseMaintenance): snapshots every
+# MAINTENANCE_BACKUP_INTERVAL hours into MAINTENANCE_BACKUP_DIR (empty turns
+# them off), WAL checkpoints every MAINTENANCE_CHECKPOINT_INTERVAL seconds,
+# archiving, vacuum and ANALYZE daily at MAINTENANCE_HOUR (UTC). Users inactive
+# for ARCHIVE_INACTIVE_DAYS days are archived, 0 keeps everyone.
+MAINTENANCE_HOUR = int(os.getenv('MAINTENANCE_HOUR', '4'))
+MAINTENANCE_BACKUP_DIR = os.getenv('MAINTENANCE_BACKUP_DIR', 'backups')
+MAINTENANCE_BACKUP_INTERVAL = float(os.getenv('MAINTENANCE_BACKUP_INTERVAL', '6'))
+MAINTENANCE_BACKUP_KEEP = int(os.getenv('MAINTENANCE_BACKUP_KEEP', '4'))
+MAINTENANCE_CHECKPOINT_INTERVAL = float(os.getenv('MAINTENANCE_CHECKPOINT_INTERVAL', '600'))
+MAINTENANCE_VACUUM_STEP = 1000
+# PRAGMA auto_vacuum reports incremental vacuum as 2
+AUTO_VACUUM_INCREMENTAL = 2
+MAINTENANCE_ANALYSIS_LIMIT = 1000
+ARCHIVE_INACTIVE_DAYS = int(os.getenv('ARCHIVE_INACTIVE_DAYS', '0'))
+
+# Update ingestion: 'polling' (default) or 'webhook'
+UPDATE_MODE = os.getenv('UPDATE_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', os.getenv('PORT', '8443')))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN', '')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+WEBHOOK_MAX_PENDING = int(os.getenv('WEBHOOK_MAX_PENDING', '1000'))
+
+# Polling confirms updates to Telegram only once they are handled and saves the
+# handled offset with every commit of queued writes (and at least every
+# UPDATE_OFFSET_SAVE_INTERVAL seconds), so a restart resumes where the last run
+# stopped instead of dropping waiting updates
+POLL_TIMEOUT = int(os.getenv('POLL_TIMEOUT', '10'))
+POLL_MAX_UNCONFIRMED = 100
+POLL_REFETCH_DELAY = 0.2
+UPDATE_OFFSET_SAVE_INTERVAL = float(os.getenv('UPDATE_OFFSET_SAVE_INTERVAL', '1.0'))
+
+# Scale-out: 'sqlite' keeps state in DB_PATH, the URL of a state server
+# (python bot.py state-server) shares it between workers. With WORKER_PEERS
+# set to the webhook URLs of all workers in index order, each user is handled
+# by one worker and updates arriving elsewhere are forwarded to it.
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'sqlite')
+STATE_SERVER_LISTEN = os.getenv('STATE_SERVER_LISTEN', '0.0.0.0')
+STATE_SERVER_PORT = int(os.getenv('STATE_SERVER_PORT', '8600'))
+STATE_SERVER_TOKEN = os.getenv('STATE_SERVER_TOKEN', '')
+STATE_RPC_TIMEOUT = float(os.getenv('STATE_RPC_TIMEOUT', '10'))
+WORKER_INDEX = int(os.getenv('WORKER_INDEX', '0'))
+WORKER_PEERS = [url.strip() for url in os.getenv('WORKER_PEERS', '').split(',') if url.strip()]
+
+# Update dispatching: handlers for different users run concurrently,
+# each user's updates run one at a time
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '256'))
+MAX_QUEUED_CALLBACKS_PER_USER = int(os.getenv('MAX_QUEUED_CALLBACKS_PER_USER', '2'))
+# A click repeating the last button clicked on the same message within this
+# many seconds (a double-tap or a redelivered update) is answered and ignored
+CALLBACK_REPEAT_WINDOW = float(os.getenv('CALLBACK_REPEAT_WINDOW', '2.0'))
+CALLBACK_REPEAT_TRACKED = 100000
+# Messages whose last shown screen is remembered to skip edits that change nothing
+SHOWN_SCREENS_TRACKED = 100000
+# Seconds a confirmation ("Task 2 Verified!") stays up before the next screen
+SCREEN_TRANSITION_DELAY = float(os.getenv('SCREEN_TRANSITION_DELAY', '1.0'))
+
+# Outbound Telegram limits (messages per second)
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', '30'))
+SEND_PER_CHAT_RATE = float(os.getenv('SEND_PER_CHAT_RATE', '1'))
+SEND_PER_CHAT_BURST = int(os.getenv('SEND_PER_CHAT_BURST', '3'))
+SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', '3'))
+
+# Admin broadcasts
+BROADCAST_CHUNK_SIZE = int(os.getenv('BROADCAST_CHUNK_SIZE', '200'))
+BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', '16'))
+
+# Funnel analytics: events are buffered and inserted in batches, rollups
+# for /funnel are brought up to date every FUNNEL_ROLLUP_INTERVAL seconds
+EVENT_BATCH_MAX_SIZE = int(os.getenv('EVENT_BATCH_MAX_SIZE', '1000'))
+EVENT_BATCH_MAX_DELAY = float(os.getenv('EVENT_BATCH_MAX_DELAY', '1.0'))
+EVENT_BUFFER_LIMIT = int(os.getenv('EVENT_BUFFER_LIMIT', '100000'))
+FUNNEL_ROLLUP_INTERVAL = float(os.getenv('FUNNEL_ROLLUP_INTERVAL', '60'))
+FUNNEL_ROLLUP_BATCH_SIZE = 5000
+FUNNEL_COHORT_HOURS = 24
+
+# Abuse scoring: users beyond ABUSE_TRACKED_USERS evict the least recently
+# seen ones; refused actions add ABUSE_POINTS to a decaying score and users
+# reaching ABUSE_FLAG_SCORE are recorded in user_flags
+ABUSE_TRACKED_USERS = int(os.getenv('ABUSE_TRACKED_USERS', '100000'))
+ABUSE_SET_WAYS = 4
+ABUSE_CLICK_WINDOW = 10.0
+ABUSE_MAX_CLICKS = int(os.getenv('ABUSE_MAX_CLICKS', '30'))
+ABUSE_MIN_VERIFY_INTERVAL = float(os.getenv('ABUSE_MIN_VERIFY_INTERVAL', '2.0'))
+ABUSE_MAX_RESETS_PER_HOUR = int(os.getenv('ABUSE_MAX_RESETS_PER_HOUR', '3'))
+ABUSE_FLAG_SCORE = float(os.getenv('ABUSE_FLAG_SCORE', '10'))
+ABUSE_SCORE_HALF_LIFE = 3600.0
+ABUSE_POINTS = {'click': 1, 'verify': 2, 'reset': 3, 'wallet_reuse': 5}
+
+# Membership checks for the group and channel tasks (getChatMember)
+TASK_GROUP_CHAT_ID = os.getenv('TASK_GROUP_CHAT_ID')
+TASK_CHANNEL_CHAT_ID = os.getenv('TASK_CHANNEL_CHAT_ID')
+MEMBERSHIP_CACHE_TTL = float(os.getenv('MEMBERSHIP_CACHE_TTL', '300'))
+MEMBERSHIP_NEGATIVE_TTL = float(os.getenv('MEMBERSHIP_NEGATIVE_TTL', '5'))
+MEMBERSHIP_CHECK_RATE = float(os.getenv('MEMBERSHIP_CHECK_RATE', '20'))
+MEMBERSHIP_MAX_CONCURRENT = 10
+MEMBERSHIP_CACHE_SIZE = 100000
+
+# Per-task completion counters are kept for this many tasks, which is also
+# the most tasks a config may define
+STATS_TASK_BITS = 32
+
+# Progress cache sizing
+PROGRESS_CACHE_SIZE = int(os.getenv('PROGRESS_CACHE_SIZE', '10000'))
+PROGRESS_CACHE_TTL = float(os.getenv('PROGRESS_CACHE_TTL', '600'))
+
+# Metrics endpoint (Prometheus text format), METRICS_PORT=0 turns it off
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))
 
 # Task configuration
-TASKS = [
+# Tasks, admins and message templates are read from CONFIG_PATH (YAML or JSON)
+# when that file exists, otherwise the defaults below are used. The file is
+# re-read when it changes and on /reload.
+CONFIG_PATH = os.getenv('CONFIG_PATH', 'airdrop_config.yaml')
+CONFIG_RELOAD_INTERVAL = float(os.getenv('CONFIG_RELOAD_INTERVAL', '5'))
+
+DEFAULT_TASKS = [
     {
         'id': 1,
         'name': 'Join Group',
         'description': 'Join our Telegram Group',
         'url': 'https://t.me/+UpEih_OErhA5YWZh',
+        'chat_id': TASK_GROUP_CHAT_ID,
         'button_text': '✅ Joined Group',
         'verification_text': 'Click below after joining'
     },
@@ -31,6 +298,7 @@ TASKS = [
         'name': 'Join Channel',
         'description': 'Join our Telegram Channel',
         'url': 'https://t.me/+aCyF_M3PeV42OWIx',
+        'chat_id': TASK_CHANNEL_CHAT_ID,
         'button_text': '✅ Joined Channel',
         'verification_text': 'Click below after joining'
     },
@@ -60,204 +328,13 @@ TASKS = [
     }
 ]
 
-ADMINS = ['@dallen32', '@joyouschrs']
-
-# Database setup
-def init_db():
-    """Initialize SQLite database"""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
-        # Create users table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            current_step INTEGER DEFAULT 1,
-            task1_completed INTEGER DEFAULT 0,
-            task2_completed INTEGER DEFAULT 0,
-            task3_completed INTEGER DEFAULT 0,
-            task4_completed INTEGER DEFAULT 0,
-            task5_completed INTEGER DEFAULT 0,
-            wallet_address TEXT,
-            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-        
-        # Create indexes
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_id ON users(user_id)')
-        
-        conn.commit()
-        logger.info(f"Database initialized successfully at {DB_PATH}")
-    except Exception as e:
-        logger.error(f"Database initialization error: {e}")
-        raise
-    finally:
-        if 'conn' in locals():
-            conn.close()
-
-def get_db_connection():
-    """Get database connection"""
-    return sqlite3.connect(DB_PATH)
-
-class UserManager:
-    """Manages user data and progress"""
-    
-    @staticmethod
-    def get_or_create_user(user_id, username, first_name):
-        """Get existing user or create new one"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        try:
-            # Check if user exists
-            cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-            user = cursor.fetchone()
-            
-            if not user:
-                # Create new user
-                cursor.execute('''
-                INSERT INTO users (user_id, username, first_name, joined_at, last_active)
-                VALUES (?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                ''', (user_id, username, first_name))
-                conn.commit()
-                logger.info(f"New user created: {user_id} (@{username})")
-            else:
-                # Update last active
-                cursor.execute('''
-                UPDATE users SET last_active = CURRENT_TIMESTAMP, username = ?, first_name = ?
-                WHERE user_id = ?
-                ''', (username, first_name, user_id))
-                conn.commit()
-            
-            return True
-        except Exception as e:
-            logger.error(f"Error in get_or_create_user: {e}")
-            return False
-        finally:
-            conn.close()
-    
-    @staticmethod
-    def get_user_progress(user_id):
-        """Get user's current progress"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-            SELECT current_step, task1_completed, task2_completed, task3_completed, 
-                   task4_completed, task5_completed, wallet_address
-            FROM users WHERE user_id = ?
-            ''', (user_id,))
-            
-            result = cursor.fetchone()
-            if result:
-                return {
-                    'current_step': result[0],
-                    'tasks_completed': [bool(result[i]) for i in range(1, 6)],
-                    'wallet_address': result[6]
-                }
-            return None
-        except Exception as e:
-            logger.error(f"Error getting user progress: {e}")
-            return None
-        finally:
-            conn.close()
-    
-    @staticmethod
-    def update_user_step(user_id, step):
-        """Update user's current step"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-            UPDATE users SET current_step = ?, last_active = CURRENT_TIMESTAMP
-            WHERE user_id = ?
-            ''', (step, user_id))
-            conn.commit()
-            return True
-        except Exception as e:
-            logger.error(f"Error updating user step: {e}")
-            return False
-        finally:
-            conn.close()
-    
-    @staticmethod
-    def mark_task_completed(user_id, task_num):
-        """Mark a specific task as completed"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute(f'''
-            UPDATE users SET task{task_num}_completed = 1, last_active = CURRENT_TIMESTAMP
-            WHERE user_id = ?
-            ''', (user_id,))
-            
-            # Also update current_step to next task
-            if task_num < 5:
-                cursor.execute('''
-                UPDATE users SET current_step = ? WHERE user_id = ? AND current_step = ?
-                ''', (task_num + 1, user_id, task_num))
-            
-            conn.commit()
-            return True
-        except Exception as e:
-            logger.error(f"Error marking task completed: {e}")
-            return False
-        finally:
-            conn.close()
-    
-    @staticmethod
-    def reset_user_progress(user_id):
-        """Reset user's progress"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-            UPDATE users SET 
-                current_step = 1,
-                task1_completed = 0,
-                task2_completed = 0,
-                task3_completed = 0,
-                task4_completed = 0,
-                task5_completed = 0,
-                wallet_address = NULL,
-                last_active = CURRENT_TIMESTAMP
-            WHERE user_id = ?
-            ''', (user_id,))
-            conn.commit()
-            return True
-        except Exception as e:
-            logger.error(f"Error resetting user progress: {e}")
-            return False
-        finally:
-            conn.close()
+DEFAULT_ADMINS = ['@dallen32', '@joyouschrs']
 
-# Bot Handlers
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /start command"""
-    user = update.effective_user
-    user_id = user.id
-    username = user.username or "NoUsername"
-    first_name = user.first_name or "User"
-    
-    logger.info(f"User {user_id} (@{username}) started the bot")
-    
-    # Register user
-    UserManager.get_or_create_user(user_id, username, first_name)
-    
-    # Get user progress
-    progress = UserManager.get_user_progress(user_id)
-    current_step = progress['current_step'] if progress else 1
-    
-    # Welcome message
-    welcome_text = """
+# Message templates; {task_count}, {admins} ("@a or @b"), {admin_list} (one
+# admin per line) are filled in when the config is loaded, {username} when
+# the message is sent
+DEFAULT_MESSAGES = {
+    'welcome': """
 🤖 *Welcome to Freequency Airdrop Bot* 🤖
 
 💰 *Earn 100 FREQC tokens* by completing simple social tasks!
@@ -271,124 +348,33 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 *Note:* Tasks must be completed sequentially. You cannot skip any task.
 
 Click below to begin! 👇
-"""
-    
-    keyboard = [
-        [InlineKeyboardButton("🚀 Start Tasks", callback_data="start_tasks")],
-        [InlineKeyboardButton("📊 My Progress", callback_data="check_progress")]
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(
-        welcome_text,
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
-
-async def show_task_screen(update: Update, context: ContextTypes.DEFAULT_TYPE, task_number: int, user_id: int = None):
-    """Display a specific task to user"""
-    if not user_id:
-        user_id = update.effective_user.id
-    
-    if update.callback_query:
-        query = update.callback_query
-        await query.answer()
-    
-    if task_number > len(TASKS):
-        await show_completion_screen(update, context, user_id)
-        return
-    
-    task = TASKS[task_number - 1]
-    progress = UserManager.get_user_progress(user_id)
-    
-    if not progress:
-        await context.bot.send_message(
-            chat_id=user_id,
-            text="❌ Please use /start to begin the airdrop."
-        )
-        return
-    
-    # Create progress summary
-    completed_tasks = progress['tasks_completed']
-    completed_count = sum(completed_tasks)
-    total_tasks = len(TASKS)
-    
-    progress_text = "📊 *Your Progress:*\n"
-    for i, t in enumerate(TASKS, 1):
-        status = "✅" if completed_tasks[i-1] else "⭕"
-        current = "📍" if i == task_number else ""
-        progress_text += f"{current} {status} Task {i}: {t['name']}\n"
-    
-    progress_text += f"\n✅ Completed: {completed_count}/{total_tasks}"
-    
-    # Task message
-    message = f"""
-💰 *Task {task_number}: {task['name']}*
-
-{task['description']}
+""",
+    'help': """
+🤖 *Freequency Airdrop Bot Help*
 
-{task['verification_text']}
+*Available Commands:*
+/start - Start or resume the airdrop
+/progress - Check your current progress
+/help - Show this help message
+/reset - Reset your progress (start over)
 
-{progress_text}
+*How it works:*
+1. Complete {task_count} social tasks in order
+2. Each task must be verified before next
+3. After all tasks, contact admins with proof
+4. Receive 100 FREQC tokens
 
-*Remember:* Complete this task first, then click verification button.
-"""
-    
-    # Create buttons
-    keyboard = [
-        [InlineKeyboardButton("🔗 Open Link", url=task['url'])],
-        [InlineKeyboardButton(task['button_text'], callback_data=f"verify_{task_number}")]
-    ]
-    
-    # Navigation buttons
-    nav_buttons = []
-    if task_number > 1:
-        nav_buttons.append(InlineKeyboardButton("◀️ Previous", callback_data=f"task_{task_number-1}"))
-    
-    if task_number < len(TASKS):
-        nav_buttons.append(InlineKeyboardButton("Next ▶️", callback_data=f"task_{task_number+1}"))
-    else:
-        nav_buttons.append(InlineKeyboardButton("🏁 Finish", callback_data="finish_all"))
-    
-    if nav_buttons:
-        keyboard.append(nav_buttons)
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    # Send or edit message
-    try:
-        if update.callback_query:
-            await update.callback_query.edit_message_text(
-                text=message,
-                reply_markup=reply_markup,
-                parse_mode='Markdown',
-                disable_web_page_preview=True
-            )
-        else:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=message,
-                reply_markup=reply_markup,
-                parse_mode='Markdown',
-                disable_web_page_preview=True
-            )
-    except Exception as e:
-        logger.error(f"Error showing task screen: {e}")
+*Contact Admins for help:*
+{admins}
 
-async def show_completion_screen(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int = None):
-    """Show completion screen after all tasks"""
-    if not user_id:
-        user_id = update.effective_user.id
-    
-    if update.callback_query:
-        query = update.callback_query
-        await query.answer()
-    
-    user = update.effective_user
-    username = user.username or "NoUsername"
-    
-    completion_message = f"""
+Good luck! 🚀
+""",
+    'wallet_saved': (
+        "✅ *Wallet address saved!*\n\n"
+        "Now please send your task completion screenshots to our admins:\n"
+        "{admin_list}"
+    ),
+    'completion': """
 🎉 *CONGRATULATIONS! ALL TASKS COMPLETED!* 🎉
 
 ✅ You have successfully completed all social tasks!
@@ -404,12 +390,11 @@ async def show_completion_screen(update: Update, context: ContextTypes.DEFAULT_T
 3. 📤 *Contact our admins* with the proof:
 
 *Admins to Contact:*
-{ADMINS[0]}
-{ADMINS[1]}
+{admin_list}
 
 *Send them this information:*
 • Your Telegram: @{username}
-• Screenshot proofs of all 5 tasks
+• Screenshot proofs of all {task_count} tasks
 • Your wallet address
 
 ---
@@ -420,309 +405,4909 @@ async def show_completion_screen(update: Update, context: ContextTypes.DEFAULT_T
 - Processing time: 24-48 hours
 
 *Thank you for participating in Freequency Airdrop!* 🚀
-"""
+""",
+}
+
+TASK_FIELDS = ('name', 'description', 'url', 'button_text', 'verification_text')
+
+# The campaign whose progress lives in the users table; its tasks are the
+# top-level 'tasks' of the config and its buttons carry no campaign prefix
+MAIN_CAMPAIGN = 'main'
+CAMPAIGN_KEY_PATTERN = re.compile(r'^[a-z0-9_-]{1,16}$')
+
+class ConfigError(ValueError):
+    """Raised when the task config file is missing fields or malformed"""
+
+class Campaign(NamedTuple):
+    """One airdrop: its tasks in order and the messages filled in for them"""
+    key: str
+    name: str
+    tasks: tuple
+    messages: MappingProxyType
+
+class AirdropConfig(NamedTuple):
+    """Validated, immutable task configuration
+
+    tasks is a tuple of read-only task mappings in order, task id N at index
+    N - 1, and messages holds the templates with everything but {username}
+    filled in. Both belong to the main campaign; campaigns maps every
+    campaign key, the main one included, to its Campaign, and
+    default_campaign is the one a plain /start enters.
+    """
+    tasks: tuple
+    admins: tuple
+    messages: MappingProxyType
+    path: str = None
+    mtime: int = None
+    campaigns: MappingProxyType = MappingProxyType({})
+    default_campaign: str = MAIN_CAMPAIGN
+
+def _compile_tasks(raw_tasks, where=''):
+    if not isinstance(raw_tasks, list) or not 1 <= len(raw_tasks) <= STATS_TASK_BITS:
+        raise ConfigError(f"{where}'tasks' must be a list of 1 to {STATS_TASK_BITS} tasks")
+    tasks = []
+    for task_id, task in enumerate(raw_tasks, 1):
+        if not isinstance(task, dict):
+            raise ConfigError(f"{where}task {task_id} must be a mapping")
+        unknown = set(task) - {'id', 'chat_id', *TASK_FIELDS}
+        if unknown:
+            raise ConfigError(f"{where}task {task_id}: unknown keys {', '.join(sorted(unknown))}")
+        # The id is the task's bit in tasks_mask, so it can never move
+        if task.get('id', task_id) != task_id:
+            raise ConfigError(f"{where}task {task_id}: id is {task['id']!r}, tasks must be listed in id order starting at 1")
+        missing = [field for field in TASK_FIELDS if not isinstance(task.get(field), str) or not task[field].strip()]
+        if missing:
+            raise ConfigError(f"{where}task {task_id}: missing {', '.join(missing)}")
+        if not task['url'].startswith(('https://', 'http://', 'tg://')):
+            raise ConfigError(f"{where}task {task_id}: url must be an http(s) or tg:// link")
+        if not isinstance(task.get('chat_id'), (str, int, type(None))):
+            raise ConfigError(f"{where}task {task_id}: chat_id must be a chat id or @username")
+        tasks.append(MappingProxyType({'id': task_id, **task, 'chat_id': task.get('chat_id')}))
+    return tuple(tasks)
+
+def _compile_messages(templates, base, task_count, admins, where=''):
+    templates = templates or {}
+    if not isinstance(templates, dict):
+        raise ConfigError(f"{where}'messages' must be a mapping")
+    unknown = set(templates) - set(DEFAULT_MESSAGES)
+    if unknown:
+        raise ConfigError(f"{where}unknown messages: {', '.join(sorted(unknown))}")
+    fields = {
+        'task_count': task_count,
+        'admins': ' or '.join(admins),
+        'admin_list': '\n'.join(admins),
+        'username': '{username}',
+    }
+    messages = {}
+    for name, template in {**base, **templates}.items():
+        if not isinstance(template, str):
+            raise ConfigError(f"{where}message {name!r} must be a string")
+        try:
+            messages[name] = template.format(**fields)
+        except (KeyError, IndexError, ValueError) as e:
+            raise ConfigError(f"{where}message {name!r}: invalid placeholder {e}")
+    return MappingProxyType(messages)
+
+def compile_config(raw, path=None, mtime=None):
+    """Validate a parsed config and build the AirdropConfig for it"""
+    if not isinstance(raw, dict):
+        raise ConfigError("config must be a mapping with 'tasks' and 'admins'")
+    unknown = set(raw) - {'tasks', 'admins', 'messages', 'campaigns', 'default_campaign'}
+    if unknown:
+        raise ConfigError(f"unknown config keys: {', '.join(sorted(unknown))}")
     
-    keyboard = [
-        [InlineKeyboardButton("📤 Contact Admin 1", url=f"https://t.me/{ADMINS[0].replace('@', '')}")],
-        [InlineKeyboardButton("📤 Contact Admin 2", url=f"https://t.me/{ADMINS[1].replace('@', '')}")],
-        [InlineKeyboardButton("🔄 Restart Airdrop", callback_data="restart_airdrop")]
-    ]
+    admins = raw.get('admins')
+    if not isinstance(admins, list) or not admins or not all(
+        isinstance(admin, str) and admin.startswith('@') and len(admin) > 1 for admin in admins
+    ):
+        raise ConfigError("'admins' must be a non-empty list of @usernames")
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    tasks = _compile_tasks(raw.get('tasks'))
+    templates = raw.get('messages') or {}
+    messages = _compile_messages(templates, DEFAULT_MESSAGES, len(tasks), admins)
+    campaigns = {MAIN_CAMPAIGN: Campaign(MAIN_CAMPAIGN, MAIN_CAMPAIGN, tasks, messages)}
     
-    try:
-        if update.callback_query:
-            await update.callback_query.edit_message_text(
-                text=completion_message,
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-        else:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=completion_message,
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
+    raw_campaigns = raw.get('campaigns') or {}
+    if not isinstance(raw_campaigns, dict):
+        raise ConfigError("'campaigns' must be a mapping of campaign key to campaign")
+    for key, campaign in raw_campaigns.items():
+        if not isinstance(key, str) or not CAMPAIGN_KEY_PATTERN.match(key) or key == MAIN_CAMPAIGN:
+            raise ConfigError(
+                f"campaign key {key!r} must be 1 to 16 of a-z, 0-9, _ and - and not {MAIN_CAMPAIGN!r}"
             )
-    except Exception as e:
-        logger.error(f"Error showing completion screen: {e}")
+        where = f"campaign {key}: "
+        if not isinstance(campaign, dict):
+            raise ConfigError(f"{where}must be a mapping with 'tasks'")
+        unknown = set(campaign) - {'name', 'tasks', 'messages'}
+        if unknown:
+            raise ConfigError(f"{where}unknown keys {', '.join(sorted(unknown))}")
+        name = campaign.get('name', key)
+        if not isinstance(name, str) or not name.strip():
+            raise ConfigError(f"{where}'name' must be a non-empty string")
+        campaign_tasks = _compile_tasks(campaign.get('tasks'), where)
+        # Campaign messages override the top-level templates, which override the defaults
+        campaign_messages = _compile_messages(
+            campaign.get('messages'), {**DEFAULT_MESSAGES, **templates}, len(campaign_tasks), admins, where
+        )
+        campaigns[key] = Campaign(key, name, campaign_tasks, campaign_messages)
+    
+    default_campaign = raw.get('default_campaign', MAIN_CAMPAIGN)
+    if default_campaign not in campaigns:
+        raise ConfigError(f"'default_campaign' {default_campaign!r} is not a campaign")
+    
+    return AirdropConfig(
+        tasks, tuple(admins), messages, path, mtime, MappingProxyType(campaigns), default_campaign
+    )
 
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+def _read_config_file(path):
+    with open(path, encoding='utf-8') as f:
+        if not path.endswith(('.yaml', '.yml')):
+            return json.load(f)
+        try:
+            import yaml
+        except ImportError:
+            raise ConfigError("PyYAML is needed for YAML config files (pip install PyYAML), or use JSON")
+        return yaml.safe_load(f)
+
+def load_config(path=None):
+    """Load and compile the config file, or the defaults if the file does not exist"""
+    path = path or CONFIG_PATH
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return compile_config({'tasks': DEFAULT_TASKS, 'admins': DEFAULT_ADMINS})
+    try:
+        raw = _read_config_file(path)
+    except ConfigError:
+        raise
+    except Exception as e:
+        raise ConfigError(f"cannot parse {path}: {e}")
+    return compile_config(raw, path, mtime)
+
+def apply_config(config):
+    """Swap in a new config for all handlers at once
+
+    The globals are replaced without yielding to the event loop, so no
+    handler sees a mix of the old and new config at any await.
+    """
+    global CONFIG, TASKS, ADMINS, MESSAGES
+    tasks_changed = (
+        {key: len(campaign.tasks) for key, campaign in config.campaigns.items()}
+        != {key: len(campaign.tasks) for key, campaign in CONFIG.campaigns.items()}
+    )
+    CONFIG, TASKS, ADMINS, MESSAGES = config, config.tasks, config.admins, config.messages
+    invalidate_render_cache()
+    if tasks_changed:
+        # Cached progress holds one completion flag per task
+        progress_cache.clear()
+
+async def reload_config(path=None):
+    """Re-read the config file in a worker thread and apply it, raises ConfigError if invalid"""
+    config = await asyncio.to_thread(load_config, path)
+    apply_config(config)
+    logger.info(
+        "Loaded %s campaigns, %s main tasks and %s admins from %s",
+        len(config.campaigns), len(config.tasks), len(config.admins), config.path or 'defaults'
+    )
+    return config
+
+async def watch_config(interval=CONFIG_RELOAD_INTERVAL):
+    """Reload the config whenever its file changes"""
+    rejected_mtime = None
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            mtime = os.stat(CONFIG_PATH).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        if mtime == CONFIG.mtime or mtime == rejected_mtime:
+            continue
+        try:
+            await reload_config()
+        except Exception as e:
+            # Keep serving with the current config until the file is fixed
+            rejected_mtime = mtime
+            logger.error("Ignoring invalid config %s: %s", CONFIG_PATH, e)
+
+CONFIG = load_config()
+TASKS, ADMINS, MESSAGES = CONFIG.tasks, CONFIG.admins, CONFIG.messages
+
+def get_campaign(campaign):
+    """Configured Campaign of a key, the main one if a reload has removed it
+
+    Handlers check the campaign of a click when it arrives, but a reload can
+    land at any await after that; everything past the check looks campaigns
+    up through here instead of indexing CONFIG.campaigns.
+    """
+    return CONFIG.campaigns.get(campaign) or CONFIG.campaigns[MAIN_CAMPAIGN]
+
+# Wallet validation
+# Addresses are checked locally against their checksums: EIP-55 for mixed
+# case EVM addresses, bech32/bech32m for native segwit and Cardano, and
+# base58check for legacy Bitcoin and TRON.
+
+def _keccak_round_constants():
+    constants = []
+    lfsr = 1
+    for _ in range(24):
+        constant = 0
+        for j in range(7):
+            lfsr = ((lfsr << 1) ^ ((lfsr >> 7) * 0x71)) & 0xFF
+            if lfsr & 2:
+                constant |= 1 << ((1 << j) - 1)
+        constants.append(constant)
+    return constants
+
+_KECCAK_ROUND_CONSTANTS = _keccak_round_constants()
+# Rotation offsets of lane x + 5 * y
+_KECCAK_ROTATIONS = [
+    0, 1, 62, 28, 27, 36, 44, 6, 55, 20, 3, 10, 43, 25, 39,
+    41, 45, 15, 21, 8, 18, 2, 61, 56, 14
+]
+# (source lane, rotation, destination lane) of the combined rho and pi steps
+_KECCAK_RHO_PI = [
+    (x + 5 * y, _KECCAK_ROTATIONS[x + 5 * y], y + 5 * ((2 * x + 3 * y) % 5))
+    for x in range(5) for y in range(5)
+]
+_KECCAK_MASK = (1 << 64) - 1
+
+def _keccak_f1600(lanes):
+    mask = _KECCAK_MASK
+    rotated = [0] * 25
+    for round_constant in _KECCAK_ROUND_CONSTANTS:
+        parity = [lanes[x] ^ lanes[x + 5] ^ lanes[x + 10] ^ lanes[x + 15] ^ lanes[x + 20] for x in range(5)]
+        d = [
+            parity[(x - 1) % 5] ^ (((parity[(x + 1) % 5] << 1) | (parity[(x + 1) % 5] >> 63)) & mask)
+            for x in range(5)
+        ]
+        for source, offset, target in _KECCAK_RHO_PI:
+            lane = lanes[source] ^ d[source % 5]
+            rotated[target] = ((lane << offset) | (lane >> (64 - offset))) & mask
+        for y in range(0, 25, 5):
+            a, b, c, e, f = rotated[y:y + 5]
+            lanes[y:y + 5] = [a ^ (~b & c), b ^ (~c & e), c ^ (~e & f), e ^ (~f & a), f ^ (~a & b)]
+        lanes[0] ^= round_constant
+
+def keccak256(data):
+    """Keccak-256 as used by Ethereum (hashlib's sha3_256 pads differently)"""
+    rate = 136
+    padded = bytearray(data) + b'\x01' + b'\x00' * (rate - 1 - len(data) % rate)
+    padded[-1] |= 0x80
+    lanes = [0] * 25
+    for offset in range(0, len(padded), rate):
+        for i in range(rate // 8):
+            lanes[i] ^= int.from_bytes(padded[offset + i * 8:offset + i * 8 + 8], 'little')
+        _keccak_f1600(lanes)
+    return b''.join(lane.to_bytes(8, 'little') for lane in lanes[:4])
+
+_HEX_DIGITS = frozenset('0123456789abcdefABCDEF')
+
+def _parse_evm_address(text):
+    digits = text[2:]
+    if len(digits) != 40 or not _HEX_DIGITS.issuperset(digits):
+        return None
+    lower = digits.lower()
+    # All-lowercase and all-uppercase addresses carry no checksum
+    if digits != lower and digits != digits.upper():
+        checksum = keccak256(lower.encode()).hex()
+        for char, nibble in zip(digits, checksum):
+            if char.isalpha() and char.isupper() != (int(nibble, 16) >= 8):
+                return None
+    return 'evm', '0x' + lower
+
+_BECH32_CHARSET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+_BECH32_VALUES = {char: value for value, char in enumerate(_BECH32_CHARSET)}
+_BECH32_CONST = 1
+_BECH32M_CONST = 0x2bc830a3
+
+def _bech32_polymod(values):
+    generator = (0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3)
+    checksum = 1
+    for value in values:
+        top = checksum >> 25
+        checksum = (checksum & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            if (top >> i) & 1:
+                checksum ^= generator[i]
+    return checksum
+
+def _bech32_decode(text, max_length=90):
+    """Split a bech32/bech32m string into (hrp, 5-bit data, checksum constant), None if invalid"""
+    if len(text) > max_length or (text != text.lower() and text != text.upper()):
+        return None
+    text = text.lower()
+    separator = text.rfind('1')
+    if separator < 1 or separator + 7 > len(text):
+        return None
+    hrp = text[:separator]
+    data = [_BECH32_VALUES.get(char, -1) for char in text[separator + 1:]]
+    if -1 in data:
+        return None
+    expanded_hrp = [ord(char) >> 5 for char in hrp] + [0] + [ord(char) & 31 for char in hrp]
+    return hrp, data[:-6], _bech32_polymod(expanded_hrp + data)
+
+def _convert_bits(data, from_bits, to_bits):
+    """Regroup data into to_bits wide values without padding, None if bits are left over"""
+    accumulator = bits = 0
+    result = []
+    for value in data:
+        accumulator = (accumulator << from_bits) | value
+        bits += from_bits
+        while bits >= to_bits:
+            bits -= to_bits
+            result.append((accumulator >> bits) & ((1 << to_bits) - 1))
+    if bits >= from_bits or (accumulator << (to_bits - bits)) & ((1 << to_bits) - 1):
+        return None
+    return result
+
+def _parse_segwit_address(text):
+    decoded = _bech32_decode(text)
+    if decoded is None or decoded[0] != 'bc' or not decoded[1]:
+        return None
+    hrp, data, constant = decoded
+    version, program = data[0], _convert_bits(data[1:], 5, 8)
+    if version > 16 or program is None or not 2 <= len(program) <= 40:
+        return None
+    if version == 0 and (constant != _BECH32_CONST or len(program) not in (20, 32)):
+        return None
+    if version > 0 and constant != _BECH32M_CONST:
+        return None
+    return 'btc', text.lower()
+
+def _parse_cardano_address(text):
+    # Shelley addresses are plain bech32 but longer than the 90 characters BIP-173 allows
+    decoded = _bech32_decode(text, max_length=128)
+    if decoded is None or decoded[0] != 'addr' or decoded[2] != _BECH32_CONST:
+        return None
+    if _convert_bits(decoded[1], 5, 8) is None:
+        return None
+    return 'cardano', text.lower()
+
+_BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+_BASE58_VALUES = {char: value for value, char in enumerate(_BASE58_ALPHABET)}
+# Version byte of 21-byte base58check payloads per chain
+_BASE58_VERSIONS = {0x00: 'btc', 0x05: 'btc', 0x41: 'tron'}
+
+def _parse_base58check_address(text):
+    if not 26 <= len(text) <= 35:
+        return None
+    number = 0
+    for char in text:
+        value = _BASE58_VALUES.get(char)
+        if value is None:
+            return None
+        number = number * 58 + value
+    leading_zeros = len(text) - len(text.lstrip('1'))
+    raw = b'\x00' * leading_zeros + number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    payload, checksum = raw[:-4], raw[-4:]
+    if len(payload) != 21 or hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4] != checksum:
+        return None
+    chain = _BASE58_VERSIONS.get(payload[0])
+    return (chain, text) if chain else None
+
+def parse_wallet_address(text):
+    """Validate a wallet address, returns (chain, normalized address) or None
+
+    The normalized form is what duplicate detection compares: lowercase for
+    hex and bech32 addresses, unchanged for case-sensitive base58 ones.
+    """
+    text = text.strip()
+    if text[:2] in ('0x', '0X'):
+        return _parse_evm_address(text)
+    prefix = text[:5].lower()
+    if prefix.startswith('bc1'):
+        return _parse_segwit_address(text)
+    if prefix == 'addr1':
+        return _parse_cardano_address(text)
+    if text[:1] in ('1', '3', 'T'):
+        return _parse_base58check_address(text)
+    return None
+
+# Metrics
+# Kept in memory and served in the Prometheus text format by MetricsServer.
+# Observing a histogram is a bisect and two additions, cheap enough for every
+# update; numbers other components already count are read at scrape time.
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class CounterMetric:
+    """Monotonic count per combination of label values"""
+    
+    kind = 'counter'
+    
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = defaultdict(int)
+    
+    def inc(self, *label_values, amount=1):
+        self._values[label_values] += amount
+    
+    def samples(self):
+        for label_values, value in sorted(self._values.items()):
+            yield self.name, _format_labels(self.labels, label_values), value
+
+class HistogramMetric:
+    """Bucketed distribution of observed values per combination of label values
+
+    Each series keeps one count per bucket plus the sum; the cumulative
+    counts Prometheus expects are only computed when scraped.
+    """
+    
+    kind = 'histogram'
+    
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}
+    
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+        # Bucket counts, then the sum in the last slot
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+    
+    def samples(self):
+        for label_values, series in sorted(self._series.items()):
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = f'le="{_format_value(upper_bound)}"'
+                yield f'{self.name}_bucket', _format_labels(self.labels, label_values, le), cumulative
+            labels = _format_labels(self.labels, label_values)
+            yield f'{self.name}_sum', labels, series[-1]
+            yield f'{self.name}_count', labels, cumulative
+
+class CallbackMetric:
+    """Gauge or counter read from elsewhere when scraped
+
+    fn returns a number, or a dict mapping label values (a tuple, or a plain
+    value for a single label) to numbers.
+    """
+    
+    def __init__(self, name, help_text, fn, kind='gauge', labels=()):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.kind = kind
+        self.labels = labels
+    
+    def samples(self):
+        value = self.fn()
+        if not isinstance(value, dict):
+            yield self.name, '', value
+            return
+        for label_values, item in sorted(value.items()):
+            if not isinstance(label_values, tuple):
+                label_values = (label_values,)
+            yield self.name, _format_labels(self.labels, label_values), item
+
+class MetricsRegistry:
+    """Named metrics rendered together for /metrics; registering a name again replaces it"""
+    
+    def __init__(self):
+        self._metrics = {}
+    
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name, help_text, labels=()):
+        return self.register(CounterMetric(name, help_text, labels))
+    
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(HistogramMetric(name, help_text, labels, buckets))
+    
+    def callback(self, name, help_text, fn, kind='gauge', labels=()):
+        return self.register(CallbackMetric(name, help_text, fn, kind, labels))
+    
+    def render(self):
+        """The Prometheus text exposition of every metric"""
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.error("Error collecting metric %s: %s", metric.name, e)
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+HANDLER_SECONDS = metrics.histogram('airdrop_handler_seconds', 'Time spent in bot handlers', ('handler',))
+HANDLER_ERRORS = metrics.counter('airdrop_handler_errors_total', 'Handler calls that raised', ('handler',))
+STORE_SECONDS = metrics.histogram('airdrop_store_seconds', 'Time spent in UserManager methods, cache hits included', ('method',))
+TELEGRAM_API_SECONDS = metrics.histogram('airdrop_telegram_api_seconds', 'Bot API call latency, rate limiting excluded', ('endpoint',))
+TELEGRAM_API_ERRORS = metrics.counter('airdrop_telegram_api_errors_total', 'Bot API calls that failed', ('endpoint', 'error'))
+WRITES_SKIPPED = metrics.counter('airdrop_store_writes_skipped_total', 'Progress writes skipped because the state already matched', ('method',))
+SEND_WAIT_SECONDS = metrics.histogram('airdrop_send_wait_seconds', 'Time messages waited for the send rate limits', ('priority',))
+MAINTENANCE_SECONDS = metrics.histogram('airdrop_maintenance_seconds', 'Run time of database maintenance jobs', ('job',),
+                                        buckets=(0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0))
+MAINTENANCE_PAGES = metrics.counter('airdrop_maintenance_pages_reclaimed_total', 'Database pages freed by maintenance jobs', ('job',))
+
+def timed(histogram, errors=None):
+    """Decorator observing an async function's run time in histogram, labelled with its name"""
+    def decorator(fn):
+        name = fn.__name__
+        
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(name)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, name)
+        return wrapper
+    return decorator
+
+# Database setup
+
+# Completion state of the legacy per-task columns as a bitmask (bit 0 = task 1).
+# Rows written before the tasks_mask migration has reached them have
+# tasks_mask NULL and fall back to this expression.
+def _legacy_tasks_mask_sql(row=''):
+    return (
+        f'({row}task1_completed | ({row}task2_completed << 1) | ({row}task3_completed << 2)'
+        f' | ({row}task4_completed << 3) | ({row}task5_completed << 4))'
+    )
+
+LEGACY_TASKS_MASK_SQL = _legacy_tasks_mask_sql()
+TASKS_MASK_SQL = f'COALESCE(tasks_mask, {LEGACY_TASKS_MASK_SQL})'
+
+MIGRATION_BATCH_SIZE = int(os.getenv('MIGRATION_BATCH_SIZE', '2000'))
+MIGRATION_BATCH_PAUSE = 0.05
+MAX_USER_ID = 2 ** 63 - 1
+
+def _migrate_create_users(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        current_step INTEGER DEFAULT 1,
+        task1_completed INTEGER DEFAULT 0,
+        task2_completed INTEGER DEFAULT 0,
+        task3_completed INTEGER DEFAULT 0,
+        task4_completed INTEGER DEFAULT 0,
+        task5_completed INTEGER DEFAULT 0,
+        wallet_address TEXT,
+        joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_id ON users(user_id)')
+
+def _migrate_add_tasks_mask(conn):
+    # Only adds the column, existing rows are converted by the
+    # 'tasks_mask' backfill while the bot is running
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(users)')}
+    if 'tasks_mask' not in columns:
+        conn.execute('ALTER TABLE users ADD COLUMN tasks_mask INTEGER')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schema_backfills (
+        name TEXT PRIMARY KEY,
+        last_key INTEGER NOT NULL DEFAULT 0,
+        done INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO schema_backfills (name) VALUES ('tasks_mask')")
+
+def _migrate_create_broadcasts(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        broadcast_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        text TEXT NOT NULL,
+        created_by INTEGER,
+        status TEXT NOT NULL DEFAULT 'running',
+        last_user_id INTEGER NOT NULL DEFAULT 0,
+        sent INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+        broadcast_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        error TEXT,
+        PRIMARY KEY (broadcast_id, user_id)
+    ) WITHOUT ROWID
+    ''')
+
+def _migrate_create_stats(conn):
+    # Running aggregates for /stats, kept current by the triggers below
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stats_counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stats_task_completions (
+        task_bit INTEGER PRIMARY KEY,
+        completed INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS stats_daily (
+        day TEXT PRIMARY KEY,
+        signups INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    ''')
+    
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(users)')}
+    if 'completed_at' not in columns:
+        conn.execute('ALTER TABLE users ADD COLUMN completed_at TIMESTAMP')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_joined_at ON users(joined_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_completed_at ON users(completed_at)')
+    
+    # One pass over the existing rows to seed the aggregates
+    bits = range(STATS_TASK_BITS)
+    row = conn.execute(
+        'SELECT COUNT(*)' + ''.join(f', TOTAL(({TASKS_MASK_SQL} >> {bit}) & 1)' for bit in bits) + ' FROM users'
+    ).fetchone()
+    conn.execute("INSERT OR REPLACE INTO stats_counters (name, value) VALUES ('users', ?)", (row[0],))
+    conn.executemany(
+        'INSERT OR REPLACE INTO stats_task_completions (task_bit, completed) VALUES (?, ?)',
+        [(bit, int(row[bit + 1])) for bit in bits]
+    )
+    conn.execute('''
+    INSERT OR REPLACE INTO stats_daily (day, signups)
+    SELECT date(joined_at), COUNT(*) FROM users GROUP BY date(joined_at)
+    ''')
+    
+    old_mask = f'COALESCE(OLD.tasks_mask, {_legacy_tasks_mask_sql("OLD.")})'
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS stats_users_insert AFTER INSERT ON users
+    BEGIN
+        UPDATE stats_counters SET value = value + 1 WHERE name = 'users';
+        INSERT INTO stats_daily (day, signups) VALUES (date(NEW.joined_at), 1)
+            ON CONFLICT(day) DO UPDATE SET signups = signups + 1;
+        UPDATE stats_task_completions SET completed = completed + 1
+            WHERE (NEW.tasks_mask >> task_bit) & 1;
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS stats_users_delete AFTER DELETE ON users
+    BEGIN
+        UPDATE stats_counters SET value = value - 1 WHERE name = 'users';
+        UPDATE stats_task_completions SET completed = completed - 1
+            WHERE ({old_mask} >> task_bit) & 1;
+    END
+    ''')
+    conn.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS stats_users_tasks AFTER UPDATE OF tasks_mask ON users
+    WHEN NEW.tasks_mask IS NOT {old_mask}
+    BEGIN
+        UPDATE stats_task_completions
+            SET completed = completed + ((NEW.tasks_mask >> task_bit) & 1) - (({old_mask} >> task_bit) & 1)
+            WHERE (((NEW.tasks_mask | {old_mask}) - (NEW.tasks_mask & {old_mask})) >> task_bit) & 1;
+    END
+    ''')
+    conn.execute("INSERT OR IGNORE INTO schema_backfills (name) VALUES ('completed_at')")
+
+def _migrate_create_events(conn):
+    # Append-only event log, written by EventLog
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS events (
+        event_id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        step INTEGER,
+        created_at REAL NOT NULL
+    )
+    ''')
+    
+    # Rollups of events up to stats_counters 'funnel_last_event', see FunnelReport
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS funnel_users (
+        user_id INTEGER PRIMARY KEY,
+        started_hour INTEGER NOT NULL,
+        last_step_at REAL NOT NULL,
+        viewed_mask INTEGER NOT NULL DEFAULT 0,
+        verified_mask INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS funnel_steps (
+        task INTEGER PRIMARY KEY,
+        viewed INTEGER NOT NULL DEFAULT 0,
+        verified INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS funnel_durations (
+        task INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (task, bucket)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS funnel_cohorts (
+        hour INTEGER PRIMARY KEY,
+        started INTEGER NOT NULL DEFAULT 0,
+        completed INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    conn.executemany(
+        'INSERT OR IGNORE INTO stats_counters (name, value) VALUES (?, 0)',
+        [('funnel_last_event',), ('funnel_users',), ('funnel_starts',), ('funnel_resets',)]
+    )
+
+def _migrate_add_wallet_normalized(conn):
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(users)')}
+    if 'wallet_normalized' not in columns:
+        conn.execute('ALTER TABLE users ADD COLUMN wallet_normalized TEXT')
+    # One account per wallet: duplicate lookups and the check itself go through this index
+    conn.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_users_wallet_normalized
+    ON users(wallet_normalized) WHERE wallet_normalized IS NOT NULL
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS wallet_flags (
+        flag_id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        wallet_address TEXT NOT NULL,
+        reason TEXT NOT NULL,
+        other_user_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO schema_backfills (name) VALUES ('wallet_normalized')")
+
+def _migrate_create_user_flags(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS user_flags (
+        user_id INTEGER PRIMARY KEY,
+        score REAL NOT NULL,
+        reason TEXT NOT NULL,
+        flagged_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+def _migrate_create_campaigns(conn):
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(users)')}
+    if 'campaign' not in columns:
+        # Campaign the user last started, NULL for the main campaign
+        conn.execute('ALTER TABLE users ADD COLUMN campaign TEXT')
+    
+    # Progress in every campaign but the main one, whose progress stays in users.
+    # The primary key serves per-user lookups, the index the per-campaign
+    # completion listings.
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS campaign_progress (
+        campaign TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        current_step INTEGER NOT NULL DEFAULT 1,
+        tasks_mask INTEGER NOT NULL DEFAULT 0,
+        joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        completed_at TIMESTAMP,
+        PRIMARY KEY (campaign, user_id)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_campaign_progress_completed_at
+    ON campaign_progress(campaign, completed_at)
+    ''')
+    
+    # Per-campaign aggregates for /stats, kept current by the triggers below
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS campaign_counters (
+        campaign TEXT PRIMARY KEY,
+        participants INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS campaign_task_completions (
+        campaign TEXT NOT NULL,
+        task_bit INTEGER NOT NULL,
+        completed INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (campaign, task_bit)
+    ) WITHOUT ROWID
+    ''')
+    
+    # stats_task_completions has one row per task bit, so it doubles as the list of bits
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS campaign_progress_insert AFTER INSERT ON campaign_progress
+    BEGIN
+        INSERT INTO campaign_counters (campaign, participants) VALUES (NEW.campaign, 1)
+            ON CONFLICT(campaign) DO UPDATE SET participants = participants + 1;
+        INSERT OR IGNORE INTO campaign_task_completions (campaign, task_bit)
+            SELECT NEW.campaign, task_bit FROM stats_task_completions
+            WHERE NOT EXISTS (SELECT 1 FROM campaign_task_completions WHERE campaign = NEW.campaign);
+        UPDATE campaign_task_completions SET completed = completed + 1
+            WHERE campaign = NEW.campaign AND (NEW.tasks_mask >> task_bit) & 1;
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS campaign_progress_delete AFTER DELETE ON campaign_progress
+    BEGIN
+        UPDATE campaign_counters SET participants = participants - 1 WHERE campaign = OLD.campaign;
+        UPDATE campaign_task_completions SET completed = completed - 1
+            WHERE campaign = OLD.campaign AND (OLD.tasks_mask >> task_bit) & 1;
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS campaign_progress_tasks AFTER UPDATE OF tasks_mask ON campaign_progress
+    WHEN NEW.tasks_mask IS NOT OLD.tasks_mask
+    BEGIN
+        UPDATE campaign_task_completions
+            SET completed = completed + ((NEW.tasks_mask >> task_bit) & 1) - ((OLD.tasks_mask >> task_bit) & 1)
+            WHERE campaign = NEW.campaign
+            AND (((NEW.tasks_mask | OLD.tasks_mask) - (NEW.tasks_mask & OLD.tasks_mask)) >> task_bit) & 1;
+    END
+    ''')
+
+def _next_key_range(conn, last_key, batch_size):
+    """Upper user_id of the next batch after last_key, None if it is the last batch"""
+    row = conn.execute(
+        'SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT 1 OFFSET ?',
+        (last_key, batch_size - 1)
+    ).fetchone()
+    return row[0] if row else None
+
+def _backfill_tasks_mask(conn, last_key, batch_size):
+    """Convert the next batch of rows after last_key, returns the new last_key or None when done"""
+    upper_key = _next_key_range(conn, last_key, batch_size)
+    conn.execute(f'''
+    UPDATE users SET tasks_mask = {LEGACY_TASKS_MASK_SQL}
+    WHERE user_id > ? AND user_id <= ? AND tasks_mask IS NULL
+    ''', (last_key, upper_key if upper_key is not None else MAX_USER_ID))
+    return upper_key
+
+def _backfill_completed_at(conn, last_key, batch_size):
+    """Stamp users who finished before completed_at existed with their last activity"""
+    upper_key = _next_key_range(conn, last_key, batch_size)
+    conn.execute(f'''
+    UPDATE users SET completed_at = last_active
+    WHERE user_id > ? AND user_id <= ? AND completed_at IS NULL AND {TASKS_MASK_SQL} & ?
+    ''', (last_key, upper_key if upper_key is not None else MAX_USER_ID, 1 << (len(TASKS) - 1)))
+    return upper_key
+
+def _backfill_wallet_normalized(conn, last_key, batch_size):
+    """Normalize wallets saved before validation existed, flagging invalid and shared ones"""
+    upper_key = _next_key_range(conn, last_key, batch_size)
+    rows = conn.execute('''
+    SELECT user_id, wallet_address FROM users
+    WHERE user_id > ? AND user_id <= ? AND wallet_address IS NOT NULL AND wallet_normalized IS NULL
+    ''', (last_key, upper_key if upper_key is not None else MAX_USER_ID)).fetchall()
+    for user_id, wallet_address in rows:
+        parsed = parse_wallet_address(wallet_address)
+        if parsed is None:
+            conn.execute(SQL_FLAG_WALLET, (user_id, wallet_address, 'invalid', None))
+            continue
+        owner = conn.execute(SQL_SELECT_WALLET_OWNER, (parsed[1],)).fetchone()
+        if owner:
+            # The wallet stays with whoever claimed it first
+            conn.execute(SQL_FLAG_WALLET, (user_id, wallet_address, 'shared', owner[0]))
+            continue
+        conn.execute('UPDATE users SET wallet_normalized = ? WHERE user_id = ?', (parsed[1], user_id))
+    return upper_key
+
+def _migrate_create_bot_state(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS bot_state (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''')
+
+def _migrate_drop_user_id_index(conn):
+    # user_id is the rowid, so this index only doubled every insert
+    conn.execute('DROP INDEX IF EXISTS idx_user_id')
+
+def _migrate_create_users_archive(conn):
+    # Users moved out by DatabaseMaintenance.archive_inactive, restored by
+    # get_or_create_user when they come back
+    conn.execute(f'''
+    CREATE TABLE IF NOT EXISTS users_archive (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        current_step INTEGER,
+        task1_completed INTEGER,
+        task2_completed INTEGER,
+        task3_completed INTEGER,
+        task4_completed INTEGER,
+        task5_completed INTEGER,
+        wallet_address TEXT,
+        joined_at TIMESTAMP,
+        last_active TIMESTAMP,
+        tasks_mask INTEGER,
+        completed_at TIMESTAMP,
+        wallet_normalized TEXT,
+        campaign TEXT,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    
+    # Archived users still count in /stats: moving a row between users and
+    # users_archive (which holds it during the move) leaves the aggregates alone
+    old_mask = f'COALESCE(OLD.tasks_mask, {_legacy_tasks_mask_sql("OLD.")})'
+    conn.execute('DROP TRIGGER IF EXISTS stats_users_insert')
+    conn.execute('''
+    CREATE TRIGGER stats_users_insert AFTER INSERT ON users
+    WHEN NOT EXISTS (SELECT 1 FROM users_archive WHERE user_id = NEW.user_id)
+    BEGIN
+        UPDATE stats_counters SET value = value + 1 WHERE name = 'users';
+        INSERT INTO stats_daily (day, signups) VALUES (date(NEW.joined_at), 1)
+            ON CONFLICT(day) DO UPDATE SET signups = signups + 1;
+        UPDATE stats_task_completions SET completed = completed + 1
+            WHERE (NEW.tasks_mask >> task_bit) & 1;
+    END
+    ''')
+    conn.execute('DROP TRIGGER IF EXISTS stats_users_delete')
+    conn.execute(f'''
+    CREATE TRIGGER stats_users_delete AFTER DELETE ON users
+    WHEN NOT EXISTS (SELECT 1 FROM users_archive WHERE user_id = OLD.user_id)
+    BEGIN
+        UPDATE stats_counters SET value = value - 1 WHERE name = 'users';
+        UPDATE stats_task_completions SET completed = completed - 1
+            WHERE ({old_mask} >> task_bit) & 1;
+    END
+    ''')
+
+# Versioned schema migrations, applied in order by init_db. Each runs in its
+# own transaction and must be quick (at most one read pass over users); data
+# conversions that rewrite every row go into BACKFILLS and run in small
+# batches while the bot is serving.
+MIGRATIONS = [
+    (1, 'create users table', _migrate_create_users),
+    (2, 'add tasks_mask column', _migrate_add_tasks_mask),
+    (3, 'create broadcast tables', _migrate_create_broadcasts),
+    (4, 'create stats aggregates', _migrate_create_stats),
+    (5, 'create event log and funnel rollups', _migrate_create_events),
+    (6, 'add normalized wallet index', _migrate_add_wallet_normalized),
+    (7, 'create user flags table', _migrate_create_user_flags),
+    (8, 'create campaign progress tables', _migrate_create_campaigns),
+    (9, 'create bot state table', _migrate_create_bot_state),
+    (10, 'drop redundant user_id index', _migrate_drop_user_id_index),
+    (11, 'create users archive', _migrate_create_users_archive),
+]
+
+BACKFILLS = {
+    'tasks_mask': _backfill_tasks_mask,
+    'completed_at': _backfill_completed_at,
+    'wallet_normalized': _backfill_wallet_normalized,
+}
+
+def init_db(db_path=None):
+    """Initialize SQLite database and apply pending migrations"""
+    db_path = db_path or DB_PATH
+    try:
+        conn = sqlite3.connect(db_path)
+        
+        # A database at the latest version was set up by an earlier start;
+        # its WAL journal mode is stored in the file
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version == MIGRATIONS[-1][0]:
+            logger.info("Database schema is up to date (version %s) at %s", version, db_path)
+            return
+        
+        # Only takes effect before the first table is created; older databases
+        # are converted by `python bot.py vacuum`
+        if version == 0:
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        
+        # WAL lets the read pool run alongside the writer thread
+        conn.execute('PRAGMA journal_mode=WAL')
+        
+        for target, description, migrate in MIGRATIONS:
+            if target <= version:
+                continue
+            with conn:
+                migrate(conn)
+                conn.execute(f'PRAGMA user_version = {target}')
+            logger.info("Applied database migration %s: %s", target, description)
+        
+        logger.info("Database initialized successfully at %s", db_path)
+    except Exception as e:
+        logger.error("Database initialization error: %s", e)
+        raise
+    finally:
+        if 'conn' in locals():
+            conn.close()
+
+async def run_backfills(store, batch_size=MIGRATION_BATCH_SIZE):
+    """Run unfinished BACKFILLS in short write transactions on the store's writer thread"""
+    def next_batch(conn, name, backfill):
+        row = conn.execute('SELECT last_key, done FROM schema_backfills WHERE name = ?', (name,)).fetchone()
+        if row is None or row[1]:
+            return False
+        with conn:
+            upper_key = backfill(conn, row[0], batch_size)
+            if upper_key is None:
+                conn.execute('UPDATE schema_backfills SET done = 1 WHERE name = ?', (name,))
+            else:
+                conn.execute('UPDATE schema_backfills SET last_key = ? WHERE name = ?', (upper_key, name))
+        return upper_key is not None
+    
+    for name, backfill in BACKFILLS.items():
+        started = time.monotonic()
+        batches = 0
+        try:
+            while await store.write(next_batch, name, backfill):
+                batches += 1
+                await asyncio.sleep(MIGRATION_BATCH_PAUSE)
+        except Exception as e:
+            logger.error("Backfill %s stopped, will resume on next start: %s", name, e)
+            continue
+        if batches:
+            logger.info("Backfill %s finished: %s batches in %.1fs", name, batches, time.monotonic() - started)
+
+# SQL statements, kept as constants so the long-lived connections reuse
+# their compiled form from the sqlite3 statement cache
+SQL_FIND_USER = '''
+SELECT 'active' FROM users WHERE user_id = ?
+UNION ALL SELECT 'archived' FROM users_archive WHERE user_id = ?
+'''
+SQL_INSERT_USER = '''
+INSERT OR IGNORE INTO users (user_id, username, first_name, tasks_mask, joined_at, last_active)
+VALUES (?, ?, ?, 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+'''
+SQL_TOUCH_USER = '''
+UPDATE users SET last_active = CURRENT_TIMESTAMP, username = ?, first_name = ?
+WHERE user_id = ?
+'''
+SQL_SELECT_PROGRESS = f'''
+SELECT current_step, {TASKS_MASK_SQL}, wallet_address, campaign
+FROM users WHERE user_id = ?
+'''
+SQL_UPDATE_STEP = '''
+UPDATE users SET current_step = ?, last_active = CURRENT_TIMESTAMP
+WHERE user_id = ?
+'''
+SQL_MARK_TASK = f'''
+UPDATE users SET tasks_mask = {TASKS_MASK_SQL} | ?, last_active = CURRENT_TIMESTAMP
+WHERE user_id = ?
+'''
+SQL_MARK_COMPLETED = 'UPDATE users SET completed_at = COALESCE(completed_at, CURRENT_TIMESTAMP) WHERE user_id = ?'
+SQL_ADVANCE_STEP = 'UPDATE users SET current_step = ? WHERE user_id = ? AND current_step = ?'
+SQL_RESET_PROGRESS = '''
+UPDATE users SET
+    current_step = 1,
+    tasks_mask = 0,
+    completed_at = NULL,
+    wallet_address = NULL,
+    wallet_normalized = NULL,
+    last_active = CURRENT_TIMESTAMP
+WHERE user_id = ?
+'''
+SQL_SET_ACTIVE_CAMPAIGN = 'UPDATE users SET campaign = ?, last_active = CURRENT_TIMESTAMP WHERE user_id = ?'
+SQL_ENROLL_CAMPAIGN = 'INSERT OR IGNORE INTO campaign_progress (campaign, user_id) VALUES (?, ?)'
+SQL_SELECT_CAMPAIGN_PROGRESS = '''
+SELECT p.current_step, p.tasks_mask, u.wallet_address
+FROM campaign_progress p JOIN users u ON u.user_id = p.user_id
+WHERE p.campaign = ? AND p.user_id = ?
+'''
+SQL_CAMPAIGN_UPDATE_STEP = 'UPDATE campaign_progress SET current_step = ? WHERE campaign = ? AND user_id = ?'
+SQL_CAMPAIGN_MARK_TASK = 'UPDATE campaign_progress SET tasks_mask = tasks_mask | ? WHERE campaign = ? AND user_id = ?'
+SQL_CAMPAIGN_MARK_COMPLETED = '''
+UPDATE campaign_progress SET completed_at = COALESCE(completed_at, CURRENT_TIMESTAMP)
+WHERE campaign = ? AND user_id = ?
+'''
+SQL_CAMPAIGN_ADVANCE_STEP = '''
+UPDATE campaign_progress SET current_step = ?
+WHERE campaign = ? AND user_id = ? AND current_step = ?
+'''
+SQL_CAMPAIGN_RESET_PROGRESS = '''
+UPDATE campaign_progress SET current_step = 1, tasks_mask = 0, completed_at = NULL
+WHERE campaign = ? AND user_id = ?
+'''
+USER_COLUMNS = '''
+user_id, username, first_name, current_step, task1_completed, task2_completed, task3_completed,
+task4_completed, task5_completed, wallet_address, joined_at, last_active, tasks_mask, completed_at,
+wallet_normalized, campaign
+'''
+SQL_RESTORE_USER = f'INSERT OR IGNORE INTO users ({USER_COLUMNS}) SELECT {USER_COLUMNS} FROM users_archive WHERE user_id = ?'
+SQL_DELETE_ARCHIVED_USER = 'DELETE FROM users_archive WHERE user_id = ?'
+SQL_SAVE_WALLET = 'UPDATE users SET wallet_address = ?, wallet_normalized = ? WHERE user_id = ?'
+SQL_SELECT_WALLET_OWNER = 'SELECT user_id FROM users WHERE wallet_normalized = ?'
+SQL_FLAG_WALLET = 'INSERT INTO wallet_flags (user_id, wallet_address, reason, other_user_id) VALUES (?, ?, ?, ?)'
+SQL_SAVE_STATE = '''
+INSERT INTO bot_state (key, value) VALUES (?, ?)
+ON CONFLICT(key) DO UPDATE SET value = excluded.value
+'''
+SQL_FLAG_USER = '''
+INSERT INTO user_flags (user_id, score, reason) VALUES (?, ?, ?)
+ON CONFLICT(user_id) DO UPDATE SET score = excluded.score, reason = excluded.reason, flagged_at = CURRENT_TIMESTAMP
+'''
+SQL_INSERT_EVENT = 'INSERT INTO events (user_id, kind, step, created_at) VALUES (?, ?, ?, ?)'
+
+# State backends
+# Query functions run by read() and write() are looked up by name when the
+# backend is remote, so only functions registered here can be called.
+STATE_QUERIES = {}
+
+def state_query(fn):
+    """Register fn(conn, ...) as a query that StateBackend.read/write may run remotely"""
+    STATE_QUERIES[fn.__qualname__] = fn
+    return fn
+
+class StateBackendError(RuntimeError):
+    """Raised when the state server rejects or fails a call"""
+
+class StateBackend(ABC):
+    """Storage interface used by UserManager, broadcasts and the funnel
+
+    UserStore keeps the state in a local SQLite file and is the default.
+    RemoteStore reaches a StateServer over HTTP, so several bot workers can
+    share one database. read() and write() run a @state_query function
+    against the backend's database; the other methods are the user
+    operations behind UserManager.
+    """
+    
+    # Local database file, None when the database lives in another process;
+    # snapshots and /export need it
+    db_path = None
+    # Writes queued in this process for the next commit, none for backends that write through
+    pending_writes = 0
+    
+    def has_pending_writes(self, user_id):
+        """True if a write of user_id is queued in this process and not committed yet"""
+        return False
+    
+    def pending_user_ids(self):
+        """Users with writes queued in this process and not committed yet"""
+        return []
+    
+    def save_with_commits(self, key, value_fn):
+        """Write value_fn() to bot_state key along with each commit of queued writes
+
+        Returns False for backends that do not queue writes; callers save the
+        value themselves then.
+        """
+        return False
+    
+    @abstractmethod
+    async def read(self, fn, *args):
+        """Run the @state_query fn(conn, *args) on a reader, returns its result"""
+    
+    @abstractmethod
+    async def write(self, fn, *args):
+        """Run the @state_query fn(conn, *args) on the writer, returns its result"""
+    
+    @abstractmethod
+    async def flush(self):
+        """Commit every queued write"""
+    
+    @abstractmethod
+    async def close(self):
+        """Commit queued writes and release connections"""
+    
+    @abstractmethod
+    async def get_or_create_user(self, user_id, username, first_name):
+        """Register or touch a user, returns True if the user is new"""
+    
+    @abstractmethod
+    async def touch_user(self, user_id, username, first_name):
+        """Refresh last-active and profile fields of a known user"""
+    
+    @abstractmethod
+    async def enroll(self, user_id, campaign):
+        """Make campaign the user's active campaign, creating their progress row in it"""
+    
+    @abstractmethod
+    async def get_user_progress(self, user_id, campaign=MAIN_CAMPAIGN):
+        """Progress record of user_id in campaign, None for unknown users"""
+    
+    @abstractmethod
+    async def update_user_step(self, user_id, step, campaign=MAIN_CAMPAIGN):
+        """Move user_id to task step"""
+    
+    @abstractmethod
+    async def mark_task_completed(self, user_id, task_num, campaign=MAIN_CAMPAIGN):
+        """Mark task_num done and advance the step past it"""
+    
+    @abstractmethod
+    async def reset_user_progress(self, user_id, campaign=MAIN_CAMPAIGN):
+        """Start campaign over for user_id"""
+    
+    @abstractmethod
+    async def save_wallet_address(self, user_id, wallet_address, normalized):
+        """Save a validated wallet, returns the id of the user already using it or None"""
+    
+    @abstractmethod
+    async def flag_user(self, user_id, score, reason):
+        """Mark user_id as suspicious"""
+    
+    @abstractmethod
+    async def get_stats(self):
+        """Totals for /stats"""
+    
+    @abstractmethod
+    async def get_campaign_stats(self, campaign):
+        """Per-task totals of campaign for /stats"""
+    
+    @abstractmethod
+    async def get_campaign_totals(self):
+        """(participants, completed) of every configured campaign but the main one"""
+
+class UserStore(StateBackend):
+    """Async storage for user data backed by long-lived SQLite connections
+
+    All writes go through a single dedicated writer thread, reads are served
+    by a small pool of reader threads. Handlers await the coroutines below and
+    never block the event loop on disk I/O.
+
+    Writes are queued in memory and committed in batches. Repeated writes of
+    the same kind for a user (step changes, last-active touches) are merged
+    while they are still queued, and reads for a user with queued writes
+    flush first so handlers always see their own writes. Wallet saves are
+    committed immediately since they have to check who owns the wallet.
+
+    Each user's write in a batch runs in its own savepoint, so a statement
+    that fails only rolls back that write; the rest of the batch commits.
+    """
+    
+    def __init__(self, db_path, read_pool_size=DB_READ_POOL_SIZE, durability=DB_DURABILITY,
+                 batch_size=DB_BATCH_MAX_SIZE, batch_delay=DB_BATCH_MAX_DELAY):
+        self.db_path = db_path
+        self.durability = durability
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=read_pool_size, thread_name_prefix='db-reader')
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        
+        # Write batching state, only touched from the event loop
+        self._pending = []
+        self._last_write = {}
+        self._dirty = {}
+        self._generation = 0
+        self._flush_handle = None
+        self._flush_future = None
+        self._commit_state = {}
+        self.flushes = 0
+        self.coalesced_writes = 0
+        self.failed_writes = 0
+        self.failed_batches = 0
+    
+    def _connect(self):
+        """Open a connection for the calling thread"""
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE_SIZE
+        )
+        conn.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}')
+        conn.execute(f"PRAGMA synchronous = {'FULL' if self.durability == 'strict' else 'NORMAL'}")
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+    
+    def _call(self, fn, args):
+        """Run fn with this thread's connection"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return fn(conn, *args)
+    
+    async def read(self, fn, *args):
+        """Run a read-only fn(conn, *args) on the reader pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._call, fn, args)
+    
+    async def write(self, fn, *args):
+        """Run fn(conn, *args) on the writer thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, self._call, fn, args)
+    
+    async def close(self):
+        """Flush queued writes and close all connections"""
+        await self.flush()
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+    
+    # Write batching
+    
+    @property
+    def pending_writes(self):
+        return len(self._pending)
+    
+    async def _queue_write(self, user_id, ops, coalesce_key=None):
+        """Queue a list of (sql, params) for user_id
+
+        If the last queued write for this user has the same coalesce_key it is
+        replaced instead of adding another one.
+        """
+        last = self._last_write.get(user_id)
+        if coalesce_key and last and last[0] == coalesce_key:
+            self._pending[last[1]] = (user_id, ops)
+            self.coalesced_writes += 1
+        else:
+            self._last_write[user_id] = (coalesce_key, len(self._pending))
+            self._pending.append((user_id, ops))
+        self._dirty[user_id] = self._generation
+        
+        if self.durability == 'strict':
+            await self.flush()
+        elif len(self._pending) >= self.batch_size:
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.batch_delay, self._start_flush)
+    
+    def _start_flush(self):
+        """Hand the queued writes to the writer thread as one transaction"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        state = self._changed_state()
+        if not self._pending and not state:
+            # Only a batch still being committed; a failed one was reported already
+            if self._flush_future is not None and not self._flush_future.done():
+                return self._flush_future
+            return None
+        
+        batch, self._pending = self._pending + state, []
+        self._last_write.clear()
+        generation = self._generation
+        self._generation += 1
+        
+        self._flush_future = asyncio.ensure_future(self._commit_batch(batch, generation))
+        self._flush_future.add_done_callback(self._log_flush_error)
+        return self._flush_future
+    
+    def save_with_commits(self, key, value_fn):
+        self._commit_state[key] = [value_fn, None]
+        return True
+    
+    def _changed_state(self):
+        """bot_state writes for the save_with_commits values that changed since the last batch"""
+        ops = []
+        for key, entry in self._commit_state.items():
+            value = entry[0]()
+            if value != entry[1]:
+                entry[1] = value
+                ops.append((None, [(SQL_SAVE_STATE, (key, value))]))
+        return ops
+    
+    async def _commit_batch(self, batch, generation):
+        try:
+            failed = await self.write(self._apply_batch, batch)
+            self.flushes += 1
+        except Exception:
+            self.failed_batches += 1
+            self.failed_writes += len(batch)
+            # Saved state values were rolled back with the batch
+            for entry in self._commit_state.values():
+                entry[1] = None
+            raise
+        finally:
+            for user_id in [u for u, g in self._dirty.items() if g <= generation]:
+                del self._dirty[user_id]
+        
+        for user_id, error in failed:
+            self.failed_writes += 1
+            logger.error("Error committing a write of user %s, it was rolled back: %s", user_id, error)
+            # Cached progress may now be ahead of the database
+            for campaign in CONFIG.campaigns:
+                progress_cache.invalidate(progress_key(user_id, campaign))
+    
+    @staticmethod
+    def _log_flush_error(future):
+        if not future.cancelled() and future.exception():
+            logger.error("Error committing write batch: %s", future.exception())
+            # Cached progress may now be ahead of the database
+            progress_cache.clear()
+    
+    @staticmethod
+    def _apply_batch(conn, batch):
+        """Commit batch in one transaction, returns (user_id, error) of the writes rolled back"""
+        failed = []
+        with conn:
+            # Savepoints outside a transaction would commit on release
+            conn.execute('BEGIN')
+            for user_id, ops in batch:
+                conn.execute('SAVEPOINT user_write')
+                try:
+                    for sql, params in ops:
+                        conn.execute(sql, params)
+                except sqlite3.Error as e:
+                    conn.execute('ROLLBACK TO user_write')
+                    failed.append((user_id, e))
+                conn.execute('RELEASE user_write')
+        return failed
+    
+    async def flush(self):
+        """Commit every queued write and wait for it to reach the database"""
+        future = self._start_flush()
+        if future is not None:
+            await asyncio.shield(future)
+    
+    def has_pending_writes(self, user_id):
+        return user_id in self._dirty
+    
+    def pending_user_ids(self):
+        return list(self._dirty)
+    
+    async def _flush_user(self, user_id):
+        """Flush if user_id has writes that are not committed yet"""
+        if user_id in self._dirty:
+            await self.flush()
+    
+    # Queries, executed on the store threads
+    
+    @staticmethod
+    def _find_user(conn, user_id):
+        """'active', 'archived' or None"""
+        row = conn.execute(SQL_FIND_USER, (user_id, user_id)).fetchone()
+        return row[0] if row else None
+    
+    @staticmethod
+    def _get_user_progress(conn, user_id, campaign=MAIN_CAMPAIGN):
+        if campaign == MAIN_CAMPAIGN:
+            result = conn.execute(SQL_SELECT_PROGRESS, (user_id,)).fetchone()
+        else:
+            result = conn.execute(SQL_SELECT_CAMPAIGN_PROGRESS, (campaign, user_id)).fetchone()
+        if result:
+            tasks_completed = [bool(result[1] >> i & 1) for i in range(len(get_campaign(campaign).tasks))]
+            progress = {
+                'current_step': resume_step(tasks_completed, result[0]),
+                'tasks_completed': tasks_completed,
+                'wallet_address': result[2]
+            }
+            if campaign == MAIN_CAMPAIGN:
+                progress['active_campaign'] = result[3] or MAIN_CAMPAIGN
+            return progress
+        return None
+    
+    @staticmethod
+    def _get_stats(conn):
+        total_users = conn.execute("SELECT value FROM stats_counters WHERE name = 'users'").fetchone()[0]
+        task_completions = [row[0] for row in conn.execute(
+            'SELECT completed FROM stats_task_completions WHERE task_bit < ? ORDER BY task_bit', (len(TASKS),)
+        )]
+        today = conn.execute("SELECT signups FROM stats_daily WHERE day = date('now')").fetchone()
+        recent_completions = conn.execute('''
+        SELECT username, completed_at FROM users 
+        WHERE completed_at IS NOT NULL 
+        ORDER BY completed_at DESC 
+        LIMIT 5
+        ''').fetchall()
+        flagged_users = conn.execute('SELECT COUNT(*) FROM user_flags').fetchone()[0]
+        flagged_wallets = dict(conn.execute('SELECT reason, COUNT(*) FROM wallet_flags GROUP BY reason').fetchall())
+        return {
+            'total_users': total_users,
+            'completed_users': task_completions[-1] if task_completions else 0,
+            'task_completions': task_completions,
+            'today_users': today[0] if today else 0,
+            'recent_completions': recent_completions,
+            'flagged_wallets': flagged_wallets,
+            'flagged_users': flagged_users
+        }
+    
+    @staticmethod
+    def _get_campaign_stats(conn, campaign, task_count):
+        participants = conn.execute(
+            'SELECT participants FROM campaign_counters WHERE campaign = ?', (campaign,)
+        ).fetchone()
+        completions = dict(conn.execute(
+            'SELECT task_bit, completed FROM campaign_task_completions WHERE campaign = ? AND task_bit < ?',
+            (campaign, task_count)
+        ).fetchall())
+        task_completions = [completions.get(bit, 0) for bit in range(task_count)]
+        recent_completions = conn.execute('''
+        SELECT u.username, p.completed_at FROM campaign_progress p
+        JOIN users u ON u.user_id = p.user_id
+        WHERE p.campaign = ? AND p.completed_at IS NOT NULL
+        ORDER BY p.completed_at DESC
+        LIMIT 5
+        ''', (campaign,)).fetchall()
+        return {
+            'total_users': participants[0] if participants else 0,
+            'completed_users': task_completions[-1],
+            'task_completions': task_completions,
+            'recent_completions': recent_completions
+        }
+    
+    @staticmethod
+    def _get_campaign_totals(conn, task_counts):
+        totals = {}
+        for campaign, task_count in task_counts.items():
+            participants = conn.execute(
+                'SELECT participants FROM campaign_counters WHERE campaign = ?', (campaign,)
+            ).fetchone()
+            completed = conn.execute(
+                'SELECT completed FROM campaign_task_completions WHERE campaign = ? AND task_bit = ?',
+                (campaign, task_count - 1)
+            ).fetchone()
+            totals[campaign] = (participants[0] if participants else 0, completed[0] if completed else 0)
+        return totals
+    
+    @staticmethod
+    def _save_wallet(conn, user_id, wallet_address, normalized):
+        # Runs on the writer thread, so nobody can claim the wallet between check and update
+        with conn:
+            owner = conn.execute(SQL_SELECT_WALLET_OWNER, (normalized,)).fetchone()
+            if owner and owner[0] != user_id:
+                conn.execute(SQL_FLAG_WALLET, (user_id, wallet_address, 'shared', owner[0]))
+                return owner[0]
+            conn.execute(SQL_SAVE_WALLET, (wallet_address, normalized, user_id))
+            return None
+    
+    # Write operations, as lists of (sql, params) executed in order
+    
+    @staticmethod
+    def mark_task_ops(user_id, task_num, campaign=MAIN_CAMPAIGN):
+        task_count = len(get_campaign(campaign).tasks)
+        if campaign != MAIN_CAMPAIGN:
+            ops = [(SQL_CAMPAIGN_MARK_TASK, (1 << (task_num - 1), campaign, user_id))]
+            if task_num < task_count:
+                ops.append((SQL_CAMPAIGN_ADVANCE_STEP, (task_num + 1, campaign, user_id, task_num)))
+            else:
+                ops.append((SQL_CAMPAIGN_MARK_COMPLETED, (campaign, user_id)))
+            return ops
+        
+        ops = [(SQL_MARK_TASK, (1 << (task_num - 1), user_id))]
+        # Also update current_step to next task
+        if task_num < task_count:
+            ops.append((SQL_ADVANCE_STEP, (task_num + 1, user_id, task_num)))
+        else:
+            ops.append((SQL_MARK_COMPLETED, (user_id,)))
+        return ops
+    
+    async def get_or_create_user(self, user_id, username, first_name):
+        """Register or touch a user, returns True if the user is new"""
+        await self._flush_user(user_id)
+        status = await self.read(self._find_user, user_id)
+        if status == 'active':
+            await self._queue_write(user_id, [(SQL_TOUCH_USER, (username, first_name, user_id))], 'touch')
+            return False
+        if status == 'archived':
+            # A returning user gets their progress back
+            await self._queue_write(user_id, [
+                (SQL_RESTORE_USER, (user_id,)),
+                (SQL_DELETE_ARCHIVED_USER, (user_id,)),
+                (SQL_TOUCH_USER, (username, first_name, user_id)),
+            ])
+            logger.info("Restored archived user %s", user_id, extra={'user_id': user_id})
+            return False
+        await self._queue_write(user_id, [(SQL_INSERT_USER, (user_id, username, first_name))])
+        return True
+    
+    async def touch_user(self, user_id, username, first_name):
+        """Refresh last-active and profile fields of a known user"""
+        await self._queue_write(user_id, [(SQL_TOUCH_USER, (username, first_name, user_id))], 'touch')
+    
+    async def enroll(self, user_id, campaign):
+        """Make campaign the user's active campaign, creating their progress row in it"""
+        if campaign == MAIN_CAMPAIGN:
+            await self._queue_write(user_id, [(SQL_SET_ACTIVE_CAMPAIGN, (None, user_id))])
+            return
+        await self._queue_write(user_id, [
+            (SQL_ENROLL_CAMPAIGN, (campaign, user_id)),
+            (SQL_SET_ACTIVE_CAMPAIGN, (campaign, user_id)),
+        ])
+    
+    async def get_user_progress(self, user_id, campaign=MAIN_CAMPAIGN):
+        await self._flush_user(user_id)
+        return await self.read(self._get_user_progress, user_id, campaign)
+    
+    async def update_user_step(self, user_id, step, campaign=MAIN_CAMPAIGN):
+        if campaign == MAIN_CAMPAIGN:
+            await self._queue_write(user_id, [(SQL_UPDATE_STEP, (step, user_id))], 'step')
+        else:
+            # Step changes only merge with queued step changes of the same campaign
+            await self._queue_write(
+                user_id, [(SQL_CAMPAIGN_UPDATE_STEP, (step, campaign, user_id))], ('step', campaign)
+            )
+    
+    async def mark_task_completed(self, user_id, task_num, campaign=MAIN_CAMPAIGN):
+        await self._queue_write(user_id, self.mark_task_ops(user_id, task_num, campaign))
+    
+    async def reset_user_progress(self, user_id, campaign=MAIN_CAMPAIGN):
+        if campaign == MAIN_CAMPAIGN:
+            await self._queue_write(user_id, [(SQL_RESET_PROGRESS, (user_id,))])
+        else:
+            await self._queue_write(user_id, [(SQL_CAMPAIGN_RESET_PROGRESS, (campaign, user_id))])
+    
+    async def save_wallet_address(self, user_id, wallet_address, normalized):
+        """Save a validated wallet, returns the id of the user already using it or None"""
+        # The user's own row may still be queued
+        await self._flush_user(user_id)
+        return await self.write(self._save_wallet, user_id, wallet_address, normalized)
+    
+    async def flag_user(self, user_id, score, reason):
+        await self._queue_write(user_id, [(SQL_FLAG_USER, (user_id, score, reason))])
+    
+    async def get_stats(self):
+        return await self.read(self._get_stats)
+    
+    async def get_campaign_stats(self, campaign):
+        return await self.read(self._get_campaign_stats, campaign, len(get_campaign(campaign).tasks))
+    
+    async def get_campaign_totals(self):
+        """(participants, completed) of every configured campaign but the main one"""
+        task_counts = {
+            key: len(campaign.tasks) for key, campaign in CONFIG.campaigns.items() if key != MAIN_CAMPAIGN
+        }
+        return await self.read(self._get_campaign_totals, task_counts)
+
+def _json_default(value):
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+class RemoteStore(StateBackend):
+    """State backend served by a StateServer over HTTP
+
+    Every call is one POST to the server's /rpc endpoint over a keep-alive
+    connection. Writes are not buffered here: the server queues and batches
+    them into its SQLite transactions, and its reads flush a user's queued
+    writes first, so read-your-writes holds across the network. Tuples come
+    back as lists and sets as lists.
+    """
+    
+    def __init__(self, url, token=None, timeout=STATE_RPC_TIMEOUT):
+        self.url = url.rstrip('/') + '/rpc'
+        self.token = STATE_SERVER_TOKEN if token is None else token
+        self.timeout = timeout
+        self._session = None
+        self.calls = 0
+    
+    async def _call(self, method, *args):
+        import aiohttp
+        
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={'Authorization': f'Bearer {self.token}', 'Content-Type': 'application/json'}
+            )
+        self.calls += 1
+        body = json.dumps({'method': method, 'args': args}, default=_json_default)
+        async with self._session.post(self.url, data=body) as response:
+            text = await response.text()
+        if response.status != 200:
+            raise StateBackendError(f"State server answered {method} with HTTP {response.status}: {text[:200]}")
+        return json.loads(text)['result']
+    
+    @staticmethod
+    def _query_name(fn):
+        name = fn.__qualname__
+        if STATE_QUERIES.get(name) is not fn:
+            raise ValueError(f"{name} is not registered with @state_query")
+        return name
+    
+    async def read(self, fn, *args):
+        return await self._call('read', self._query_name(fn), *args)
+    
+    async def write(self, fn, *args):
+        return await self._call('write', self._query_name(fn), *args)
+    
+    async def flush(self):
+        await self._call('flush')
+    
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+    
+    async def get_or_create_user(self, user_id, username, first_name):
+        return await self._call('get_or_create_user', user_id, username, first_name)
+    
+    async def touch_user(self, user_id, username, first_name):
+        await self._call('touch_user', user_id, username, first_name)
+    
+    async def enroll(self, user_id, campaign):
+        await self._call('enroll', user_id, campaign)
+    
+    async def get_user_progress(self, user_id, campaign=MAIN_CAMPAIGN):
+        return await self._call('get_user_progress', user_id, campaign)
+    
+    async def update_user_step(self, user_id, step, campaign=MAIN_CAMPAIGN):
+        await self._call('update_user_step', user_id, step, campaign)
+    
+    async def mark_task_completed(self, user_id, task_num, campaign=MAIN_CAMPAIGN):
+        await self._call('mark_task_completed', user_id, task_num, campaign)
+    
+    async def reset_user_progress(self, user_id, campaign=MAIN_CAMPAIGN):
+        await self._call('reset_user_progress', user_id, campaign)
+    
+    async def save_wallet_address(self, user_id, wallet_address, normalized):
+        return await self._call('save_wallet_address', user_id, wallet_address, normalized)
+    
+    async def flag_user(self, user_id, score, reason):
+        await self._call('flag_user', user_id, score, reason)
+    
+    async def get_stats(self):
+        return await self._call('get_stats')
+    
+    async def get_campaign_stats(self, campaign):
+        return await self._call('get_campaign_stats', campaign)
+    
+    async def get_campaign_totals(self):
+        return await self._call('get_campaign_totals')
+
+# Methods of the server's UserStore a RemoteStore may call besides read and write
+STATE_METHODS = frozenset({
+    'flush', 'get_or_create_user', 'touch_user', 'enroll', 'get_user_progress', 'update_user_step',
+    'mark_task_completed', 'reset_user_progress', 'save_wallet_address', 'flag_user', 'get_stats',
+    'get_campaign_stats', 'get_campaign_totals',
+})
+
+def create_state_backend(spec=None):
+    """UserStore for 'sqlite', RemoteStore for the http(s) URL of a state server"""
+    spec = spec or STATE_BACKEND
+    if spec == 'sqlite':
+        return UserStore(DB_PATH)
+    if spec.startswith(('http://', 'https://')):
+        return RemoteStore(spec)
+    raise ValueError(f"STATE_BACKEND must be 'sqlite' or the URL of a state server, not {spec!r}")
+
+user_store = create_state_backend()
+
+class ProgressCache:
+    """Bounded LRU cache of per-user progress records with a TTL
+
+    Records are treated as immutable: writers replace them through update()
+    so a handler holding a record never sees it change underneath it. Keys
+    are user ids for the main campaign and (campaign, user_id) for the others,
+    see progress_key().
+    """
+    
+    def __init__(self, capacity=PROGRESS_CACHE_SIZE, ttl=PROGRESS_CACHE_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._records = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def __len__(self):
+        return len(self._records)
+    
+    def __contains__(self, user_id):
+        entry = self._records.get(user_id)
+        return entry is not None and entry[0] > time.monotonic()
+    
+    def get(self, user_id):
+        """Return the cached record or None, counting hits and misses"""
+        entry = self._records.get(user_id)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._records[user_id]
+            self.misses += 1
+            return None
+        self._records.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
+    
+    def put(self, user_id, record, ttl=None):
+        self._records[user_id] = (time.monotonic() + (self.ttl if ttl is None else ttl), record)
+        self._records.move_to_end(user_id)
+        while len(self._records) > self.capacity:
+            self._records.popitem(last=False)
+            self.evictions += 1
+    
+    def update(self, user_id, fn):
+        """Replace a cached record with fn(record), if the user is cached
+
+        Returns False when a fresh cached record already is what fn makes of
+        it, meaning the write behind the change can be skipped.
+        """
+        entry = self._records.get(user_id)
+        if entry is None:
+            return True
+        record = fn(entry[1])
+        if record == entry[1] and entry[0] > time.monotonic():
+            return False
+        self.put(user_id, record)
+        return True
+    
+    def invalidate(self, user_id):
+        self._records.pop(user_id, None)
+    
+    def clear(self):
+        self._records.clear()
+    
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+progress_cache = ProgressCache()
+
+def progress_key(user_id, campaign=MAIN_CAMPAIGN):
+    """progress_cache key of a user's progress in campaign"""
+    return user_id if campaign == MAIN_CAMPAIGN else (campaign, user_id)
+
+def _new_progress(campaign=MAIN_CAMPAIGN, wallet_address=None):
+    progress = {
+        'current_step': 1,
+        'tasks_completed': [False] * len(get_campaign(campaign).tasks),
+        'wallet_address': wallet_address
+    }
+    if campaign == MAIN_CAMPAIGN:
+        progress['active_campaign'] = MAIN_CAMPAIGN
+    return progress
+
+def resume_step(tasks_completed, current_step):
+    """Clamp a stored step to a task that still exists, preferring the first unfinished one"""
+    if 1 <= current_step <= len(tasks_completed):
+        return current_step
+    # The config dropped the task the user was on
+    for i, done in enumerate(tasks_completed, 1):
+        if not done:
+            return i
+    return max(len(tasks_completed), 1)
+
+def _with_step(record, step):
+    return {**record, 'current_step': step}
+
+def _with_task_completed(record, task_num):
+    tasks_completed = list(record['tasks_completed'])
+    tasks_completed[task_num - 1] = True
+    current_step = record['current_step']
+    if task_num < len(tasks_completed) and current_step == task_num:
+        current_step = task_num + 1
+    return {**record, 'current_step': current_step, 'tasks_completed': tasks_completed}
+
+def _with_reset(record, campaign):
+    # Resetting the main campaign also clears the wallet, other campaigns keep it
+    if campaign == MAIN_CAMPAIGN:
+        return {**_new_progress(), 'active_campaign': record['active_campaign']}
+    return _new_progress(campaign, record['wallet_address'])
+
+def _with_wallet(record, wallet_address):
+    return {**record, 'wallet_address': wallet_address}
+
+def _with_active_campaign(record, campaign):
+    return {**record, 'active_campaign': campaign}
+
+class UserManager:
+    """Manages user data and progress
+
+    Progress reads are served from progress_cache; every write below updates
+    the cached record together with queueing the database write.
+    """
+    
+    @staticmethod
+    @timed(STORE_SECONDS)
+    async def get_or_create_user(user_id, username, first_name):
+        """Get existing user or create new one"""
+        try:
+            if user_id in progress_cache:
+                await user_store.touch_user(user_id, username, first_name)
+            elif await user_store.get_or_create_user(user_id, username, first_name):
+                progress_cache.put(user_id, _new_progress())
+                logger.info("New user created: %s (@%s)", user_id, username, extra={'user_id': user_id})
+            return True
+        except Exception as e:
+            logger.error("Error in get_or_create_user: %s", e)
+            return False
+    
+    @staticmethod
+    @timed(STORE_SECONDS)
+    async def enroll(user_id, campaign):
+        """Make campaign the user's active campaign, keeping any progress they already have in it"""
+        try:
+            progress_cache.update(user_id, lambda record: _with_active_campaign(record, campaign))
+            await user_store.enroll(user_id, campaign)
+            return True
+        except Exception as e:
+            progress_cache.invalidate(user_id)
+            logger.error("Error enrolling user in campaign %s: %s", campaign, e)
+            return False
+    
+    @staticmethod
+    @timed(STORE_SECONDS)
+    async def get_active_campaign(user_id):
+        """Campaign the user last started, the main one if it is no longer configured"""
+        progress = await UserManager.get_user_progress(user_id)
+        campaign = progress['active_campaign'] if progress else MAIN_CAMPAIGN
+        return campaign if campaign in CONFIG.campaigns else MAIN_CAMPAIGN
+    
+    @staticmethod
+    @timed(STORE_SECONDS)
+    async def get_user_progress(user_id, campaign=MAIN_CAMPAIGN):
+        """Get user's current progress"""
+        key = progress_key(user_id, campaign)
+        progress = progress_cache.get(key)
+        if progress is not None:
+            return progress
+        try:
+            progress = await user_store.get_user_progress(user_id, campaign)
+        except Exception as e:
+            logger.error("Error getting user progress: %s", e)
+            return None
+        # A write queued while we were reading would make this record stale
+        if progress is not None and not user_store.has_pending_writes(user_id):
+            progress_cache.put(key, progress)
+        return progress
+    
+    @staticmethod
+    @timed(STORE_SECONDS)
+    async def update_user_step(user_id, step, campaign=MAIN_CAMPAIGN):
+        """Update user's current step"""
+        key = progress_key(user_id, campaign)
+        try:
+            if not progress_cache.update(key, lambda record: _with_step(record, step)):
+                WRITES_SKIPPED.inc('update_user_step')
+                return True
+            await user_store.update_user_step(user_id, step, campaign)
+            return True
+        except Exception as e:
+            progress_cache.invalidate(key)
+            logger.error("Error updating user step: %s", e)
+            return False
+    
+    @staticmethod
+    @timed(STORE_SECONDS)
+    async def mark_task_completed(user_id, task_num, campaign=MAIN_CAMPAIGN):
+        """Mark a specific task as completed"""
+        key = progress_key(user_id, campaign)
+        try:
+            if not progress_cache.update(key, lambda record: _with_task_completed(record, task_num)):
+                WRITES_SKIPPED.inc('mark_task_completed')
+                return True
+            await user_store.mark_task_completed(user_id, task_num, campaign)
+            return True
+        except Exception as e:
+            progress_cache.invalidate(key)
+            logger.error("Error marking task completed: %s", e)
+            return False
+    
+    @staticmethod
+    @timed(STORE_SECONDS)
+    async def reset_user_progress(user_id, campaign=MAIN_CAMPAIGN):
+        """Reset user's progress"""
+        key = progress_key(user_id, campaign)
+        try:
+            if not progress_cache.update(key, lambda record: _with_reset(record, campaign)):
+                WRITES_SKIPPED.inc('reset_user_progress')
+                return True
+            await user_store.reset_user_progress(user_id, campaign)
+            return True
+        except Exception as e:
+            progress_cache.invalidate(key)
+            logger.error("Error resetting user progress: %s", e)
+            return False
+    
+    @staticmethod
+    @timed(STORE_SECONDS)
+    async def save_wallet_address(user_id, wallet_address, normalized):
+        """Save user's wallet address
+
+        Returns 'saved', 'shared' if another account already registered the
+        wallet, or None on error.
+        """
+        try:
+            if await user_store.save_wallet_address(user_id, wallet_address, normalized) is not None:
+                logger.info("User %s sent a wallet already registered by another account", user_id, extra={'user_id': user_id})
+                return 'shared'
+            # The wallet belongs to the user, so every campaign's cached record shows it
+            for campaign in CONFIG.campaigns:
+                progress_cache.update(progress_key(user_id, campaign), lambda record: _with_wallet(record, wallet_address))
+            return 'saved'
+        except Exception as e:
+            for campaign in CONFIG.campaigns:
+                progress_cache.invalidate(progress_key(user_id, campaign))
+            logger.error("Error saving wallet address: %s", e)
+            return None
+
+# Broadcasts
+class BroadcastEngine:
+    """Sends an admin broadcast to every user in the users table
+
+    Recipients are read in keyset-paginated chunks of chunk_size user ids, so
+    memory stays constant however many users there are. Each chunk is sent by
+    a pool of workers through the broadcast lane of the rate limiter, then its
+    delivery statuses and the last user id are checkpointed in one
+    transaction. A broadcast that was interrupted resumes after its
+    checkpoint on the next start, skipping users already recorded.
+    """
+    
+    def __init__(self, bot, store, chunk_size=BROADCAST_CHUNK_SIZE, workers=BROADCAST_WORKERS):
+        self.bot = bot
+        self.store = store
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self._running = {}
+    
+    # Queries, executed on the store threads
+    
+    @staticmethod
+    @state_query
+    def _create(conn, text, created_by):
+        with conn:
+            cursor = conn.execute('INSERT INTO broadcasts (text, created_by) VALUES (?, ?)', (text, created_by))
+        return cursor.lastrowid
+    
+    @staticmethod
+    @state_query
+    def _get(conn, broadcast_id):
+        return conn.execute('''
+        SELECT text, created_by, status, last_user_id, sent, failed
+        FROM broadcasts WHERE broadcast_id = ?
+        ''', (broadcast_id,)).fetchone()
+    
+    @staticmethod
+    @state_query
+    def _unfinished(conn):
+        return [row[0] for row in conn.execute("SELECT broadcast_id FROM broadcasts WHERE status = 'running'")]
+    
+    @staticmethod
+    @state_query
+    def _next_chunk(conn, broadcast_id, last_user_id, limit):
+        user_ids = [row[0] for row in conn.execute(
+            'SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?', (last_user_id, limit)
+        )]
+        if not user_ids:
+            return [], set()
+        delivered = {row[0] for row in conn.execute(
+            'SELECT user_id FROM broadcast_deliveries WHERE broadcast_id = ? AND user_id BETWEEN ? AND ?',
+            (broadcast_id, user_ids[0], user_ids[-1])
+        )}
+        return user_ids, delivered
+    
+    @staticmethod
+    @state_query
+    def _checkpoint(conn, broadcast_id, results, last_user_id):
+        sent = sum(1 for _, status, _ in results if status == 'sent')
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO broadcast_deliveries (broadcast_id, user_id, status, error) VALUES (?, ?, ?, ?)',
+                [(broadcast_id, user_id, status, error) for user_id, status, error in results]
+            )
+            conn.execute('''
+            UPDATE broadcasts SET sent = sent + ?, failed = failed + ?, last_user_id = MAX(last_user_id, ?)
+            WHERE broadcast_id = ?
+            ''', (sent, len(results) - sent, last_user_id, broadcast_id))
+    
+    @staticmethod
+    @state_query
+    def _finish(conn, broadcast_id):
+        with conn:
+            conn.execute(
+                "UPDATE broadcasts SET status = 'done', finished_at = CURRENT_TIMESTAMP WHERE broadcast_id = ?",
+                (broadcast_id,)
+            )
+    
+    async def start(self, text, created_by):
+        """Create a broadcast and start sending it, returns its id"""
+        broadcast_id = await self.store.write(self._create, text, created_by)
+        self._launch(broadcast_id)
+        return broadcast_id
+    
+    async def resume(self):
+        """Continue broadcasts interrupted by a restart"""
+        for broadcast_id in await self.store.read(self._unfinished):
+            logger.info("Resuming broadcast #%s", broadcast_id)
+            self._launch(broadcast_id)
+    
+    def _launch(self, broadcast_id):
+        task = start_background_task(self._run(broadcast_id), name=f'broadcast-{broadcast_id}')
+        self._running[broadcast_id] = task
+        task.add_done_callback(lambda _: self._running.pop(broadcast_id, None))
+    
+    async def _send(self, user_id, text):
+        try:
+            await self.bot.send_message(chat_id=user_id, text=text, rate_limit_args={'priority': 'broadcast'})
+            return user_id, 'sent', None
+        except Forbidden as e:
+            return user_id, 'blocked', str(e)
+        except Exception as e:
+            return user_id, 'failed', str(e)
+    
+    async def _send_chunk(self, user_ids, text, results):
+        pending = iter(user_ids)
+        
+        async def worker():
+            for user_id in pending:
+                results.append(await self._send(user_id, text))
+        
+        await asyncio.gather(*(worker() for _ in range(min(self.workers, len(user_ids)))))
+    
+    async def _run(self, broadcast_id):
+        text, created_by, status, last_user_id, _, _ = await self.store.read(self._get, broadcast_id)
+        started = time.monotonic()
+        
+        while True:
+            user_ids, delivered = await self.store.read(
+                self._next_chunk, broadcast_id, last_user_id, self.chunk_size
+            )
+            if not user_ids:
+                break
+            
+            results = []
+            try:
+                await self._send_chunk([u for u in user_ids if u not in delivered], text, results)
+            finally:
+                # On cancellation keep what was sent, without moving past the chunk
+                chunk_done = len(results) + len(delivered) == len(user_ids)
+                await self.store.write(
+                    self._checkpoint, broadcast_id, results, user_ids[-1] if chunk_done else last_user_id
+                )
+            last_user_id = user_ids[-1]
+        
+        await self.store.write(self._finish, broadcast_id)
+        _, _, _, _, sent, failed = await self.store.read(self._get, broadcast_id)
+        logger.info("Broadcast #%s finished in %.0fs: %s sent, %s failed", broadcast_id, time.monotonic() - started, sent, failed)
+        
+        if created_by:
+            try:
+                await self.bot.send_message(
+                    chat_id=created_by,
+                    text=f"📣 Broadcast #{broadcast_id} finished: {sent} delivered, {failed} failed."
+                )
+            except Exception as e:
+                logger.error("Error reporting broadcast #%s: %s", broadcast_id, e)
+
+# Funnel analytics
+class EventLog:
+    """Append-only log of funnel events: start, task view, verify and reset
+
+    record() only appends to an in-memory buffer and never waits on the
+    database. Buffered events are inserted with one executemany on the
+    store's writer thread every batch_delay seconds or batch_size events.
+    When max_buffered events are waiting because the database is behind,
+    further events are dropped and counted instead of queueing without bound.
+    """
+    
+    def __init__(self, store, batch_size=EVENT_BATCH_MAX_SIZE, batch_delay=EVENT_BATCH_MAX_DELAY,
+                 max_buffered=EVENT_BUFFER_LIMIT):
+        self.store = store
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.max_buffered = max_buffered
+        self._buffer = []
+        self._in_flight = 0
+        self._flush_handle = None
+        self._flush_future = None
+        self.written = 0
+        self.dropped = 0
+    
+    @property
+    def buffered(self):
+        """Events recorded but not yet written"""
+        return len(self._buffer) + self._in_flight
+    
+    def record(self, user_id, kind, step=None):
+        """Buffer an event for user_id"""
+        if len(self._buffer) + self._in_flight >= self.max_buffered:
+            self.dropped += 1
+            return
+        self._buffer.append((user_id, kind, step, time.time()))
+        if len(self._buffer) >= self.batch_size:
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.batch_delay, self._start_flush)
+    
+    def _start_flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._buffer:
+            return self._flush_future
+        
+        batch, self._buffer = self._buffer, []
+        self._in_flight += len(batch)
+        self._flush_future = asyncio.ensure_future(self._write(batch))
+        return self._flush_future
+    
+    async def _write(self, batch):
+        try:
+            await self.store.write(self._insert, batch)
+            self.written += len(batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.error("Error writing %s events: %s", len(batch), e)
+        finally:
+            self._in_flight -= len(batch)
+    
+    @staticmethod
+    @state_query
+    def _insert(conn, batch):
+        with conn:
+            conn.executemany(SQL_INSERT_EVENT, batch)
+    
+    async def flush(self):
+        """Write every buffered event and wait for it to reach the database"""
+        future = self._start_flush()
+        if future is not None:
+            await asyncio.shield(future)
+
+# Upper bounds in seconds of the time-between-steps histogram buckets, the
+# last bucket holds everything slower
+DURATION_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 21600, 43200, 86400)
+
+def histogram_quantile(counts, q):
+    """Upper bound of the DURATION_BUCKETS bucket holding quantile q, None if counts is empty"""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for bucket, count in enumerate(counts):
+        seen += count
+        if seen >= rank:
+            return DURATION_BUCKETS[bucket] if bucket < len(DURATION_BUCKETS) else float('inf')
+
+def format_duration(seconds):
+    """Short human readable duration, e.g. 90s -> 1.5m"""
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds >= size:
+            return f"{seconds / size:g}{unit}"
+    return f"{seconds:g}s"
+
+def format_bucket(upper_bound):
+    """Format a histogram_quantile result for /funnel"""
+    if upper_bound is None:
+        return "–"
+    if upper_bound == float('inf'):
+        return f">{format_duration(DURATION_BUCKETS[-1])}"
+    return f"≤{format_duration(upper_bound)}"
+
+class FunnelReport:
+    """Per-task funnel, time between steps and hourly cohorts built from the event log
+
+    refresh() folds events after the last processed event_id into rollup
+    tables: per-user state (first-seen hour, time of the previous step, tasks
+    viewed and verified), per-task counts of distinct users who viewed and
+    verified each task, per-task histograms of the time since the user's
+    previous step, and started/completed counts per hourly cohort. Each batch
+    of events and the new last event_id are committed together, so events are
+    counted exactly once and building the report never scans the event log.
+    """
+    
+    def __init__(self, store, batch_size=FUNNEL_ROLLUP_BATCH_SIZE):
+        self.store = store
+        self.batch_size = batch_size
+    
+    # Queries, executed on the store threads
+    
+    @staticmethod
+    @state_query
+    def _rollup(conn, batch_size):
+        """Fold the next batch_size events into the rollups, returns the number processed"""
+        last_event_id = conn.execute("SELECT value FROM stats_counters WHERE name = 'funnel_last_event'").fetchone()[0]
+        events = conn.execute(
+            'SELECT event_id, user_id, kind, step, created_at FROM events WHERE event_id > ? ORDER BY event_id LIMIT ?',
+            (last_event_id, batch_size)
+        ).fetchall()
+        if not events:
+            return 0
+        
+        user_ids = json.dumps(list({event[1] for event in events}))
+        users = {
+            row[0]: list(row[1:]) for row in conn.execute('''
+            SELECT user_id, started_hour, last_step_at, viewed_mask, verified_mask FROM funnel_users
+            WHERE user_id IN (SELECT value FROM json_each(?))
+            ''', (user_ids,))
+        }
+        steps = defaultdict(lambda: [0, 0])
+        durations = defaultdict(int)
+        cohorts = defaultdict(lambda: [0, 0])
+        counters = defaultdict(int)
+        
+        for event_id, user_id, kind, step, created_at in events:
+            state = users.get(user_id)
+            if state is None:
+                # First event of this user starts their cohort and step clock
+                state = users[user_id] = [int(created_at // 3600), created_at, 0, 0]
+                cohorts[state[0]][0] += 1
+                counters['funnel_users'] += 1
+            
+            if kind == 'start':
+                counters['funnel_starts'] += 1
+            elif kind == 'reset':
+                counters['funnel_resets'] += 1
+                state[1] = created_at
+            elif kind == 'view':
+                bit = 1 << (step - 1)
+                if not state[2] & bit:
+                    state[2] |= bit
+                    steps[step][0] += 1
+            elif kind == 'verify':
+                bit = 1 << (step - 1)
+                durations[step, bisect_left(DURATION_BUCKETS, created_at - state[1])] += 1
+                state[1] = created_at
+                if not state[3] & bit:
+                    state[3] |= bit
+                    steps[step][1] += 1
+                    if step == len(TASKS):
+                        cohorts[state[0]][1] += 1
+        
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO funnel_users (user_id, started_hour, last_step_at, viewed_mask, verified_mask) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [(user_id, *state) for user_id, state in users.items()]
+            )
+            conn.executemany('''
+            INSERT INTO funnel_steps (task, viewed, verified) VALUES (?, ?, ?)
+            ON CONFLICT(task) DO UPDATE SET viewed = viewed + excluded.viewed, verified = verified + excluded.verified
+            ''', [(task, *counts) for task, counts in steps.items()])
+            conn.executemany('''
+            INSERT INTO funnel_durations (task, bucket, count) VALUES (?, ?, ?)
+            ON CONFLICT(task, bucket) DO UPDATE SET count = count + excluded.count
+            ''', [(task, bucket, count) for (task, bucket), count in durations.items()])
+            conn.executemany('''
+            INSERT INTO funnel_cohorts (hour, started, completed) VALUES (?, ?, ?)
+            ON CONFLICT(hour) DO UPDATE SET started = started + excluded.started, completed = completed + excluded.completed
+            ''', [(hour, *counts) for hour, counts in cohorts.items()])
+            conn.executemany(
+                'UPDATE stats_counters SET value = value + ? WHERE name = ?',
+                [(value, name) for name, value in counters.items()]
+            )
+            conn.execute("UPDATE stats_counters SET value = ? WHERE name = 'funnel_last_event'", (events[-1][0],))
+        return len(events)
+    
+    @staticmethod
+    @state_query
+    def _get_report(conn, since_hour):
+        counters = dict(conn.execute("SELECT name, value FROM stats_counters WHERE name LIKE 'funnel%'"))
+        steps = {task: (viewed, verified) for task, viewed, verified in conn.execute(
+            'SELECT task, viewed, verified FROM funnel_steps'
+        )}
+        histograms = defaultdict(lambda: [0] * (len(DURATION_BUCKETS) + 1))
+        for task, bucket, count in conn.execute('SELECT task, bucket, count FROM funnel_durations'):
+            histograms[task][bucket] = count
+        cohorts = conn.execute(
+            'SELECT hour, started, completed FROM funnel_cohorts WHERE hour >= ? ORDER BY hour', (since_hour,)
+        ).fetchall()
+        return {
+            'users': counters.get('funnel_users', 0),
+            'starts': counters.get('funnel_starts', 0),
+            'resets': counters.get('funnel_resets', 0),
+            'tasks': [
+                {
+                    'viewed': steps.get(task, (0, 0))[0],
+                    'verified': steps.get(task, (0, 0))[1],
+                    'median': histogram_quantile(histograms[task], 0.5),
+                    'p90': histogram_quantile(histograms[task], 0.9),
+                }
+                for task in range(1, len(TASKS) + 1)
+            ],
+            'cohorts': cohorts
+        }
+    
+    async def refresh(self):
+        """Fold every unprocessed event into the rollups, returns the number of events processed"""
+        processed = 0
+        while True:
+            batch = await self.store.write(self._rollup, self.batch_size)
+            processed += batch
+            if batch < self.batch_size:
+                return processed
+    
+    async def get_report(self, hours=FUNNEL_COHORT_HOURS):
+        since_hour = int(time.time() // 3600) - hours + 1
+        return await self.store.read(self._get_report, since_hour)
+    
+    async def run(self, interval=FUNNEL_ROLLUP_INTERVAL):
+        """Keep the rollups current in the background"""
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error("Error updating funnel rollups: %s", e)
+            await asyncio.sleep(interval)
+
+event_log = EventLog(user_store)
+funnel_report = FunnelReport(user_store)
+
+# Database maintenance
+def seconds_until_hour(hour, now=None):
+    """Seconds from now until the next hour:00 UTC"""
+    now = now or datetime.now(timezone.utc)
+    target = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+class DatabaseMaintenance:
+    """Scheduled upkeep of the local database: snapshots, WAL checkpoints, archiving, vacuum and ANALYZE
+
+    Snapshots copy the database with the SQLite backup API through their own
+    read connection in one step. That step is a single read transaction, so
+    the copy is consistent and, with WAL, writers carry on while it runs. The
+    other jobs run on the store's writer thread between write batches, in
+    short transactions. Every job logs its duration and the pages it freed
+    and records both in the maintenance metrics.
+
+    schedule() puts the jobs on the application's job queue; run() runs the
+    same schedule as a background task where there is none (the state
+    server, or python-telegram-bot without the job-queue extra).
+    """
+    
+    def __init__(self, store, backup_dir=MAINTENANCE_BACKUP_DIR, backup_interval=MAINTENANCE_BACKUP_INTERVAL,
+                 backup_keep=MAINTENANCE_BACKUP_KEEP, archive_days=ARCHIVE_INACTIVE_DAYS, hour=MAINTENANCE_HOUR,
+                 checkpoint_interval=MAINTENANCE_CHECKPOINT_INTERVAL, batch_size=MIGRATION_BATCH_SIZE):
+        self.store = store
+        self.backup_dir = Path(backup_dir) if backup_dir else None
+        self.backup_interval = backup_interval * 3600
+        self.backup_keep = backup_keep
+        self.archive_days = archive_days
+        self.hour = hour
+        self.checkpoint_interval = checkpoint_interval
+        self.batch_size = batch_size
+    
+    # Queries, executed on the store's writer thread
+    
+    @staticmethod
+    def _freelist_count(conn):
+        return conn.execute('PRAGMA freelist_count').fetchone()[0]
+    
+    @staticmethod
+    def _auto_vacuum(conn):
+        return conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+    
+    @staticmethod
+    def _checkpoint(conn):
+        busy, wal_pages, checkpointed = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+        return busy, wal_pages, checkpointed
+    
+    @staticmethod
+    def _vacuum_step(conn, pages):
+        """Return up to pages free pages to the file system, returns the pages still free"""
+        # execute() would run only the first step, which frees a single page
+        conn.executescript(f'PRAGMA incremental_vacuum({int(pages)})')
+        return conn.execute('PRAGMA freelist_count').fetchone()[0]
+    
+    @staticmethod
+    def _analyze(conn):
+        conn.execute(f'PRAGMA analysis_limit = {MAINTENANCE_ANALYSIS_LIMIT}')
+        conn.execute('ANALYZE')
+    
+    @staticmethod
+    def _archive_batch(conn, last_key, batch_size, cutoff, skip_user_ids=()):
+        """Archive the inactive users among the next batch_size after last_key
+
+        Returns (new last_key or None when done, archived user ids). Users who
+        finished a campaign or sent a wallet stay, the payout export needs them,
+        and so do skip_user_ids, whose queued writes need their rows.
+        """
+        upper_key = _next_key_range(conn, last_key, batch_size)
+        with conn:
+            user_ids = [row[0] for row in conn.execute('''
+            SELECT user_id FROM users
+            WHERE user_id > ? AND user_id <= ? AND last_active < ?
+              AND completed_at IS NULL AND wallet_address IS NULL AND tasks_mask IS NOT NULL
+              AND user_id NOT IN (SELECT user_id FROM campaign_progress WHERE completed_at IS NOT NULL)
+              AND user_id NOT IN (SELECT value FROM json_each(?))
+            ''', (last_key, upper_key if upper_key is not None else MAX_USER_ID, cutoff, json.dumps(skip_user_ids)))]
+            if user_ids:
+                placeholders = ', '.join('?' * len(user_ids))
+                conn.execute(f'''
+                INSERT OR REPLACE INTO users_archive ({USER_COLUMNS})
+                SELECT {USER_COLUMNS} FROM users WHERE user_id IN ({placeholders})
+                ''', user_ids)
+                conn.execute(f'DELETE FROM users WHERE user_id IN ({placeholders})', user_ids)
+        return upper_key, user_ids
+    
+    # Jobs
+    
+    def _report(self, job, started, pages, detail=''):
+        elapsed = time.monotonic() - started
+        MAINTENANCE_SECONDS.observe(elapsed, job)
+        MAINTENANCE_PAGES.inc(job, amount=pages)
+        logger.info("Maintenance %s: %.2fs, %s pages reclaimed%s", job, elapsed, pages, detail)
+    
+    @staticmethod
+    def _snapshot(db_path, target):
+        """Copy db_path to target with the backup API, returns the pages copied"""
+        partial = target.with_name(target.name + '.partial')
+        source = sqlite3.connect(Path(db_path).resolve().as_uri() + '?mode=ro', uri=True)
+        try:
+            copy = sqlite3.connect(partial)
+            try:
+                source.backup(copy)
+                pages = copy.execute('PRAGMA page_count').fetchone()[0]
+            finally:
+                copy.close()
+        finally:
+            source.close()
+        os.replace(partial, target)
+        return pages
+    
+    def _snapshots(self):
+        """Existing snapshots, oldest first"""
+        return sorted(self.backup_dir.glob(f'{Path(self.store.db_path).stem}-*.db'))
+    
+    async def backup(self):
+        """Snapshot the database into backup_dir, keeping the newest backup_keep snapshots"""
+        started = time.monotonic()
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        target = self.backup_dir / f'{Path(self.store.db_path).stem}-{stamp}.db'
+        pages = await asyncio.to_thread(self._snapshot, self.store.db_path, target)
+        
+        expired = self._snapshots()[:-max(self.backup_keep, 1)]
+        for old in expired:
+            old.unlink()
+        self._report('backup', started, 0, f", {pages} pages copied to {target}, {len(expired)} old snapshots removed")
+    
+    async def checkpoint(self):
+        """Copy the WAL into the database and truncate it"""
+        started = time.monotonic()
+        busy, wal_pages, checkpointed = await self.store.write(self._checkpoint)
+        detail = ", readers kept the WAL from being truncated" if busy else ''
+        self._report('checkpoint', started, checkpointed if not busy else 0, f", {wal_pages} WAL pages{detail}")
+    
+    async def vacuum(self):
+        """Return free pages to the file system, MAINTENANCE_VACUUM_STEP pages per transaction"""
+        if await self.store.write(self._auto_vacuum) != AUTO_VACUUM_INCREMENTAL:
+            # Switching needs a full VACUUM, which would hold the writer for the whole rewrite
+            logger.warning("Skipping vacuum: incremental auto_vacuum is off, stop the bot and run 'python bot.py vacuum' once")
+            return
+        started = time.monotonic()
+        before = await self.store.write(self._freelist_count)
+        remaining = before
+        while remaining:
+            still_free = await self.store.write(self._vacuum_step, MAINTENANCE_VACUUM_STEP)
+            if still_free >= remaining:
+                break
+            remaining = still_free
+            await asyncio.sleep(MIGRATION_BATCH_PAUSE)
+        self._report('vacuum', started, before - remaining)
+    
+    async def analyze(self):
+        """Refresh the query planner statistics"""
+        started = time.monotonic()
+        await self.store.write(self._analyze)
+        self._report('analyze', started, 0)
+    
+    async def archive_inactive(self):
+        """Move users inactive for archive_days days to users_archive, returns how many"""
+        if self.archive_days <= 0:
+            return 0
+        started = time.monotonic()
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=self.archive_days)).strftime('%Y-%m-%d %H:%M:%S')
+        free_before = await self.store.write(self._freelist_count)
+        archived = 0
+        last_key = 0
+        while last_key is not None:
+            # Coalesced writes still queued would update rows archived under them: commit
+            # them first and leave out the users whose writes came in meanwhile
+            await self.store.flush()
+            last_key, user_ids = await self.store.write(
+                self._archive_batch, last_key, self.batch_size, cutoff, self.store.pending_user_ids()
+            )
+            for user_id in user_ids:
+                progress_cache.invalidate(user_id)
+            archived += len(user_ids)
+            await asyncio.sleep(MIGRATION_BATCH_PAUSE)
+        freed = await self.store.write(self._freelist_count) - free_before
+        self._report('archive', started, max(freed, 0), f", {archived} users inactive since {cutoff} archived")
+        return archived
+    
+    async def off_peak(self):
+        """The daily jobs: archiving first, so vacuum and ANALYZE see its result"""
+        await self.archive_inactive()
+        await self.vacuum()
+        await self.analyze()
+    
+    # Scheduling
+    
+    def jobs(self):
+        """(name, job, seconds between runs, seconds until the first run)"""
+        jobs = [
+            ('checkpoint', self.checkpoint, self.checkpoint_interval, self.checkpoint_interval),
+            ('off-peak', self.off_peak, 86400, seconds_until_hour(self.hour)),
+        ]
+        if self.backup_dir and self.store.db_path:
+            snapshots = self._snapshots() if self.backup_dir.exists() else []
+            # Restarts must not postpone the next snapshot
+            age = time.time() - snapshots[-1].stat().st_mtime if snapshots else self.backup_interval
+            jobs.append(('backup', self.backup, self.backup_interval, max(self.backup_interval - age, 60)))
+        return jobs
+    
+    async def _run_job(self, name, job):
+        try:
+            await job()
+        except Exception as e:
+            logger.error("Maintenance job %s failed: %s", name, e)
+    
+    def schedule(self, job_queue):
+        """Add the jobs to job_queue"""
+        for name, job, interval, first in self.jobs():
+            async def callback(context, name=name, job=job):
+                await self._run_job(name, job)
+            job_queue.run_repeating(callback, interval=interval, first=first, name=f'maintenance-{name}')
+    
+    async def run(self):
+        """Run the jobs on their schedule until cancelled"""
+        now = time.monotonic()
+        due = [[now + first, interval, name, job] for name, job, interval, first in self.jobs()]
+        while True:
+            entry = min(due, key=lambda e: e[0])
+            await asyncio.sleep(max(entry[0] - time.monotonic(), 0))
+            await self._run_job(entry[2], entry[3])
+            entry[0] += entry[1]
+
+# Participant export
+EXPORT_FETCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 64 * 1024
+# Bot API upload limit for documents
+EXPORT_MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_COLUMNS = (
+    'user_id', 'username', 'first_name', 'current_step', 'tasks_completed', 'completed_all',
+    'wallet_address', 'joined_at', 'last_active', 'completed_at', 'flagged'
+)
+# Names and wallets are typed by users; spreadsheets run CSV cells starting
+# with these as formulas, so such cells are exported behind a '
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def _csv_cell(value):
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def iter_export_rows(conn, completed_only=False, with_wallet=False, exclude_flagged=False, fetch_size=EXPORT_FETCH_SIZE):
+    """Yield EXPORT_COLUMNS tuples for users in user_id order, reading fetch_size rows at a time"""
+    all_tasks = (1 << len(TASKS)) - 1
+    conditions = []
+    if completed_only:
+        conditions.append(f'({TASKS_MASK_SQL} & {all_tasks}) = {all_tasks}')
+    if with_wallet:
+        conditions.append("COALESCE(wallet_address, '') != ''")
+    if exclude_flagged:
+        conditions.append('user_flags.user_id IS NULL')
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    
+    cursor = conn.execute(f'''
+    SELECT users.user_id, username, first_name, current_step, {TASKS_MASK_SQL},
+           wallet_address, joined_at, last_active, completed_at, user_flags.reason
+    FROM users LEFT JOIN user_flags ON user_flags.user_id = users.user_id
+    {where} ORDER BY users.user_id
+    ''')
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            return
+        for user_id, username, first_name, current_step, mask, wallet_address, joined_at, last_active, completed_at, flagged in rows:
+            mask &= all_tasks
+            yield (
+                user_id, username, first_name, current_step, bin(mask).count('1'), mask == all_tasks,
+                wallet_address, joined_at, last_active, completed_at, flagged
+            )
+
+def encode_export_rows(rows, fmt='csv', chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the export file for rows as chunks of about chunk_size encoded bytes"""
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        import csv
+        
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        
+        def write_row(row):
+            writer.writerow([_csv_cell(value) for value in row])
+    else:
+        def write_row(row):
+            buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False))
+            buffer.write('\n')
+    
+    for row in rows:
+        write_row(row)
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+def write_export(db_path, out, fmt='csv', compress=True, completed_only=False, with_wallet=False, exclude_flagged=False):
+    """Stream users from db_path into the binary file out, returns the number of users exported
+
+    Reads through its own read-only connection, so the export sees one
+    consistent snapshot and never waits for or holds up the bot's writer.
+    """
+    import gzip
+    
+    exported = 0
+    
+    def counted(rows):
+        nonlocal exported
+        for row in rows:
+            exported += 1
+            yield row
+    
+    conn = sqlite3.connect(Path(db_path).resolve().as_uri() + '?mode=ro', uri=True)
+    try:
+        sink = gzip.GzipFile(fileobj=out, mode='wb') if compress else out
+        for chunk in encode_export_rows(counted(iter_export_rows(conn, completed_only, with_wallet, exclude_flagged)), fmt):
+            sink.write(chunk)
+        if compress:
+            sink.close()
+        out.flush()
+    finally:
+        conn.close()
+    return exported
+
+def export_cli(argv):
+    """Command line export: python bot.py export [options]"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(prog='bot.py export', description='Export participants and wallets for payout')
+    parser.add_argument('--db', default=DB_PATH, help='database file (default: %(default)s)')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+    parser.add_argument('--completed', action='store_true', help='only users who completed all tasks')
+    parser.add_argument('--with-wallet', action='store_true', help='only users who sent a wallet address')
+    parser.add_argument('--exclude-flagged', action='store_true', help='leave out users flagged as suspicious')
+    parser.add_argument('--no-gzip', action='store_true', help='write uncompressed output')
+    parser.add_argument('-o', '--output', default='-', help='output file, - for stdout (default)')
+    args = parser.parse_args(argv)
+    
+    init_db(args.db)
+    out = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+    try:
+        exported = write_export(
+            args.db, out, args.format, not args.no_gzip, args.completed, args.with_wallet, args.exclude_flagged
+        )
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    logger.info("Exported %s users to %s", exported, args.output)
+
+def enable_incremental_vacuum(db_path=None):
+    """Switch a database created without incremental auto_vacuum, returns False if it already was
+
+    The switch takes a full VACUUM, which rewrites the file and blocks every
+    writer until it is done, so it runs from the command line while the bot
+    is stopped rather than as part of the nightly maintenance.
+    """
+    conn = sqlite3.connect(db_path or DB_PATH)
+    try:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+            return False
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        return True
+    finally:
+        conn.close()
+
+def vacuum_cli(argv):
+    """Command line switch to incremental vacuum: python bot.py vacuum [--db FILE]"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(
+        prog='bot.py vacuum', description='Rewrite the database once so the nightly vacuum can run incrementally'
+    )
+    parser.add_argument('--db', default=DB_PATH, help='database file (default: %(default)s)')
+    args = parser.parse_args(argv)
+    
+    init_db(args.db)
+    started = time.monotonic()
+    if enable_incremental_vacuum(args.db):
+        logger.info("Enabled incremental vacuum on %s in %.1fs", args.db, time.monotonic() - started)
+    else:
+        logger.info("%s already uses incremental vacuum", args.db)
+
+# Abuse scoring
+class AbuseScorer:
+    """In-process abuse scoring over each user's recent activity
+
+    State lives in arrays with one slot per tracked user (about 50 bytes
+    each), so memory is fixed by capacity however many users show up. They
+    are allocated on first use, so processes that never score anything don't
+    hold them. Slots are grouped in sets of ABUSE_SET_WAYS; a user hashes to
+    one set and, when it is full, takes over the slot in it that was seen
+    least recently, so idle users are evicted first.
+
+    check() runs before a handler touches the database. Clicks are limited
+    with a sliding window, verifications sooner than min_verify_interval
+    after the task screen was shown (or the previous verification) and
+    resets beyond max_resets_per_hour are refused. Refusals and shared-wallet attempts add ABUSE_POINTS to a score
+    that halves every score_half_life seconds; a user whose score reaches
+    flag_score is reported once through check()'s return value.
+    """
+    
+    def __init__(self, capacity=ABUSE_TRACKED_USERS, click_window=ABUSE_CLICK_WINDOW,
+                 max_clicks=ABUSE_MAX_CLICKS, min_verify_interval=ABUSE_MIN_VERIFY_INTERVAL,
+                 max_resets_per_hour=ABUSE_MAX_RESETS_PER_HOUR, flag_score=ABUSE_FLAG_SCORE,
+                 score_half_life=ABUSE_SCORE_HALF_LIFE):
+        self._sets = max(1, capacity // ABUSE_SET_WAYS)
+        self.capacity = self._sets * ABUSE_SET_WAYS
+        self.click_window = click_window
+        self.max_clicks = max_clicks
+        self.min_verify_interval = min_verify_interval
+        self.max_resets_per_hour = max_resets_per_hour
+        self.flag_score = flag_score
+        self.score_half_life = score_half_life
+        self._users = None
+        
+        self.throttled = 0
+        self.flagged = 0
+        self.evictions = 0
+    
+    def _allocate(self):
+        slots = self.capacity
+        self._users = array('q', bytes(8 * slots))
+        self._last_seen = array('d', bytes(8 * slots))
+        self._score = array('f', bytes(4 * slots))
+        self._flagged = array('B', bytes(slots))
+        self._last_step = array('d', bytes(8 * slots))
+        # Sliding windows: start of the current window, events in it and in the one before
+        self._click_start = array('d', bytes(8 * slots))
+        self._clicks = array('H', bytes(2 * slots))
+        self._previous_clicks = array('H', bytes(2 * slots))
+        self._reset_start = array('d', bytes(8 * slots))
+        self._resets = array('B', bytes(slots))
+        self._previous_resets = array('B', bytes(slots))
+    
+    def _slot(self, user_id):
+        """Slot of user_id, taking over the least recently seen slot of its set if needed"""
+        if self._users is None:
+            self._allocate()
+        base = ((user_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) % self._sets * ABUSE_SET_WAYS
+        last_seen = self._last_seen
+        victim = base
+        for slot in range(base, base + ABUSE_SET_WAYS):
+            if self._users[slot] == user_id:
+                return slot
+            if last_seen[slot] < last_seen[victim]:
+                victim = slot
+        
+        if self._users[victim]:
+            self.evictions += 1
+        self._users[victim] = user_id
+        for column in (self._last_seen, self._score, self._flagged, self._last_step, self._click_start,
+                       self._clicks, self._previous_clicks, self._reset_start, self._resets, self._previous_resets):
+            column[victim] = 0
+        return victim
+    
+    @staticmethod
+    def _window_rate(start, current, previous, slot, now, window):
+        """Slide the window of slot to now, returns the estimated events in the last window"""
+        elapsed = now - start[slot]
+        if elapsed >= 2 * window:
+            start[slot], current[slot], previous[slot] = now, 0, 0
+            elapsed = 0
+        elif elapsed >= window:
+            start[slot] += window
+            current[slot], previous[slot] = 0, current[slot]
+            elapsed -= window
+        return previous[slot] * (1 - elapsed / window) + current[slot]
+    
+    def record_view(self, user_id, now=None):
+        """Start the verify timer once a task screen has been shown"""
+        slot = self._slot(user_id)
+        self._last_step[slot] = time.monotonic() if now is None else now
+    
+    def check(self, user_id, action, now=None):
+        """Score a 'click', 'verify', 'reset' or 'wallet_reuse' by user_id
+
+        Returns (allowed, flag_reason): allowed is False if the action should
+        be refused, flag_reason is set when this action made the user cross
+        flag_score.
+        """
+        now = time.monotonic() if now is None else now
+        slot = self._slot(user_id)
+        score = self._score[slot]
+        if score:
+            score *= 0.5 ** ((now - self._last_seen[slot]) / self.score_half_life)
+        self._last_seen[slot] = now
+        
+        # Every action is a click; refused clicks count too so flooding stays throttled
+        clicks = self._window_rate(self._click_start, self._clicks, self._previous_clicks, slot, now, self.click_window)
+        self._clicks[slot] = min(self._clicks[slot] + 1, 0xFFFF)
+        
+        violation = None
+        if clicks >= self.max_clicks:
+            violation = 'click'
+        elif action == 'verify':
+            if now - self._last_step[slot] < self.min_verify_interval:
+                violation = 'verify'
+            else:
+                self._last_step[slot] = now
+        elif action == 'reset':
+            resets = self._window_rate(self._reset_start, self._resets, self._previous_resets, slot, now, 3600)
+            if resets >= self.max_resets_per_hour:
+                violation = 'reset'
+            else:
+                self._resets[slot] = min(self._resets[slot] + 1, 0xFF)
+        elif action == 'wallet_reuse':
+            violation = 'wallet_reuse'
+        
+        flag_reason = None
+        if violation:
+            if violation != 'wallet_reuse':
+                self.throttled += 1
+            score += ABUSE_POINTS[violation]
+            if score >= self.flag_score and not self._flagged[slot]:
+                self._flagged[slot] = 1
+                self.flagged += 1
+                flag_reason = violation
+        self._score[slot] = score
+        return violation is None or violation == 'wallet_reuse', flag_reason
+    
+    def score(self, user_id, now=None):
+        """Current score of user_id, 0 if not tracked"""
+        if self._users is None:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        base = ((user_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) % self._sets * ABUSE_SET_WAYS
+        for slot in range(base, base + ABUSE_SET_WAYS):
+            if self._users[slot] == user_id:
+                return self._score[slot] * 0.5 ** ((now - self._last_seen[slot]) / self.score_half_life)
+        return 0.0
+
+abuse_scorer = AbuseScorer()
+
+async def check_abuse(user_id, action):
+    """Score action with abuse_scorer, returns False if the handler should refuse it"""
+    allowed, flag_reason = abuse_scorer.check(user_id, action)
+    if not allowed:
+        logger.info("Throttled %s by user %s", action, user_id)
+    if flag_reason:
+        logger.warning("User %s flagged as suspicious (%s)", user_id, flag_reason)
+        try:
+            await user_store.flag_user(user_id, abuse_scorer.score(user_id), flag_reason)
+        except Exception as e:
+            logger.error("Error flagging user %s: %s", user_id, e)
+    return allowed
+
+# Screen rendering
+# Task, progress and completion screens depend only on the config and the
+# user's completion state, so the rendered text and keyboard for each state are
+# memoized. apply_config() drops them whenever the config changes.
+RENDER_CACHE_SIZE = 4096
+
+def campaign_callback(campaign, action):
+    """Callback data for a button of campaign; main campaign buttons carry no prefix"""
+    return action if campaign == MAIN_CAMPAIGN else f"{campaign}:{action}"
+
+def parse_callback(data):
+    """Split callback data into (campaign, action)"""
+    campaign, _, action = data.rpartition(':')
+    return campaign or MAIN_CAMPAIGN, action
+
+def completion_mask(tasks_completed):
+    """Pack a list of per-task completion flags into a bitmask"""
+    mask = 0
+    for i, done in enumerate(tasks_completed):
+        if done:
+            mask |= 1 << i
+    return mask
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def render_task_screen(task_number, completed_mask, campaign=MAIN_CAMPAIGN):
+    """Render the task screen as (text, reply_markup)"""
+    # The campaign or task may have been dropped by a reload since the click was checked
+    current = get_campaign(campaign)
+    campaign, tasks = current.key, current.tasks
+    task_number = min(task_number, len(tasks))
+    task = tasks[task_number - 1]
+    total_tasks = len(tasks)
+    completed_count = sum(completed_mask >> i & 1 for i in range(total_tasks))
+    
+    # Create progress summary
+    progress_lines = ["📊 *Your Progress:*"]
+    for i, t in enumerate(tasks, 1):
+        status = "✅" if completed_mask >> (i - 1) & 1 else "⭕"
+        current = "📍" if i == task_number else ""
+        progress_lines.append(f"{current} {status} Task {i}: {t['name']}")
+    progress_text = "\n".join(progress_lines)
+    
+    # Task message
+    message = f"""
+💰 *Task {task_number}: {task['name']}*
+
+{task['description']}
+
+{task['verification_text']}
+
+{progress_text}
+
+✅ Completed: {completed_count}/{total_tasks}
+
+*Remember:* Complete this task first, then click verification button.
+"""
+    
+    # Create buttons
+    keyboard = [
+        [InlineKeyboardButton("🔗 Open Link", url=task['url'])],
+        [InlineKeyboardButton(task['button_text'], callback_data=campaign_callback(campaign, f"verify_{task_number}"))]
+    ]
+    
+    # Navigation buttons
+    nav_buttons = []
+    if task_number > 1:
+        nav_buttons.append(InlineKeyboardButton("◀️ Previous", callback_data=campaign_callback(campaign, f"task_{task_number-1}")))
+    
+    if task_number < total_tasks:
+        nav_buttons.append(InlineKeyboardButton("Next ▶️", callback_data=campaign_callback(campaign, f"task_{task_number+1}")))
+    else:
+        nav_buttons.append(InlineKeyboardButton("🏁 Finish", callback_data=campaign_callback(campaign, "finish_all")))
+    
+    keyboard.append(nav_buttons)
+    
+    return message, InlineKeyboardMarkup(keyboard)
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def render_progress_screen(completed_mask, current_step, campaign=MAIN_CAMPAIGN):
+    """Render the /progress screen as (text, reply_markup)"""
+    current = get_campaign(campaign)
+    campaign, tasks = current.key, current.tasks
+    total_tasks = len(tasks)
+    completed = [bool(completed_mask >> i & 1) for i in range(total_tasks)]
+    completed_count = sum(completed)
+    current_step = resume_step(completed, current_step)
+    
+    # Create progress visualization
+    progress_bar = "".join(
+        "🟢" if completed[i] else ("🟡" if i + 1 == current_step else "⚪")
+        for i in range(total_tasks)
+    )
+    
+    breakdown = "".join(
+        f"{i}. {task['name']}: "
+        f"{'✅ Completed' if completed[i-1] else ('⏳ Current' if i == current_step else '📝 Pending')}\n"
+        for i, task in enumerate(tasks, 1)
+    )
+    
+    if completed_count == total_tasks:
+        footer = f"\n🎉 *Ready to claim!*\nContact admins: {' or '.join(ADMINS)}"
+    else:
+        current_task = tasks[current_step-1]
+        footer = f"\n👉 *Current Task:* {current_task['name']}"
+    
+    progress_text = f"""
+📊 *Your Airdrop Progress*
+
+{progress_bar}
+✅ {completed_count}/{total_tasks} tasks completed
+
+*Current Status:* {'🎉 All Tasks Completed!' if completed_count == total_tasks else f'Task {current_step} of {total_tasks}'}
+
+📋 *Task Breakdown:*
+{breakdown}{footer}"""
+    
+    keyboard = []
+    if completed_count < total_tasks:
+        keyboard.append([InlineKeyboardButton("➡️ Continue Tasks", callback_data=campaign_callback(campaign, f"task_{current_step}"))])
+    else:
+        keyboard.append([InlineKeyboardButton("📤 Contact Admins", callback_data=campaign_callback(campaign, "finish_all"))])
+    
+    keyboard.append([InlineKeyboardButton("🔄 Restart", callback_data=campaign_callback(campaign, "restart_airdrop"))])
+    
+    return progress_text, InlineKeyboardMarkup(keyboard)
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def _completion_screen_parts(campaign=MAIN_CAMPAIGN):
+    parts = tuple(get_campaign(campaign).messages['completion'].split('{username}'))
+    
+    keyboard = [
+        [InlineKeyboardButton(f"📤 Contact Admin {i}", url=f"https://t.me/{admin.replace('@', '')}")]
+        for i, admin in enumerate(ADMINS, 1)
+    ]
+    keyboard.append([InlineKeyboardButton("🔄 Restart Airdrop", callback_data=campaign_callback(campaign, "restart_airdrop"))])
+    
+    return parts, InlineKeyboardMarkup(keyboard)
+
+def render_completion_screen(username, campaign=MAIN_CAMPAIGN):
+    """Render the completion screen as (text, reply_markup)"""
+    parts, reply_markup = _completion_screen_parts(campaign)
+    return username.join(parts), reply_markup
+
+def invalidate_render_cache():
+    """Drop all memoized screens, called by apply_config"""
+    render_task_screen.cache_clear()
+    render_progress_screen.cache_clear()
+    _completion_screen_parts.cache_clear()
+
+# Idempotent callbacks
+class RecentCallbacks:
+    """The last button handled on each recent message, to recognize repeated clicks
+
+    Users double-tap and Telegram redelivers updates it got no answer for. A
+    click is a repeat when the same user clicked the same button on the same
+    message less than window seconds earlier. A different button clicked
+    there in between makes it a new click, so going back and forth between
+    tasks is never mistaken for a repeat. At most capacity messages are
+    remembered, the least recently clicked are forgotten first.
+    """
+    
+    def __init__(self, window=CALLBACK_REPEAT_WINDOW, capacity=CALLBACK_REPEAT_TRACKED):
+        self.window = window
+        self.capacity = capacity
+        self._last = OrderedDict()
+        self.repeats = 0
+    
+    def is_repeat(self, user_id, message_id, data, now=None):
+        """True if the click repeats the last one on the message, otherwise remember it"""
+        now = time.monotonic() if now is None else now
+        key = (user_id, message_id)
+        last = self._last.get(key)
+        if last is not None and last[0] == data and now - last[1] < self.window:
+            self.repeats += 1
+            return True
+        self._last[key] = (data, now)
+        self._last.move_to_end(key)
+        if len(self._last) > self.capacity:
+            self._last.popitem(last=False)
+        return False
+
+class ShownScreens:
+    """Text and keyboard each recent message was last edited to
+
+    Editing a message to what it already shows costs an API call and fails
+    with "message is not modified", so edit_screen() skips such edits.
+    """
+    
+    def __init__(self, capacity=SHOWN_SCREENS_TRACKED):
+        self.capacity = capacity
+        self._screens = OrderedDict()
+        self.skipped = 0
+    
+    def get(self, key):
+        return self._screens.get(key)
+    
+    def remember(self, key, screen):
+        self._screens[key] = screen
+        self._screens.move_to_end(key)
+        if len(self._screens) > self.capacity:
+            self._screens.popitem(last=False)
+    
+    def forget(self, key):
+        self._screens.pop(key, None)
+
+recent_callbacks = RecentCallbacks()
+shown_screens = ShownScreens()
+
+def _query_message_key(query):
+    if query.message is not None:
+        return query.message.chat.id, query.message.message_id
+    return query.inline_message_id
+
+async def edit_screen(query, text, reply_markup=None, **kwargs):
+    """Edit the message of a callback query to text and reply_markup, unless it already shows them"""
+    key = _query_message_key(query)
+    screen = (text, reply_markup)
+    if shown_screens.get(key) == screen:
+        shown_screens.skipped += 1
+        return
+    try:
+        await query.edit_message_text(text=text, reply_markup=reply_markup, **kwargs)
+    except BadRequest as e:
+        # Edits made elsewhere (another device, a lost record) can still hit an unchanged message
+        if 'message is not modified' not in e.message.lower():
+            shown_screens.forget(key)
+            raise
+    shown_screens.remember(key, screen)
+
+# Screen transitions
+class ScreenTransitions:
+    """Follow-up screens shown a moment after a confirmation, without holding the handler
+
+    schedule() arms a loop timer per user and returns at once, so the click's
+    handler finishes in milliseconds instead of sleeping through the pause.
+    When the timer fires the follow-up runs as a background task. A user has
+    at most one pending follow-up: scheduling another, or a newer click,
+    message or command calling cancel(), drops the old one so it cannot
+    overwrite or bury a newer screen.
+    On shutdown flush() shows the waiting follow-ups at once.
+    """
+    
+    def __init__(self, delay=SCREEN_TRANSITION_DELAY):
+        self.delay = delay
+        self._pending = {}
+        self._follow_ups = {}
+        self.scheduled = 0
+        self.cancelled = 0
+    
+    def __len__(self):
+        return len(self._pending)
+    
+    def schedule(self, user_id, fn, *args):
+        """Run fn(*args) for user_id after delay seconds"""
+        self.cancel(user_id)
+        self._pending[user_id] = asyncio.get_running_loop().call_later(self.delay, self._fire, user_id, fn, args)
+        self._follow_ups[user_id] = (fn, args)
+        self.scheduled += 1
+    
+    def cancel(self, user_id):
+        """Drop user_id's pending follow-up, also if it is already running"""
+        pending = self._pending.pop(user_id, None)
+        self._follow_ups.pop(user_id, None)
+        if pending is not None:
+            pending.cancel()
+            self.cancelled += 1
+    
+    def cancel_all(self):
+        for user_id in list(self._pending):
+            self.cancel(user_id)
+    
+    async def flush(self):
+        """Show the waiting follow-ups now and wait for all of them, so a shutdown does not skip any"""
+        for user_id, (fn, args) in list(self._follow_ups.items()):
+            self._pending[user_id].cancel()
+            self._fire(user_id, fn, args)
+        await asyncio.gather(*self._pending.values(), return_exceptions=True)
+    
+    def _fire(self, user_id, fn, args):
+        del self._follow_ups[user_id]
+        self._pending[user_id] = start_background_task(self._run(user_id, fn, args), name=f'transition-{user_id}')
+    
+    async def _run(self, user_id, fn, args):
+        try:
+            await fn(*args)
+        except Exception as e:
+            logger.error("Error showing the next screen to %s: %s", user_id, e)
+        finally:
+            if self._pending.get(user_id) is asyncio.current_task():
+                del self._pending[user_id]
+
+screen_transitions = ScreenTransitions()
+
+# Bot Handlers
+MEMBERSHIP_REFUSALS = {
+    False: "❌ We couldn't find you there yet. Please join using the link above, then verify again.",
+    None: "⚠️ Could not check your membership right now. Please try again in a moment.",
+}
+
+ABUSE_REFUSALS = {
+    'click': "⏳ Too many clicks, please slow down.",
+    'verify': "⏳ Please complete the task before verifying it.",
+    'reset': "⏳ You have reset your progress too often. Please try again later.",
+}
+
+def record_event(user_id, campaign, kind, step=None):
+    """Record a funnel event; /funnel follows the main campaign only"""
+    if campaign == MAIN_CAMPAIGN:
+        event_log.record(user_id, kind, step)
+
+@timed(HANDLER_SECONDS, HANDLER_ERRORS)
+async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /start command"""
+    user = update.effective_user
+    user_id = user.id
+    username = user.username or "NoUsername"
+    first_name = user.first_name or "User"
+    # The screens sent below replace whatever a pending follow-up would have shown
+    screen_transitions.cancel(user_id)
+    
+    # Deep links (t.me/<bot>?start=<campaign>) pick the campaign, a plain /start the default one
+    campaign = context.args[0] if context.args and context.args[0] in CONFIG.campaigns else CONFIG.default_campaign
+    
+    logger.info("User %s (@%s) started the bot (%s)", user_id, username, campaign,
+                extra={'user_id': user_id, 'campaign': campaign})
+    
+    # Register user
+    await UserManager.get_or_create_user(user_id, username, first_name)
+    record_event(user_id, campaign, 'start')
+    
+    # Get user progress
+    progress = await UserManager.get_user_progress(user_id)
+    if progress and progress['active_campaign'] != campaign:
+        await UserManager.enroll(user_id, campaign)
+    
+    # Welcome message
+    welcome_text = get_campaign(campaign).messages['welcome']
+    
+    keyboard = [
+        [InlineKeyboardButton("🚀 Start Tasks", callback_data=campaign_callback(campaign, "start_tasks"))],
+        [InlineKeyboardButton("📊 My Progress", callback_data=campaign_callback(campaign, "check_progress"))]
+    ]
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await update.message.reply_text(
+        welcome_text,
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+
+@timed(HANDLER_SECONDS, HANDLER_ERRORS)
+async def show_task_screen(update: Update, context: ContextTypes.DEFAULT_TYPE, task_number: int, user_id: int = None,
+                           campaign: str = MAIN_CAMPAIGN):
+    """Display a specific task to user"""
+    if not user_id:
+        user_id = update.effective_user.id
+    
+    if update.callback_query:
+        query = update.callback_query
+        await query.answer()
+    
+    if task_number > len(get_campaign(campaign).tasks):
+        await show_completion_screen(update, context, user_id, campaign)
+        return
+    
+    progress = await UserManager.get_user_progress(user_id, campaign)
+    
+    if not progress:
+        await context.bot.send_message(
+            chat_id=user_id,
+            text="❌ Please use /start to begin the airdrop."
+        )
+        return
+    
+    record_event(user_id, campaign, 'view', task_number)
+    message, reply_markup = render_task_screen(task_number, completion_mask(progress['tasks_completed']), campaign)
+    
+    # Send or edit message
+    try:
+        if update.callback_query:
+            await edit_screen(
+                update.callback_query,
+                message,
+                reply_markup,
+                parse_mode='Markdown',
+                disable_web_page_preview=True
+            )
+        else:
+            await context.bot.send_message(
+                chat_id=user_id,
+                text=message,
+                reply_markup=reply_markup,
+                parse_mode='Markdown',
+                disable_web_page_preview=True
+            )
+        # The verify timer starts once the screen is up, after any transition delay and the round trip
+        abuse_scorer.record_view(user_id)
+    except Exception as e:
+        logger.error("Error showing task screen: %s", e)
+
+@timed(HANDLER_SECONDS, HANDLER_ERRORS)
+async def show_completion_screen(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int = None,
+                                 campaign: str = MAIN_CAMPAIGN):
+    """Show completion screen after all tasks"""
+    if not user_id:
+        user_id = update.effective_user.id
+    
+    if update.callback_query:
+        query = update.callback_query
+        await query.answer()
+    
+    user = update.effective_user
+    username = user.username or "NoUsername"
+    
+    completion_message, reply_markup = render_completion_screen(username, campaign)
+    
+    try:
+        if update.callback_query:
+            await edit_screen(
+                update.callback_query,
+                completion_message,
+                reply_markup,
+                parse_mode='Markdown'
+            )
+        else:
+            await context.bot.send_message(
+                chat_id=user_id,
+                text=completion_message,
+                reply_markup=reply_markup,
+                parse_mode='Markdown'
+            )
+    except Exception as e:
+        logger.error("Error showing completion screen: %s", e)
+
+@timed(HANDLER_SECONDS, HANDLER_ERRORS)
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle all button callbacks"""
     query = update.callback_query
+    user_id = query.from_user.id
+    campaign, data = parse_callback(query.data)
+    
+    # Double-taps and redelivered updates only need their spinner stopped
+    if recent_callbacks.is_repeat(user_id, _query_message_key(query), query.data):
+        await query.answer()
+        return
+    
+    # Buttons of a campaign that has since been removed from the config
+    if campaign not in CONFIG.campaigns:
+        await query.answer("This campaign has ended. Use /start to see the current one.", show_alert=True)
+        return
+    tasks = get_campaign(campaign).tasks
+    
+    # Buttons rendered before a config reload may point at a task that is gone
+    if data.startswith(("task_", "verify_")) and not 1 <= int(data.split("_")[1]) <= len(tasks):
+        await query.answer("This task no longer exists. Use /start to continue.", show_alert=True)
+        return
+    
+    # Refuse abusive clicks before they reach the database
+    action = 'verify' if data.startswith("verify_") else 'reset' if data == "restart_airdrop" else 'click'
+    if not await check_abuse(user_id, action):
+        await query.answer(ABUSE_REFUSALS[action], show_alert=action != 'click')
+        return
+    
+    # Group and channel tasks are checked with Telegram instead of trusting the click
+    if action == 'verify':
+        chat_id = tasks[int(data.split("_")[1]) - 1].get('chat_id')
+        if chat_id:
+            is_member = await context.bot_data['membership'].is_member(chat_id, user_id)
+            if not is_member:
+                await query.answer(MEMBERSHIP_REFUSALS[is_member], show_alert=True)
+                return
     await query.answer()
+    # This click shows its own screen, a follow-up still pending from an earlier one would overwrite it
+    screen_transitions.cancel(user_id)
+    
+    click_logger.info("Button clicked by %s: %s", user_id, query.data, extra={'user_id': user_id, 'data': query.data})
+    
+    if data == "start_tasks":
+        # Start from task 1
+        await UserManager.update_user_step(user_id, 1, campaign)
+        await show_task_screen(update, context, 1, user_id, campaign)
+    
+    elif data == "check_progress":
+        await progress_command(update, context, campaign)
+    
+    elif data.startswith("task_"):
+        task_num = int(data.split("_")[1])
+        await UserManager.update_user_step(user_id, task_num, campaign)
+        await show_task_screen(update, context, task_num, user_id, campaign)
+    
+    elif data.startswith("verify_"):
+        task_num = int(data.split("_")[1])
+        
+        # Mark task as completed
+        await UserManager.mark_task_completed(user_id, task_num, campaign)
+        record_event(user_id, campaign, 'verify', task_num)
+        
+        # Show success message
+        await edit_screen(
+            query,
+            f"✅ *Task {task_num} Verified!*\n\nMoving to next task...",
+            parse_mode='Markdown'
+        )
+        
+        # Move to next task or show completion once the confirmation has been seen
+        if task_num < len(tasks):
+            screen_transitions.schedule(user_id, show_task_screen, update, context, task_num + 1, user_id, campaign)
+        else:
+            screen_transitions.schedule(user_id, show_completion_screen, update, context, user_id, campaign)
+    
+    elif data == "finish_all":
+        await show_completion_screen(update, context, user_id, campaign)
+    
+    elif data == "restart_airdrop":
+        # Reset progress
+        await UserManager.reset_user_progress(user_id, campaign)
+        record_event(user_id, campaign, 'reset')
+        
+        await edit_screen(
+            query,
+            "🔄 *Progress Reset!* Starting from the beginning...",
+            parse_mode='Markdown'
+        )
+        
+        screen_transitions.schedule(user_id, show_task_screen, update, context, 1, user_id, campaign)
+
+@timed(HANDLER_SECONDS, HANDLER_ERRORS)
+async def progress_command(update: Update, context: ContextTypes.DEFAULT_TYPE, campaign: str = None):
+    """Handle /progress command"""
+    user_id = update.effective_user.id
+    screen_transitions.cancel(user_id)
+    if campaign is None:
+        campaign = await UserManager.get_active_campaign(user_id)
+    progress = await UserManager.get_user_progress(user_id, campaign)
+    
+    if not progress:
+        await update.effective_message.reply_text("Please use /start to begin the airdrop.")
+        return
+    
+    progress_text, reply_markup = render_progress_screen(
+        completion_mask(progress['tasks_completed']),
+        progress['current_step'],
+        campaign
+    )
+    
+    try:
+        if update.message:
+            await update.message.reply_text(
+                progress_text,
+                reply_markup=reply_markup,
+                parse_mode='Markdown'
+            )
+        elif update.callback_query:
+            await edit_screen(
+                update.callback_query,
+                progress_text,
+                reply_markup,
+                parse_mode='Markdown'
+            )
+    except Exception as e:
+        logger.error("Error in progress command: %s", e)
+
+@timed(HANDLER_SECONDS, HANDLER_ERRORS)
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /help command"""
+    screen_transitions.cancel(update.effective_user.id)
+    campaign = await UserManager.get_active_campaign(update.effective_user.id)
+    help_text = get_campaign(campaign).messages['help']
+    await update.message.reply_text(help_text, parse_mode='Markdown')
+
+@timed(HANDLER_SECONDS, HANDLER_ERRORS)
+async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /reset command"""
+    user_id = update.effective_user.id
+    
+    if not await check_abuse(user_id, 'reset'):
+        await update.message.reply_text(ABUSE_REFUSALS['reset'])
+        return
+    
+    screen_transitions.cancel(user_id)
+    campaign = await UserManager.get_active_campaign(user_id)
+    await UserManager.reset_user_progress(user_id, campaign)
+    record_event(user_id, campaign, 'reset')
+    
+    keyboard = [
+        [InlineKeyboardButton("🚀 Start Airdrop", callback_data=campaign_callback(campaign, "start_tasks"))]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await update.message.reply_text(
+        "🔄 *Your progress has been reset!*\n\nClick below to start the airdrop from the beginning.",
+        reply_markup=reply_markup,
+        parse_mode='Markdown'
+    )
+
+def is_admin(user):
+    """Check if a Telegram user is one of ADMINS"""
+    return f"@{user.username}" in ADMINS
+
+@timed(HANDLER_SECONDS, HANDLER_ERRORS)
+async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /stats command (admin only)"""
+    user = update.effective_user
+    
+    # Check if user is admin
+    if not is_admin(user):
+        await update.message.reply_text("❌ Admin only command.")
+        return
+    
+    campaign = context.args[0] if context.args else MAIN_CAMPAIGN
+    if campaign not in CONFIG.campaigns:
+        await update.message.reply_text(f"❌ Unknown campaign. Campaigns: {', '.join(CONFIG.campaigns)}")
+        return
+    if campaign != MAIN_CAMPAIGN:
+        await campaign_stats(update, campaign)
+        return
+    
+    try:
+        # Get statistics
+        stats = await user_store.get_stats()
+        total_users = stats['total_users']
+        completed_users = stats['completed_users']
+        today_users = stats['today_users']
+        recent_completions = stats['recent_completions']
+        
+        funnel_text = "".join(
+            f"{i}. {task['name']}: {completed}\n"
+            for i, (task, completed) in enumerate(zip(TASKS, stats['task_completions']), 1)
+        )
+        
+        stats_text = f"""
+📊 *Admin Statistics*
+
+👥 Total Users: {total_users}
+✅ Completed All Tasks: {completed_users}
+📅 New Users Today: {today_users}
+🤖 Flagged Users: {stats['flagged_users']} ({abuse_scorer.throttled} actions throttled since start)
+🚩 Flagged Wallets: {stats['flagged_wallets'].get('shared', 0)} shared, {stats['flagged_wallets'].get('invalid', 0)} invalid
+📈 Completion Rate: {(completed_users/total_users*100 if total_users > 0 else 0):.1f}%
+🗄 Progress Cache: {len(progress_cache)}/{progress_cache.capacity} users, {progress_cache.hits} hits, {progress_cache.misses} misses ({progress_cache.hit_rate*100:.1f}%)
+
+📋 *Completions per Task:*
+{funnel_text}
+🏆 *Recent Completers:*
+"""
+        
+        if recent_completions:
+            for username, completed_at in recent_completions:
+                stats_text += f"• @{username or 'NoUsername'} - {completed_at}\n"
+        else:
+            stats_text += "No completions yet\n"
+        
+        campaign_totals = await user_store.get_campaign_totals()
+        if campaign_totals:
+            stats_text += "\n🗂 *Other Campaigns* (/stats <campaign>):\n"
+            for key, (participants, completed) in campaign_totals.items():
+                stats_text += f"• {key}: {participants} users, {completed} completed\n"
+        
+        await update.message.reply_text(stats_text, parse_mode='Markdown')
+        
+    except Exception as e:
+        logger.error("Error in admin_stats: %s", e)
+        await update.message.reply_text(f"Error getting statistics: {e}")
+
+async def campaign_stats(update: Update, campaign):
+    """Reply with the /stats of a campaign other than the main one"""
+    try:
+        stats = await user_store.get_campaign_stats(campaign)
+        total_users = stats['total_users']
+        completed_users = stats['completed_users']
+        
+        funnel_text = "".join(
+            f"{i}. {task['name']}: {completed}\n"
+            for i, (task, completed) in enumerate(zip(get_campaign(campaign).tasks, stats['task_completions']), 1)
+        )
+        
+        stats_text = f"""
+📊 *Campaign Statistics: {get_campaign(campaign).name}*
+
+👥 Participants: {total_users}
+✅ Completed All Tasks: {completed_users}
+📈 Completion Rate: {(completed_users/total_users*100 if total_users > 0 else 0):.1f}%
+
+📋 *Completions per Task:*
+{funnel_text}
+🏆 *Recent Completers:*
+"""
+        
+        if stats['recent_completions']:
+            for username, completed_at in stats['recent_completions']:
+                stats_text += f"• @{username or 'NoUsername'} - {completed_at}\n"
+        else:
+            stats_text += "No completions yet\n"
+        
+        await update.message.reply_text(stats_text, parse_mode='Markdown')
+        
+    except Exception as e:
+        logger.error("Error in campaign_stats: %s", e)
+        await update.message.reply_text(f"Error getting statistics: {e}")
+
+@timed(HANDLER_SECONDS, HANDLER_ERRORS)
+async def funnel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /funnel command (admin only)"""
+    user = update.effective_user
+    
+    if not is_admin(user):
+        await update.message.reply_text("❌ Admin only command.")
+        return
+    
+    try:
+        # Include events from the last few seconds that are still buffered
+        await event_log.flush()
+        await funnel_report.refresh()
+        report = await funnel_report.get_report()
+        
+        funnel_text = ""
+        previous = report['users']
+        for i, (task, step) in enumerate(zip(TASKS, report['tasks']), 1):
+            drop_off = (1 - step['verified'] / previous) * 100 if previous else 0
+            funnel_text += (
+                f"{i}. {task['name']}\n"
+                f"   👀 {step['viewed']} viewed, ✅ {step['verified']} verified, 📉 {drop_off:.1f}% drop-off\n"
+                f"   ⏱ median {format_bucket(step['median'])}, p90 {format_bucket(step['p90'])}\n"
+            )
+            previous = step['verified']
+        
+        cohort_text = "".join(
+            f"{datetime.fromtimestamp(hour * 3600, timezone.utc):%m-%d %H:00}: {started} → {completed}"
+            f" ({completed / started * 100 if started else 0:.0f}%)\n"
+            for hour, started, completed in report['cohorts']
+        ) or "No new users yet\n"
+        
+        funnel_message = f"""
+📉 *Task Funnel*
+
+👥 Users: {report['users']}
+🚀 /start Presses: {report['starts']}
+🔄 Resets: {report['resets']}
+🗒 Events: {event_log.written} written, {event_log.dropped} dropped
+
+📋 *Per Task (time since previous step):*
+{funnel_text}
+🕐 *Hourly Cohorts, UTC (started → completed):*
+{cohort_text}"""
+        
+        await update.message.reply_text(funnel_message, parse_mode='Markdown')
+        
+    except Exception as e:
+        logger.error("Error in funnel_command: %s", e)
+        await update.message.reply_text(f"Error building funnel report: {e}")
+
+@timed(HANDLER_SECONDS, HANDLER_ERRORS)
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /export command (admin only)"""
+    user = update.effective_user
+    
+    if not is_admin(user):
+        await update.message.reply_text("❌ Admin only command.")
+        return
+    
+    options = {arg.lower() for arg in context.args}
+    if options - {'completed', 'wallet', 'unflagged', *EXPORT_FORMATS}:
+        await update.message.reply_text(
+            "Usage: /export [csv|jsonl] [completed] [wallet] [unflagged]\n\n"
+            "completed - only users who finished all tasks\n"
+            "wallet - only users who sent a wallet address\n"
+            "unflagged - leave out users flagged as suspicious"
+        )
+        return
+    fmt = 'jsonl' if 'jsonl' in options else 'csv'
+    
+    if user_store.db_path is None:
+        await update.message.reply_text("The database is on the state server, run `python bot.py export` there.",
+                                        parse_mode='Markdown')
+        return
+    
+    import tempfile
+    
+    try:
+        # Queued writes would be missing from the export's snapshot
+        await user_store.flush()
+        with tempfile.TemporaryFile() as out:
+            exported = await asyncio.to_thread(
+                write_export, user_store.db_path, out, fmt, True,
+                'completed' in options, 'wallet' in options, 'unflagged' in options
+            )
+            if out.tell() > EXPORT_MAX_DOCUMENT_SIZE:
+                await update.message.reply_text(
+                    f"❌ Export of {exported} users is too large to send, use `python bot.py export` on the server.",
+                    parse_mode='Markdown'
+                )
+                return
+            out.seek(0)
+            await update.message.reply_document(
+                document=out,
+                filename=f"participants-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.{fmt}.gz",
+                caption=f"📦 {exported} users exported"
+            )
+        logger.info("Export of %s users sent to @%s", exported, user.username)
+    except Exception as e:
+        logger.error("Error in export_command: %s", e)
+        await update.message.reply_text(f"Error exporting users: {e}")
+
+@timed(HANDLER_SECONDS, HANDLER_ERRORS)
+async def reload_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /reload command (admin only)"""
+    user = update.effective_user
+    
+    if not is_admin(user):
+        await update.message.reply_text("❌ Admin only command.")
+        return
+    
+    try:
+        config = await reload_config()
+        await update.message.reply_text(
+            f"✅ Config reloaded from {config.path or 'built-in defaults'}: "
+            f"{len(config.tasks)} tasks, {len(config.admins)} admins"
+        )
+    except Exception as e:
+        logger.error("Error reloading config: %s", e)
+        await update.message.reply_text(f"❌ Config not reloaded, still using the previous one: {e}")
+
+@timed(HANDLER_SECONDS, HANDLER_ERRORS)
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /broadcast command (admin only)"""
+    user = update.effective_user
+    
+    if not is_admin(user):
+        await update.message.reply_text("❌ Admin only command.")
+        return
+    
+    # Keep the admin's line breaks, context.args would collapse them
+    text = update.message.text.partition(' ')[2].strip()
+    if not text:
+        await update.message.reply_text("Usage: /broadcast <message to send to all users>")
+        return
+    
+    try:
+        broadcast_id = await context.bot_data['broadcasts'].start(text, update.effective_chat.id)
+        logger.info("Broadcast #%s started by @%s", broadcast_id, user.username)
+        await update.message.reply_text(
+            f"📣 Broadcast #{broadcast_id} started. You will get a report when it is finished."
+        )
+    except Exception as e:
+        logger.error("Error starting broadcast: %s", e)
+        await update.message.reply_text(f"Error starting broadcast: {e}")
+
+@timed(HANDLER_SECONDS, HANDLER_ERRORS)
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle regular text messages"""
+    user_id = update.effective_user.id
+    message_text = update.message.text
+    # A follow-up still pending from an earlier click would land after this reply
+    screen_transitions.cancel(user_id)
+    
+    # Check if this is a wallet address
+    wallet = parse_wallet_address(message_text)
+    if wallet:
+        result = await UserManager.save_wallet_address(user_id, message_text.strip(), wallet[1])
+        if result == 'saved':
+            campaign = await UserManager.get_active_campaign(user_id)
+            await update.message.reply_text(get_campaign(campaign).messages['wallet_saved'], parse_mode='Markdown')
+        elif result == 'shared':
+            await check_abuse(user_id, 'wallet_reuse')
+            await update.message.reply_text(
+                "❌ *This wallet is already registered by another account.*\n\n"
+                "Each participant must use their own wallet. Please send a different address.",
+                parse_mode='Markdown'
+            )
+        else:
+            await update.message.reply_text("❌ Could not save your wallet address. Please try again.")
+    elif len(message_text) >= 20 and any(keyword in message_text for keyword in ['0x', 'bc1', '1', '3', 'addr']):
+        await update.message.reply_text(
+            "❌ *That doesn't look like a valid wallet address.*\n\n"
+            "Please send only the address itself: EVM (0x...), Bitcoin, TRON or Cardano.",
+            parse_mode='Markdown'
+        )
+    else:
+        # Show current task
+        campaign = await UserManager.get_active_campaign(user_id)
+        progress = await UserManager.get_user_progress(user_id, campaign)
+        if progress:
+            if all(progress['tasks_completed']):
+                await show_completion_screen(update, context, user_id, campaign)
+            else:
+                current_step = resume_step(progress['tasks_completed'], progress['current_step'])
+                await show_task_screen(update, context, current_step, user_id, campaign)
+
+async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle errors"""
+    logger.error("Update %s caused error %s", update, context.error)
+    
+    if update and update.effective_chat:
+        try:
+            await context.bot.send_message(
+                chat_id=update.effective_chat.id,
+                text="❌ An error occurred. Please try again or use /start"
+            )
+        except:
+            pass
+
+class _UserQueue:
+    __slots__ = ('lock', 'running', 'waiting')
+    
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.running = None
+        self.waiting = []
+
+BUSY_CALLBACK_NOTICE = "⏳ Still working on your previous clicks, please try again in a moment."
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently while keeping each user's updates in order
+
+    Updates from different users are handled in parallel, updates from the
+    same user wait for each other so the sequential task flow never sees two
+    of its clicks interleaved. Button callbacks are coalesced per user: a
+    callback with the same data as one already running or waiting (a
+    double-click on verify_N or task_N) is dropped, and so are callbacks
+    beyond max_queued_callbacks waiting for the same user, with a notice to
+    try again. Every dropped callback is still answered so its button stops
+    spinning. Messages always queue.
+    """
+    
+    def __init__(self, max_concurrent_updates=MAX_CONCURRENT_UPDATES,
+                 max_queued_callbacks=MAX_QUEUED_CALLBACKS_PER_USER):
+        super().__init__(max_concurrent_updates)
+        self.max_queued_callbacks = max_queued_callbacks
+        self._queues = {}
+        self.repeated_callbacks = 0
+        self.overflowed_callbacks = 0
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+    
+    @property
+    def waiting_updates(self):
+        return sum(len(queue.waiting) for queue in self._queues.values())
+    
+    @property
+    def dropped_updates(self):
+        return self.repeated_callbacks + self.overflowed_callbacks
+    
+    async def do_process_update(self, update, coroutine):
+        try:
+            await self._process_in_order(update, coroutine)
+        finally:
+            # Handled or dropped, so polling may confirm it to Telegram
+            if isinstance(update, Update):
+                update_offsets.finished(update.update_id)
+    
+    async def _process_in_order(self, update, coroutine):
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            await coroutine
+            return
+        
+        queue = self._queues.get(user.id)
+        if queue is None:
+            queue = self._queues[user.id] = _UserQueue()
+        
+        # Messages get a unique key so they are never coalesced
+        callback_data = update.callback_query.data if update.callback_query else None
+        key = callback_data if callback_data is not None else object()
+        if callback_data is not None:
+            if key == queue.running or key in queue.waiting:
+                coroutine.close()
+                self.repeated_callbacks += 1
+                logger.debug("Dropped repeated callback %s from %s", callback_data, user.id)
+                await self._answer_dropped(update.callback_query)
+                return
+            if len(queue.waiting) >= self.max_queued_callbacks:
+                coroutine.close()
+                self.overflowed_callbacks += 1
+                logger.debug("Dropped callback %s from %s, %d already waiting", callback_data, user.id, len(queue.waiting))
+                await self._answer_dropped(update.callback_query, BUSY_CALLBACK_NOTICE)
+                return
+        
+        queue.waiting.append(key)
+        try:
+            async with queue.lock:
+                queue.waiting.remove(key)
+                queue.running = key
+                try:
+                    await coroutine
+                finally:
+                    queue.running = None
+        finally:
+            if not queue.waiting and not queue.lock.locked():
+                self._queues.pop(user.id, None)
+
+    @staticmethod
+    async def _answer_dropped(query, text=None):
+        """Stop the spinner of a click that will not be handled"""
+        try:
+            await query.answer(text)
+        except Exception as e:
+            logger.debug("Could not answer dropped callback %s: %s", query.id, e)
+
+class TokenBucket:
+    """Token bucket refilled at rate tokens per second, holding at most capacity"""
+    
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'paused_until')
+    
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+    
+    def wait_time(self, now):
+        """Seconds until a token is available"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
     
-    user_id = query.from_user.id
-    data = query.data
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
     
-    logger.info(f"Button clicked by {user_id}: {data}")
+    @property
+    def idle(self):
+        return self.tokens >= self.capacity and time.monotonic() >= self.paused_until
+
+class SendScheduler(BaseRateLimiter):
+    """Rate limiter for outbound messages with priority lanes and flood-wait handling
+
+    Message-sending endpoints (send*, edit*, copy*, forward*) take a token from
+    a global bucket and from the target chat's bucket before they go out.
+    Interactive requests (the default) are always served before requests made
+    with rate_limit_args={'priority': 'broadcast'}. When Telegram answers 429
+    the chat (or, without a chat, every chat) is paused for retry_after
+    seconds and the request is retried up to max_retries times.
+    """
     
-    if data == "start_tasks":
-        # Start from task 1
-        UserManager.update_user_step(user_id, 1)
-        await show_task_screen(update, context, 1, user_id)
+    LIMITED_PREFIXES = ('send', 'edit', 'copy', 'forward')
+    MAX_CHAT_BUCKETS = 10000
     
-    elif data == "check_progress":
-        await progress_command(update, context)
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, per_chat_rate=SEND_PER_CHAT_RATE,
+                 per_chat_burst=SEND_PER_CHAT_BURST, max_retries=SEND_MAX_RETRIES):
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, 1)
+        self._chats = {}
+        self.waiting = {'interactive': 0, 'broadcast': 0}
+        self.throttled = 0
+        self.flood_waits = 0
     
-    elif data.startswith("task_"):
-        task_num = int(data.split("_")[1])
-        UserManager.update_user_step(user_id, task_num)
-        await show_task_screen(update, context, task_num, user_id)
+    async def initialize(self):
+        pass
     
-    elif data.startswith("verify_"):
-        task_num = int(data.split("_")[1])
-        
-        # Mark task as completed
-        UserManager.mark_task_completed(user_id, task_num)
-        
-        # Show success message
-        await query.edit_message_text(
-            text=f"✅ *Task {task_num} Verified!*\n\nMoving to next task...",
-            parse_mode='Markdown'
-        )
-        
-        await asyncio.sleep(1)
-        
-        # Move to next task or show completion
-        if task_num < len(TASKS):
-            await show_task_screen(update, context, task_num + 1, user_id)
-        else:
-            await show_completion_screen(update, context, user_id)
+    async def shutdown(self):
+        pass
     
-    elif data == "finish_all":
-        await show_completion_screen(update, context, user_id)
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                self._chats = {key: b for key, b in self._chats.items() if not b.idle}
+            bucket = self._chats[chat_id] = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        return bucket
     
-    elif data == "restart_airdrop":
-        # Reset progress
-        UserManager.reset_user_progress(user_id)
-        
-        await query.edit_message_text(
-            text="🔄 *Progress Reset!* Starting from the beginning...",
-            parse_mode='Markdown'
-        )
+    async def _acquire(self, chat_id, priority):
+        self.waiting[priority] += 1
+        try:
+            while True:
+                now = time.monotonic()
+                wait = self._global.wait_time(now)
+                if chat_id is not None:
+                    wait = max(wait, self._chat_bucket(chat_id).wait_time(now))
+                if priority == 'broadcast' and self.waiting['interactive']:
+                    wait = max(wait, 1 / self._global.rate)
+                if wait <= 0:
+                    self._global.tokens -= 1
+                    if chat_id is not None:
+                        self._chats[chat_id].tokens -= 1
+                    return
+                self.throttled += 1
+                await asyncio.sleep(wait)
+        finally:
+            self.waiting[priority] -= 1
+    
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        limited = endpoint.startswith(self.LIMITED_PREFIXES)
+        chat_id = data.get('chat_id') if data else None
+        priority = (rate_limit_args or {}).get('priority', 'interactive')
         
-        await asyncio.sleep(1)
-        await show_task_screen(update, context, 1, user_id)
+        for attempt in range(self.max_retries + 1):
+            if limited:
+                waited = time.perf_counter()
+                await self._acquire(chat_id, priority)
+                SEND_WAIT_SECONDS.observe(time.perf_counter() - waited, priority)
+            start = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            except TelegramError as e:
+                TELEGRAM_API_ERRORS.inc(endpoint, type(e).__name__)
+                if not isinstance(e, RetryAfter) or attempt == self.max_retries:
+                    raise
+                retry_after = getattr(e.retry_after, 'total_seconds', lambda: e.retry_after)()
+            finally:
+                TELEGRAM_API_SECONDS.observe(time.perf_counter() - start, endpoint)
+            
+            self.flood_waits += 1
+            logger.warning("Flood control on %s for chat %s, retrying in %ss", endpoint, chat_id, retry_after)
+            if chat_id is not None:
+                self._chat_bucket(chat_id).pause(retry_after)
+            else:
+                self._global.pause(retry_after)
+            if not limited:
+                await asyncio.sleep(retry_after)
 
-async def progress_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /progress command"""
-    user_id = update.effective_user.id
-    progress = UserManager.get_user_progress(user_id)
-    
-    if not progress:
-        await update.message.reply_text("Please use /start to begin the airdrop.")
-        return
+# Membership verification
+MEMBER_STATUSES = (ChatMemberStatus.OWNER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.MEMBER)
+
+class MembershipVerifier:
+    """Checks group and channel membership through getChatMember, with caching
+
+    Results are cached per (chat_id, user_id): members for ttl seconds,
+    non-members only for negative_ttl so a user who joins after a failed
+    check can verify again right away. Concurrent checks of the same pair
+    share one request. The Bot API has no lookup for many users at once, so
+    checks across users go out at most max_concurrent at a time and at most
+    rate per second; a RetryAfter from Telegram pauses all of them.
+    """
     
-    completed_tasks = progress['tasks_completed']
-    current_step = progress['current_step']
-    completed_count = sum(completed_tasks)
-    total_tasks = len(TASKS)
+    def __init__(self, bot, ttl=MEMBERSHIP_CACHE_TTL, negative_ttl=MEMBERSHIP_NEGATIVE_TTL,
+                 rate=MEMBERSHIP_CHECK_RATE, max_concurrent=MEMBERSHIP_MAX_CONCURRENT,
+                 cache_size=MEMBERSHIP_CACHE_SIZE):
+        self.bot = bot
+        self.negative_ttl = negative_ttl
+        self._cache = ProgressCache(cache_size, ttl)
+        self._in_flight = {}
+        self._bucket = TokenBucket(rate, 1)
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.api_calls = 0
+        self.deduplicated = 0
     
-    # Create progress visualization
-    progress_bar = ""
-    for i in range(total_tasks):
-        if completed_tasks[i]:
-            progress_bar += "🟢"
-        elif i + 1 == current_step:
-            progress_bar += "🟡"
+    async def is_member(self, chat_id, user_id):
+        """True if user_id is in chat_id, False if not, None if Telegram could not tell"""
+        key = (chat_id, user_id)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        
+        future = self._in_flight.get(key)
+        if future is None:
+            future = self._in_flight[key] = asyncio.ensure_future(self._lookup(chat_id, user_id))
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
         else:
-            progress_bar += "⚪"
+            self.deduplicated += 1
+        # A waiter giving up must not cancel the lookup others are waiting for
+        return await asyncio.shield(future)
     
-    progress_text = f"""
-📊 *Your Airdrop Progress*
+    async def _lookup(self, chat_id, user_id):
+        async with self._semaphore:
+            wait = self._bucket.wait_time(time.monotonic())
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self._bucket.wait_time(time.monotonic())
+            self._bucket.tokens -= 1
+            
+            self.api_calls += 1
+            try:
+                member = await self.bot.get_chat_member(chat_id, user_id)
+            except RetryAfter as e:
+                retry_after = getattr(e.retry_after, 'total_seconds', lambda: e.retry_after)()
+                logger.warning("Flood control on getChatMember, pausing membership checks for %ss", retry_after)
+                self._bucket.pause(retry_after)
+                return None
+            except BadRequest as e:
+                # Users who never joined are reported as unknown participants
+                if 'user not found' not in e.message.lower() and 'participant' not in e.message.lower():
+                    logger.error("Error checking membership of %s in %s: %s", user_id, chat_id, e)
+                    return None
+                is_member = False
+            except TelegramError as e:
+                logger.error("Error checking membership of %s in %s: %s", user_id, chat_id, e)
+                return None
+            else:
+                is_member = member.status in MEMBER_STATUSES or (
+                    member.status == ChatMemberStatus.RESTRICTED and member.is_member
+                )
+        
+        self._cache.put((chat_id, user_id), is_member, None if is_member else self.negative_ttl)
+        return is_member
 
-{progress_bar}
-✅ {completed_count}/{total_tasks} tasks completed
+# Metrics endpoint
+RENDER_CACHES = {'task': render_task_screen, 'progress': render_progress_screen, 'completion': _completion_screen_parts}
 
-*Current Status:* {'🎉 All Tasks Completed!' if completed_count == total_tasks else f'Task {current_step} of {total_tasks}'}
+def _render_cache_lookups():
+    lookups = {}
+    for screen, render in RENDER_CACHES.items():
+        info = render.cache_info()
+        lookups[(screen, 'hit')] = info.hits
+        lookups[(screen, 'miss')] = info.misses
+    return lookups
 
-📋 *Task Breakdown:*
-"""
+def register_metrics(application):
+    """Expose the counters and queue depths application and the shared components already keep
+
+    Module-level components are looked up when scraped, so replacing one
+    (as the benchmarks do) is picked up.
+    """
+    processor = application.update_processor
+    rate_limiter = application.bot.rate_limiter
+    membership = application.bot_data.get('membership')
     
-    for i, task in enumerate(TASKS, 1):
-        status = "✅ Completed" if completed_tasks[i-1] else ("⏳ Current" if i == current_step else "📝 Pending")
-        progress_text += f"{i}. {task['name']}: {status}\n"
+    metrics.callback('airdrop_update_queue_size', 'Updates received but not yet dispatched',
+                     lambda: application.update_queue.qsize())
+    if isinstance(processor, PerUserUpdateProcessor):
+        metrics.callback('airdrop_updates_waiting', "Updates waiting for the same user's previous update",
+                         lambda: processor.waiting_updates)
+        metrics.callback('airdrop_updates_dropped_total', 'Button clicks dropped as repeats or beyond the per-user queue',
+                         lambda: {'repeat': processor.repeated_callbacks, 'overflow': processor.overflowed_callbacks},
+                         'counter', ('reason',))
+    metrics.callback('airdrop_updates_unconfirmed', 'Polled updates queued or running',
+                     lambda: len(update_offsets))
+    metrics.callback('airdrop_updates_refetched_total', 'Polled updates delivered again while still being handled',
+                     lambda: update_offsets.refetched, 'counter')
+    if isinstance(rate_limiter, SendScheduler):
+        metrics.callback('airdrop_send_waiting', 'Messages waiting for the send rate limits',
+                         lambda: dict(rate_limiter.waiting), labels=('priority',))
+        metrics.callback('airdrop_send_throttled_total', 'Times a message had to wait for a rate limit',
+                         lambda: rate_limiter.throttled, 'counter')
+        metrics.callback('airdrop_send_flood_waits_total', '429 answers from Telegram',
+                         lambda: rate_limiter.flood_waits, 'counter')
     
-    if completed_count == total_tasks:
-        progress_text += f"\n🎉 *Ready to claim!*\nContact admins: {ADMINS[0]} or {ADMINS[1]}"
-    else:
-        current_task = TASKS[current_step-1]
-        progress_text += f"\n👉 *Current Task:* {current_task['name']}"
+    metrics.callback('airdrop_screen_transitions_pending', 'Follow-up screens scheduled but not yet shown',
+                     lambda: len(screen_transitions))
+    metrics.callback('airdrop_screen_transitions_cancelled_total', 'Follow-up screens dropped by a newer click',
+                     lambda: screen_transitions.cancelled, 'counter')
+    metrics.callback('airdrop_callbacks_repeated_total', 'Repeated clicks and redelivered callbacks ignored',
+                     lambda: recent_callbacks.repeats, 'counter')
+    metrics.callback('airdrop_edits_skipped_total', 'Message edits skipped because the message already showed the screen',
+                     lambda: shown_screens.skipped, 'counter')
+    metrics.callback('airdrop_store_pending_writes', 'Writes queued for the next commit',
+                     lambda: user_store.pending_writes)
+    metrics.callback('airdrop_store_flushes_total', 'Write batches committed',
+                     lambda: getattr(user_store, 'flushes', 0), 'counter')
+    metrics.callback('airdrop_store_coalesced_writes_total', 'Writes merged into a queued write of the same user',
+                     lambda: getattr(user_store, 'coalesced_writes', 0), 'counter')
+    metrics.callback('airdrop_store_failed_writes_total', 'Queued writes rolled back because a statement failed',
+                     lambda: getattr(user_store, 'failed_writes', 0), 'counter')
+    metrics.callback('airdrop_state_server_calls_total', 'Calls made to the state server',
+                     lambda: getattr(user_store, 'calls', 0), 'counter')
     
-    keyboard = []
-    if completed_count < total_tasks:
-        keyboard.append([InlineKeyboardButton("➡️ Continue Tasks", callback_data=f"task_{current_step}")])
-    else:
-        keyboard.append([InlineKeyboardButton("📤 Contact Admins", callback_data="finish_all")])
+    metrics.callback('airdrop_progress_cache_size', 'Users whose progress is cached', lambda: len(progress_cache))
+    metrics.callback('airdrop_progress_cache_lookups_total', 'Progress cache lookups',
+                     lambda: {'hit': progress_cache.hits, 'miss': progress_cache.misses}, 'counter', ('result',))
+    metrics.callback('airdrop_progress_cache_evictions_total', 'Progress records evicted from the cache',
+                     lambda: progress_cache.evictions, 'counter')
+    metrics.callback('airdrop_render_cache_lookups_total', 'Rendered screen cache lookups',
+                     _render_cache_lookups, 'counter', ('screen', 'result'))
+    if membership is not None:
+        metrics.callback('airdrop_membership_cache_lookups_total', 'Membership check cache lookups',
+                         lambda: {'hit': membership._cache.hits, 'miss': membership._cache.misses},
+                         'counter', ('result',))
+        metrics.callback('airdrop_membership_api_calls_total', 'getChatMember calls made',
+                         lambda: membership.api_calls, 'counter')
     
-    keyboard.append([InlineKeyboardButton("🔄 Restart", callback_data="restart_airdrop")])
+    metrics.callback('airdrop_events_buffered', 'Funnel events waiting to be written', lambda: event_log.buffered)
+    metrics.callback('airdrop_events_written_total', 'Funnel events written', lambda: event_log.written, 'counter')
+    metrics.callback('airdrop_events_dropped_total', 'Funnel events dropped because the buffer was full',
+                     lambda: event_log.dropped, 'counter')
+    metrics.callback('airdrop_log_queue_size', 'Log records waiting for the writer thread',
+                     lambda: log_queue_handler.queue.qsize() if log_queue_handler else 0)
+    metrics.callback('airdrop_log_records_dropped_total', 'Log records dropped because the log queue was full',
+                     lambda: log_queue_handler.dropped if log_queue_handler else 0, 'counter')
+    metrics.callback('airdrop_log_clicks_sampled_out_total', 'Per-click log records left out by sampling',
+                     lambda: click_sampler.sampled_out, 'counter')
+    metrics.callback('airdrop_abuse_throttled_total', 'Actions refused by the abuse scorer',
+                     lambda: abuse_scorer.throttled, 'counter')
+    metrics.callback('airdrop_abuse_flagged_total', 'Users flagged for payout review',
+                     lambda: abuse_scorer.flagged, 'counter')
+
+class MetricsServer:
+    """Local aiohttp server answering GET /metrics in the Prometheus text format
+
+    Listens on 127.0.0.1 by default; the metrics carry no secrets but are
+    not meant for the public internet either.
+    """
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    def __init__(self, registry=None, listen=None, port=None):
+        self.registry = registry or metrics
+        self.listen = listen or METRICS_LISTEN
+        self.port = METRICS_PORT if port is None else port
+        self._runner = None
     
-    try:
-        if update.message:
-            await update.message.reply_text(
-                progress_text,
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-        elif update.callback_query:
-            await update.callback_query.edit_message_text(
-                progress_text,
-                reply_markup=reply_markup,
-                parse_mode='Markdown'
-            )
-    except Exception as e:
-        logger.error(f"Error in progress command: {e}")
+    async def start(self):
+        from aiohttp import web
+        
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        logger.info("📈 Metrics on http://%s:%s/metrics", self.listen, self.port)
+    
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+    
+    async def _handle_metrics(self, request):
+        from aiohttp import web
+        
+        return web.Response(text=self.registry.render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
 
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /help command"""
-    help_text = """
-🤖 *Freequency Airdrop Bot Help*
+# Background tasks started outside of update handling, kept referenced until done
+_background_tasks = set()
 
-*Available Commands:*
-/start - Start or resume the airdrop
-/progress - Check your current progress
-/help - Show this help message
-/reset - Reset your progress (start over)
+def start_background_task(coroutine, name=None):
+    """Run coroutine in the background for the lifetime of the bot"""
+    task = asyncio.get_running_loop().create_task(coroutine, name=name)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
 
-*How it works:*
-1. Complete 5 social tasks in order
-2. Each task must be verified before next
-3. After all tasks, contact admins with proof
-4. Receive 100 FREQC tokens
+async def stop_background_tasks():
+    """Cancel background tasks and wait for them to finish"""
+    tasks = list(_background_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
 
-*Contact Admins for help:*
-@dallen32 or @joyouschrs
+async def post_init(application: Application):
+    """Start background work once the application is initialized"""
+    # With a remote backend the state server keeps its database maintained
+    if isinstance(user_store, UserStore):
+        start_background_task(run_backfills(user_store), name='backfills')
+        start_background_task(funnel_report.run(), name='funnel-rollups')
+        maintenance = DatabaseMaintenance(user_store)
+        if application.job_queue is not None:
+            maintenance.schedule(application.job_queue)
+        else:
+            logger.warning("Job queue unavailable (pip install 'python-telegram-bot[job-queue]'), "
+                           "running database maintenance as a background task")
+            start_background_task(maintenance.run(), name='maintenance')
+    start_background_task(watch_config(), name='config-watch')
+    if METRICS_PORT:
+        try:
+            server = application.bot_data['metrics_server'] = MetricsServer()
+            await server.start()
+        except Exception as e:
+            logger.error("Error starting metrics server: %s", e)
+    
+    broadcasts = application.bot_data['broadcasts'] = BroadcastEngine(application.bot, user_store)
+    # Only one worker picks up interrupted broadcasts, or every user would get them once per worker
+    if WORKER_INDEX == 0:
+        await broadcasts.resume()
 
-Good luck! 🚀
-"""
-    await update.message.reply_text(help_text, parse_mode='Markdown')
+async def post_stop(application: Application):
+    """Finish what handlers left behind once the last update is handled"""
+    await screen_transitions.flush()
+    await event_log.flush()
+    await user_store.flush()
 
-async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /reset command"""
-    user_id = update.effective_user.id
-    
-    UserManager.reset_user_progress(user_id)
+async def post_shutdown(application: Application):
+    """Flush and close storage once the bot has stopped"""
+    if 'metrics_server' in application.bot_data:
+        await application.bot_data.pop('metrics_server').stop()
+    screen_transitions.cancel_all()
+    await stop_background_tasks()
+    await event_log.flush()
+    await user_store.close()
+
+# Update partitioning
+FORWARDED_HEADER = 'X-Airdrop-Forwarded'
+
+def partition_of(user_id, worker_count):
+    """Index of the worker out of worker_count that handles user_id"""
+    # Fibonacci hashing: spreads sequential ids evenly and is the same in every process
+    return ((user_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) * worker_count >> 64
+
+def update_user_id(data):
+    """Id of the user a raw update is from, None for updates without a user"""
+    for value in data.values():
+        if isinstance(value, dict):
+            user = value.get('from') or value.get('user')
+            if isinstance(user, dict):
+                return user.get('id')
+    return None
+
+class WebhookServer:
+    """Local aiohttp server feeding Telegram webhook updates into an Application
+
+    Every request, including those forwarded by other workers, must carry the
+    secret token in the X-Telegram-Bot-Api-Secret-Token header; the server
+    does not start without one, since a forged update could claim an admin's
+    username and run /export or /broadcast. Once max_pending
+    updates are waiting in the application's update queue the server answers
+    503, so Telegram backs off and redelivers instead of the queue growing
+    without bound.
+
+    With several peers (the webhook URLs of all workers, in index order),
+    updates from users another worker owns are forwarded there, so every
+    user's progress cache, abuse score and update ordering live in exactly
+    one process. The owner's status is passed back to Telegram.
+    """
     
-    keyboard = [
-        [InlineKeyboardButton("🚀 Start Airdrop", callback_data="start_tasks")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    def __init__(self, application, listen=None, port=None, path=None, secret_token=None, max_pending=None,
+                 peers=None, worker_index=None):
+        self.application = application
+        self.listen = listen or WEBHOOK_LISTEN
+        self.port = WEBHOOK_PORT if port is None else port
+        self.path = path or WEBHOOK_PATH
+        self.secret_token = WEBHOOK_SECRET_TOKEN if secret_token is None else secret_token
+        self.max_pending = max_pending or WEBHOOK_MAX_PENDING
+        self.peers = WORKER_PEERS if peers is None else peers
+        self.worker_index = WORKER_INDEX if worker_index is None else worker_index
+        self._runner = None
+        self._session = None
+        self.rejected = 0
+        self.forwarded = 0
     
-    await update.message.reply_text(
-        "🔄 *Your progress has been reset!*\n\nClick below to start the airdrop from the beginning.",
-        reply_markup=reply_markup,
-        parse_mode='Markdown'
-    )
-
-async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /stats command (admin only)"""
-    user = update.effective_user
+    async def start(self):
+        import aiohttp
+        from aiohttp import web
+        
+        if not self.secret_token:
+            raise ValueError("A webhook secret token is required (WEBHOOK_SECRET_TOKEN)")
+        app = web.Application()
+        app.router.add_post(self.path, self._handle_update)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        # Pick up the real port when started with port 0
+        self.port = self._runner.addresses[0][1]
+        if len(self.peers) > 1:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=STATE_RPC_TIMEOUT))
+        metrics.callback('airdrop_webhook_rejected_total', 'Webhook updates answered 503 because the queue was full',
+                         lambda: self.rejected, 'counter')
+        metrics.callback('airdrop_webhook_forwarded_total', 'Webhook updates forwarded to the worker owning the user',
+                         lambda: self.forwarded, 'counter')
+        logger.info("🌐 Webhook server listening on %s:%s%s", self.listen, self.port, self.path)
     
-    # Check if user is admin
-    if f"@{user.username}" not in ADMINS:
-        await update.message.reply_text("❌ Admin only command.")
-        return
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    async def _forward(self, url, data):
+        from aiohttp import web
+        
+        headers = {FORWARDED_HEADER: str(self.worker_index), 'X-Telegram-Bot-Api-Secret-Token': self.secret_token}
+        try:
+            async with self._session.post(url, json=data, headers=headers) as response:
+                status = response.status
+        except Exception as e:
+            logger.error("Error forwarding update to %s: %s", url, e)
+            status = 503
+        self.forwarded += 1
+        return web.Response(status=status)
     
-    try:
-        # Get statistics
-        cursor.execute('SELECT COUNT(*) FROM users')
-        total_users = cursor.fetchone()[0]
+    async def _handle_update(self, request):
+        from aiohttp import web
+        
+        if not self.secret_token or not hmac.compare_digest(
+            request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), self.secret_token
+        ):
+            return web.Response(status=403)
+        
+        try:
+            data = await request.json()
+        except Exception as e:
+            logger.error("Invalid webhook payload: %s", e)
+            return web.Response(status=400)
         
-        cursor.execute('SELECT COUNT(*) FROM users WHERE task5_completed = 1')
-        completed_users = cursor.fetchone()[0]
+        # Forwarded updates are always handled here, so a peer list mismatch cannot loop
+        if len(self.peers) > 1 and FORWARDED_HEADER not in request.headers:
+            user_id = update_user_id(data)
+            if user_id is not None:
+                owner = partition_of(user_id, len(self.peers))
+                if owner != self.worker_index:
+                    return await self._forward(self.peers[owner], data)
         
-        # Today's stats
-        cursor.execute('SELECT COUNT(*) FROM users WHERE date(joined_at) = date("now")')
-        today_users = cursor.fetchone()[0]
+        update_queue = self.application.update_queue
+        if update_queue.qsize() >= self.max_pending:
+            self.rejected += 1
+            return web.Response(status=503)
         
-        # Recent completions
-        cursor.execute('''
-        SELECT username, joined_at FROM users 
-        WHERE task5_completed = 1 
-        ORDER BY joined_at DESC 
-        LIMIT 5
-        ''')
-        recent_completions = cursor.fetchall()
+        try:
+            update = Update.de_json(data, self.application.bot)
+        except Exception as e:
+            logger.error("Invalid webhook payload: %s", e)
+            return web.Response(status=400)
         
-        stats_text = f"""
-📊 *Admin Statistics*
+        await update_queue.put(update)
+        return web.Response()
 
-👥 Total Users: {total_users}
-✅ Completed All Tasks: {completed_users}
-📅 New Users Today: {today_users}
-📈 Completion Rate: {(completed_users/total_users*100 if total_users > 0 else 0):.1f}%
+class StateServer:
+    """aiohttp server giving RemoteStore clients access to a local UserStore
 
-🏆 *Recent Completers:*
-"""
+    POST /rpc takes {"method": ..., "args": [...]} and answers
+    {"result": ...}. Methods are the STATE_METHODS of the store, plus read
+    and write whose first argument names a @state_query function. Requests
+    must carry the shared token as a bearer Authorization header.
+    """
+    
+    def __init__(self, store, listen=None, port=None, token=None):
+        self.store = store
+        self.listen = listen or STATE_SERVER_LISTEN
+        self.port = STATE_SERVER_PORT if port is None else port
+        self.token = STATE_SERVER_TOKEN if token is None else token
+        self._runner = None
+        self.calls = 0
+    
+    async def start(self):
+        from aiohttp import web
         
-        if recent_completions:
-            for username, joined_at in recent_completions:
-                stats_text += f"• @{username or 'NoUsername'} - {joined_at}\n"
-        else:
-            stats_text += "No completions yet\n"
+        if not self.token:
+            logger.warning("STATE_SERVER_TOKEN is not set, anyone who can reach the state server can change user data")
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post('/rpc', self._handle_rpc)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        logger.info("🗄 State server listening on %s:%s", self.listen, self.port)
+    
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+    
+    async def _dispatch(self, method, args):
+        if method in ('read', 'write'):
+            fn = STATE_QUERIES.get(args[0]) if args else None
+            if fn is None:
+                raise LookupError(f"unknown query {args[0] if args else None!r}")
+            return await getattr(self.store, method)(fn, *args[1:])
+        if method not in STATE_METHODS:
+            raise LookupError(f"unknown method {method!r}")
+        return await getattr(self.store, method)(*args)
+    
+    async def _handle_rpc(self, request):
+        from aiohttp import web
         
-        await update.message.reply_text(stats_text, parse_mode='Markdown')
+        if self.token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {self.token}'):
+            return web.Response(status=403)
+        try:
+            payload = await request.json()
+            method, args = payload['method'], payload.get('args', [])
+        except Exception as e:
+            return web.json_response({'error': f"invalid request: {e}"}, status=400)
         
-    except Exception as e:
-        logger.error(f"Error in admin_stats: {e}")
-        await update.message.reply_text(f"Error getting statistics: {e}")
+        self.calls += 1
+        try:
+            result = await self._dispatch(method, args)
+        except LookupError as e:
+            return web.json_response({'error': str(e)}, status=400)
+        except Exception as e:
+            logger.error("Error in state server call %s: %s", method, e)
+            return web.json_response({'error': str(e)}, status=500)
+        return web.json_response({'result': result}, dumps=lambda obj: json.dumps(obj, default=_json_default))
+
+def add_stop_signal_handlers(stop_event):
+    """Set stop_event on SIGINT/SIGTERM, where the event loop supports signal handlers"""
+    # Windows event loops have no add_signal_handler, Ctrl+C still raises KeyboardInterrupt there
+    if sys.platform == 'win32':
+        return
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+async def run_state_server(listen=None, port=None):
+    """Serve user_store to bot workers until SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    add_stop_signal_handlers(stop_event)
+    
+    server = StateServer(user_store, listen, port)
+    await server.start()
+    try:
+        start_background_task(run_backfills(user_store), name='backfills')
+        start_background_task(funnel_report.run(), name='funnel-rollups')
+        start_background_task(DatabaseMaintenance(user_store).run(), name='maintenance')
+        # Task counts of the campaigns shape the progress records, so follow the config too
+        start_background_task(watch_config(), name='config-watch')
+        await stop_event.wait()
     finally:
-        conn.close()
+        await server.stop()
+        await stop_background_tasks()
+        await event_log.flush()
+        await user_store.close()
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle regular text messages"""
-    user_id = update.effective_user.id
-    message_text = update.message.text
+def state_server_cli(argv):
+    """python bot.py state-server: serve the database to bot workers"""
+    import argparse
     
-    # Check if this looks like a wallet address
-    if len(message_text) >= 20 and any(keyword in message_text for keyword in ['0x', 'bc1', '1', '3', 'addr']):
-        # Save wallet address
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('UPDATE users SET wallet_address = ? WHERE user_id = ?', 
-                      (message_text, user_id))
-        conn.commit()
-        conn.close()
-        
-        await update.message.reply_text(
-            "✅ *Wallet address saved!*\n\n"
-            "Now please send your task completion screenshots to our admins:\n"
-            f"{ADMINS[0]}\n{ADMINS[1]}",
-            parse_mode='Markdown'
-        )
-    else:
-        # Show current task
-        progress = UserManager.get_user_progress(user_id)
-        if progress:
-            current_step = progress['current_step']
-            if current_step <= len(TASKS):
-                await show_task_screen(update, context, current_step, user_id)
-            else:
-                await show_completion_screen(update, context, user_id)
+    parser = argparse.ArgumentParser(prog='bot.py state-server', description='Share DB_PATH with bot workers over HTTP.')
+    parser.add_argument('--listen', default=STATE_SERVER_LISTEN, help='address to listen on')
+    parser.add_argument('--port', type=int, default=STATE_SERVER_PORT, help='port to listen on')
+    args = parser.parse_args(argv)
+    
+    if not isinstance(user_store, UserStore):
+        logger.error("❌ The state server needs STATE_BACKEND=sqlite, it owns the database itself")
+        sys.exit(1)
+    init_db()
+    asyncio.run(run_state_server(args.listen, args.port))
 
-async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle errors"""
-    logger.error(f"Update {update} caused error {context.error}")
+async def run_webhook(application: Application):
+    """Serve updates through WebhookServer until SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    add_stop_signal_handlers(stop_event)
     
-    if update and update.effective_chat:
-        try:
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="❌ An error occurred. Please try again or use /start"
+    server = WebhookServer(application)
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await server.start()
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL,
+                secret_token=server.secret_token,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                drop_pending_updates=False,
+                allowed_updates=Update.ALL_TYPES
             )
-        except:
-            pass
+        await application.start()
+        logger.info("🔄 Bot is now receiving updates via webhook...")
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+# Polling
+class UpdateOffsets:
+    """Which fetched updates have been handled, behind the offset UpdatePoller confirms
+
+    Update ids usually grow by one per update, but Telegram picks a random
+    next id after a week without updates, and ids start over for another bot
+    token. The watermark is the highest id up to which every fetched update
+    has been handled; updates above it may still be queued or running. An
+    update fetched again before it was confirmed is recognised by its id and
+    not handled twice.
+    """
+    
+    def __init__(self):
+        self._unfinished = set()
+        # Fetched ids in order, trimmed to the ones above the watermark
+        self._unconfirmed = deque()
+        self._waiter = None
+        self.highest = 0
+        self.refetched = 0
+    
+    def __len__(self):
+        return len(self._unfinished)
+    
+    def reset(self, offset):
+        """Start over after offset, the watermark a previous run saved"""
+        self._unfinished.clear()
+        self._unconfirmed.clear()
+        self.highest = offset
+    
+    def received(self, update_id):
+        """Note a fetched update, False if it was fetched before and must not be handled again"""
+        if update_id <= self.highest:
+            self.refetched += 1
+            return False
+        self._unfinished.add(update_id)
+        self._unconfirmed.append(update_id)
+        self.highest = update_id
+        return True
+    
+    def finished(self, update_id):
+        self._unfinished.discard(update_id)
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+    
+    async def wait_finished(self, timeout=None):
+        """Wait until a fetched update is handled, or timeout seconds"""
+        # asyncio.wait rather than wait_for, which on Python 3.11 loses a
+        # cancellation that arrives together with the result
+        self._waiter = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait([self._waiter], timeout=timeout)
+        finally:
+            self._waiter = None
+    
+    @property
+    def watermark(self):
+        return min(self._unfinished) - 1 if self._unfinished else self.highest
+    
+    @property
+    def unconfirmed(self):
+        """Fetched updates above the watermark, handled or not; getUpdates returns them again"""
+        watermark = self.watermark
+        while self._unconfirmed and self._unconfirmed[0] <= watermark:
+            self._unconfirmed.popleft()
+        return len(self._unconfirmed)
+
+update_offsets = UpdateOffsets()
+
+class UpdatePoller:
+    """getUpdates loop that confirms updates to Telegram only once they are handled
+
+    Telegram forgets an update once getUpdates is called with a higher offset.
+    python-telegram-bot's polling passes the offset after every batch it has
+    fetched, so updates still queued or running when the process dies are
+    lost. This loop asks for the watermark of handled updates plus one
+    instead, skipping the unfinished ones that come back.
+
+    The watermark is saved in bot_state in the same transaction as the store's
+    queued writes, so it never gets ahead of the writes of the updates below
+    it, and every save_interval seconds and on shutdown for updates that
+    wrote nothing. After a restart polling resumes behind the saved watermark:
+    waiting updates are delivered, handled ones are not delivered again. Only
+    after a crash can updates handled since the last save come back, and
+    those wrote nothing or their writes were lost with them.
+
+    Once max_unconfirmed updates are held back behind one slow handler,
+    fetching pauses until it finishes; unfinished updates are never confirmed.
+    """
+    
+    OFFSET_KEY = 'update_offset'
+    
+    def __init__(self, application, store=None, timeout=POLL_TIMEOUT,
+                 max_unconfirmed=POLL_MAX_UNCONFIRMED, save_interval=UPDATE_OFFSET_SAVE_INTERVAL):
+        self.application = application
+        self.store = store or user_store
+        # PerUserUpdateProcessor reports finished updates to update_offsets
+        self.offsets = update_offsets
+        self.timeout = timeout
+        self.max_unconfirmed = max_unconfirmed
+        self.save_interval = save_interval
+        self.saved = 0
+        self._saved_with_commits = False
+        self._tasks = []
+    
+    # Queries, executed on the store threads
+    
+    @staticmethod
+    @state_query
+    def _load_offset(conn, key):
+        row = conn.execute('SELECT value FROM bot_state WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+    
+    @staticmethod
+    @state_query
+    def _save_offset(conn, key, value):
+        with conn:
+            conn.execute(SQL_SAVE_STATE, (key, value))
+    
+    @property
+    def confirm_offset(self):
+        """Offset for the next getUpdates: every update below it is confirmed"""
+        return self.offsets.watermark + 1
+    
+    async def start(self):
+        """Resume after the saved watermark and start polling"""
+        self.saved = await self.store.read(self._load_offset, self.OFFSET_KEY)
+        self.offsets.reset(self.saved)
+        if self.saved:
+            logger.info("Resuming polling after update %s", self.saved)
+        self._saved_with_commits = self.store.save_with_commits(self.OFFSET_KEY, lambda: self.offsets.watermark)
+        loop = asyncio.get_running_loop()
+        self._tasks = [
+            loop.create_task(self._poll(), name='update-poller'),
+            loop.create_task(self._save_periodically(), name='update-offset-saver'),
+        ]
+    
+    async def stop(self):
+        """Stop fetching; updates already queued are left to the application"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    async def save(self):
+        """Save the watermark once the writes of the updates below it are committed"""
+        watermark = self.offsets.watermark
+        if watermark == self.saved:
+            return
+        await self.store.flush()
+        if not self._saved_with_commits:
+            await self.store.write(self._save_offset, self.OFFSET_KEY, watermark)
+        self.saved = watermark
+    
+    async def finish(self):
+        """Save the watermark and confirm it to Telegram, once every fetched update is handled"""
+        try:
+            await self.save()
+            await self.application.bot.get_updates(offset=self.confirm_offset, limit=1, timeout=0)
+        except Exception as e:
+            logger.error("Error saving the update offset on shutdown: %s", e)
+    
+    async def _poll(self):
+        failures = 0
+        while True:
+            # Fetching on would confirm updates that are still running
+            while self.offsets.unconfirmed >= self.max_unconfirmed:
+                await self.offsets.wait_finished()
+            
+            offset = self.confirm_offset
+            try:
+                updates = await self.application.bot.get_updates(
+                    offset=offset,
+                    limit=self.max_unconfirmed,
+                    timeout=self.timeout,
+                    allowed_updates=Update.ALL_TYPES
+                )
+            except RetryAfter as e:
+                await asyncio.sleep(getattr(e.retry_after, 'total_seconds', lambda: e.retry_after)())
+                continue
+            except TelegramError as e:
+                failures += 1
+                delay = min(2 ** failures, 30)
+                logger.error("Error fetching updates, retrying in %ss: %s", delay, e)
+                await asyncio.sleep(delay)
+                continue
+            failures = 0
+            
+            # getUpdates only returns ids at or above the offset it was given, so a
+            # batch below it means Telegram started numbering anew
+            if updates and updates[-1].update_id < offset:
+                logger.warning("Update ids restarted at %s (expected %s or above), resetting the offset",
+                               updates[0].update_id, offset)
+                self.offsets.reset(updates[0].update_id - 1)
+            
+            fresh = 0
+            for update in updates:
+                if self.offsets.received(update.update_id):
+                    fresh += 1
+                    await self.application.update_queue.put(update)
+            if updates and not fresh:
+                # Only updates still being handled came back, and getUpdates
+                # keeps answering at once until one of them is confirmed
+                await self.offsets.wait_finished(POLL_REFETCH_DELAY)
+    
+    async def _save_periodically(self):
+        while True:
+            await asyncio.sleep(self.save_interval)
+            try:
+                await self.save()
+            except Exception as e:
+                logger.error("Error saving the update offset: %s", e)
+
+async def run_polling(application: Application):
+    """Poll for updates through UpdatePoller until SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    add_stop_signal_handlers(stop_event)
+    
+    poller = UpdatePoller(application)
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        # getUpdates is refused while a webhook is set; waiting updates are kept
+        await application.bot.delete_webhook(drop_pending_updates=False)
+        await application.start()
+        await poller.start()
+        logger.info("🔄 Bot is now polling for updates...")
+        await stop_event.wait()
+    finally:
+        await poller.stop()
+        if application.running:
+            # Returns once every update already fetched has been handled
+            await application.stop()
+            await poller.finish()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+def register_handlers(application: Application):
+    """Register all bot handlers on application"""
+    application.add_handler(CommandHandler("start", start_command))
+    application.add_handler(CommandHandler("progress", progress_command))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("reset", reset_command))
+    application.add_handler(CommandHandler("stats", admin_stats))
+    application.add_handler(CommandHandler("funnel", funnel_command))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
+    application.add_handler(CommandHandler("reload", reload_command))
+    application.add_handler(CallbackQueryHandler(button_handler))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    
+    # Add error handler
+    application.add_error_handler(error_handler)
+
+def build_application(token, request=None, rate_limiter=None):
+    """Build the Application with all handlers, request overrides the Bot API transport"""
+    builder = (
+        Application.builder()
+        .token(token)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(PerUserUpdateProcessor())
+        .rate_limiter(rate_limiter or SendScheduler())
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
+    application.bot_data['membership'] = MembershipVerifier(application.bot)
+    register_handlers(application)
+    register_metrics(application)
+    return application
 
 def main():
     """Main function to start the bot"""
-    # Initialize database
-    init_db()
+    # Initialize database, a remote one is initialized by its state server
+    if isinstance(user_store, UserStore):
+        init_db()
     
     # Get bot token
     TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
@@ -732,39 +5317,44 @@ def main():
         return
     
     logger.info("🤖 Starting Freequency Airdrop Bot...")
-    logger.info(f"📊 Database path: {DB_PATH}")
+    logger.info("📊 Database path: %s", DB_PATH)
+    logger.info("📋 Config: %s tasks, %s campaigns from %s", len(TASKS), len(CONFIG.campaigns), CONFIG.path or 'built-in defaults')
     
     # Create application with compatibility fix
     try:
-        application = Application.builder().token(TOKEN).build()
+        application = build_application(TOKEN)
     except Exception as e:
-        logger.error(f"Failed to create application: {e}")
+        logger.error("Failed to create application: %s", e)
         # Try alternative approach
         logger.info("Trying alternative application creation...")
         from telegram.ext import Updater
         updater = Updater(token=TOKEN, use_context=True)
         application = updater.dispatcher.application
+        register_handlers(application)
     
-    # Add handlers
-    application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CommandHandler("progress", progress_command))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("reset", reset_command))
-    application.add_handler(CommandHandler("stats", admin_stats))
-    application.add_handler(CallbackQueryHandler(button_handler))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    if UPDATE_MODE == 'webhook':
+        if not WEBHOOK_SECRET_TOKEN:
+            # Without it anyone reaching the port could forge updates, admin commands included
+            logger.error("❌ UPDATE_MODE=webhook needs WEBHOOK_SECRET_TOKEN")
+            return
+        if len(WORKER_PEERS) > 1:
+            logger.info("👥 Worker %s of %s, state backend %s", WORKER_INDEX, len(WORKER_PEERS), STATE_BACKEND)
+        asyncio.run(run_webhook(application))
+        return
     
-    # Add error handler
-    application.add_error_handler(error_handler)
+    if len(WORKER_PEERS) > 1:
+        # Telegram hands each update to one getUpdates caller, so workers cannot share polling
+        logger.error("❌ Several workers need UPDATE_MODE=webhook")
+        return
     
-    # Start polling
-    logger.info("🔄 Bot is now polling for updates...")
-    application.run_polling(
-        poll_interval=1.0,
-        timeout=10,
-        drop_pending_updates=True,
-        allowed_updates=Update.ALL_TYPES
-    )
+    asyncio.run(run_polling(application))
 
 if __name__ == '__main__':
-    main()
+    if sys.argv[1:2] == ['export']:
+        export_cli(sys.argv[2:])
+    elif sys.argv[1:2] == ['vacuum']:
+        vacuum_cli(sys.argv[2:])
+    elif sys.argv[1:2] == ['state-server']:
+        state_server_cli(sys.argv[2:])
+    else:
+        main()
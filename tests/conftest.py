@@ -0,0 +1,85 @@
+import contextlib
+import os
+import sys
+import tempfile
+
+# bot reads its settings at import time, keep it away from the real config and database
+os.environ.setdefault('CONFIG_PATH', os.path.join(tempfile.gettempdir(), 'airdrop-tests-no-config.yaml'))
+os.environ.setdefault('DB_PATH', os.path.join(tempfile.mkdtemp(prefix='airdrop-tests-'), 'airdrop_bot.db'))
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+import bot  # noqa: E402
+from benchmark import FAKE_TOKEN, FakeTelegram  # noqa: E402
+
+SPRING_TASKS = [
+    {
+        'name': f'Spring task {task_id}',
+        'description': f'Spring task number {task_id}',
+        'url': 'https://example.com/spring',
+        'button_text': '✅ Done',
+        'verification_text': 'Click below when done',
+    }
+    for task_id in (1, 2, 3)
+]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A migrated database in a temporary directory"""
+    path = str(tmp_path / 'airdrop_bot.db')
+    bot.init_db(path)
+    return path
+
+
+@pytest.fixture
+def campaign_config():
+    """Apply the default tasks plus a three-task 'spring' campaign, restoring the config afterwards"""
+    original = bot.CONFIG
+    config = bot.compile_config({
+        'tasks': bot.DEFAULT_TASKS,
+        'admins': bot.DEFAULT_ADMINS,
+        'campaigns': {'spring': {'name': 'Spring Drop', 'tasks': SPRING_TASKS}},
+    })
+    bot.apply_config(config)
+    yield config
+    bot.apply_config(original)
+    bot.progress_cache.clear()
+
+
+@pytest.fixture
+def bot_app(db_path, monkeypatch):
+    """Run the handlers against FakeTelegram and a store on db_path
+
+    Returns an async context manager yielding (application, fake); feed it
+    updates with application.process_update(). The module-level state the
+    handlers share is replaced by fresh instances for the test.
+    """
+    store = bot.UserStore(db_path)
+    monkeypatch.setattr(bot, 'user_store', store)
+    monkeypatch.setattr(bot, 'event_log', bot.EventLog(store))
+    monkeypatch.setattr(bot, 'funnel_report', bot.FunnelReport(store))
+    # Tests click faster than the abuse limits allow
+    monkeypatch.setattr(bot, 'abuse_scorer', bot.AbuseScorer(max_clicks=10**6, min_verify_interval=0))
+    monkeypatch.setattr(bot, 'progress_cache', bot.ProgressCache())
+    monkeypatch.setattr(bot, 'recent_callbacks', bot.RecentCallbacks())
+    monkeypatch.setattr(bot, 'shown_screens', bot.ShownScreens())
+    monkeypatch.setattr(bot, 'screen_transitions', bot.ScreenTransitions())
+    
+    @contextlib.asynccontextmanager
+    async def running(fake=None):
+        fake = fake or FakeTelegram()
+        unlimited = bot.SendScheduler(global_rate=1e6, per_chat_rate=1e6, per_chat_burst=10**6)
+        application = bot.build_application(FAKE_TOKEN, request=fake, rate_limiter=unlimited)
+        await application.initialize()
+        try:
+            yield application, fake
+        finally:
+            bot.screen_transitions.cancel_all()
+            await application.shutdown()
+            await store.close()
+    
+    return running
@@ -0,0 +1,97 @@
+import pytest
+
+import bot
+
+
+def scorer(**kwargs):
+    settings = dict(capacity=64, max_clicks=5, min_verify_interval=2.0, max_resets_per_hour=2,
+                    flag_score=10, score_half_life=100.0)
+    settings.update(kwargs)
+    return bot.AbuseScorer(**settings)
+
+
+def same_set_users(abuse, count):
+    """count user ids that hash to the same set of ways"""
+    def set_of(user_id):
+        return ((user_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) % abuse._sets
+    return [user_id for user_id in range(1, 10**5) if set_of(user_id) == set_of(1)][:count]
+
+
+def test_table_is_allocated_on_first_use():
+    abuse = bot.AbuseScorer(capacity=10**6)
+    assert abuse._users is None
+    assert abuse.score(1) == 0.0
+    assert abuse._users is None
+    abuse.check(1, 'click', now=0)
+    assert len(abuse._users) == abuse.capacity == 10**6
+
+
+def test_clicks_beyond_the_window_limit_are_throttled():
+    abuse = scorer()
+    assert [abuse.check(1, 'click', now=i * 0.1)[0] for i in range(7)] == [True] * 5 + [False] * 2
+    assert abuse.throttled == 2
+    assert abuse.score(1, now=0.6) == pytest.approx(2 * bot.ABUSE_POINTS['click'], rel=0.01)
+    # Other users are not affected
+    assert abuse.check(2, 'click', now=0.7) == (True, None)
+    # Once the window has slid past the burst, clicks go through again
+    assert abuse.check(1, 'click', now=25)[0]
+
+
+def test_verify_too_soon_after_the_screen_is_refused():
+    abuse = scorer()
+    abuse.record_view(1, now=100)
+    assert abuse.check(1, 'verify', now=101) == (False, None)
+    assert abuse.score(1, now=101) == pytest.approx(bot.ABUSE_POINTS['verify'])
+    assert abuse.check(1, 'verify', now=102.5) == (True, None)
+    # The timer restarts at each accepted verification
+    assert not abuse.check(1, 'verify', now=103)[0]
+
+
+def test_resets_are_limited_per_hour():
+    abuse = scorer()
+    assert [abuse.check(1, 'reset', now=i * 60)[0] for i in range(3)] == [True, True, False]
+    assert abuse.check(1, 'reset', now=3 * 3600)[0]
+
+
+def test_score_decays_with_the_half_life():
+    abuse = scorer()
+    abuse.check(1, 'wallet_reuse', now=0)
+    assert abuse.score(1, now=0) == pytest.approx(5)
+    assert abuse.score(1, now=100) == pytest.approx(2.5)
+    assert abuse.score(1, now=300) == pytest.approx(0.625)
+    # Decay is applied before new points are added
+    abuse.check(1, 'wallet_reuse', now=100)
+    assert abuse.score(1, now=100) == pytest.approx(7.5)
+
+
+def test_user_is_flagged_once_on_crossing_the_threshold():
+    abuse = scorer()
+    assert abuse.check(1, 'wallet_reuse', now=0) == (True, None)
+    assert abuse.check(1, 'wallet_reuse', now=0) == (True, 'wallet_reuse')
+    assert abuse.check(1, 'wallet_reuse', now=0) == (True, None)
+    assert (abuse.flagged, abuse.throttled) == (1, 0)
+    
+    # Refusals count towards the threshold too
+    abuse = scorer(flag_score=4)
+    abuse.record_view(2, now=0)
+    assert abuse.check(2, 'verify', now=0.5) == (False, None)
+    assert abuse.check(2, 'verify', now=0.5) == (False, 'verify')
+
+
+def test_full_set_evicts_the_least_recently_seen_user():
+    abuse = scorer(capacity=64)
+    users = same_set_users(abuse, bot.ABUSE_SET_WAYS + 1)
+    for now, user_id in enumerate(users[:-1], 1):
+        abuse.check(user_id, 'wallet_reuse', now=now)
+    assert abuse.evictions == 0
+    # users[0] is seen again, users[1] is now the idlest
+    abuse.check(users[0], 'click', now=10)
+    
+    abuse.check(users[-1], 'click', now=11)
+    assert abuse.evictions == 1
+    assert abuse.score(users[1], now=11) == 0.0
+    assert all(abuse.score(user_id, now=11) > 0 for user_id in [users[0], *users[2:-1]])
+    # An evicted user starts over with a clean slot
+    assert abuse.check(users[1], 'wallet_reuse', now=12) == (True, None)
+    assert abuse.score(users[1], now=12) == pytest.approx(5)
+    assert abuse.evictions == 2
@@ -0,0 +1,108 @@
+import asyncio
+import sqlite3
+from collections import Counter
+
+from telegram.error import Forbidden
+
+import bot
+
+ADMIN = 1
+USERS = list(range(3, 78, 3))
+BLOCKED = {9, 30, 60}
+
+
+class FakeBroadcastBot:
+    """send_message that records deliveries and stalls after stop_after sends, like a bot going down"""
+    
+    def __init__(self, stop_after=None):
+        self.stop_after = stop_after
+        self.delivered = Counter()
+        self.reports = []
+        self.calls = 0
+        self.stalled = asyncio.Event()
+    
+    async def send_message(self, chat_id, text, rate_limit_args=None):
+        if chat_id == ADMIN:
+            self.reports.append(text)
+            return
+        self.calls += 1
+        if self.stop_after is not None and self.calls > self.stop_after:
+            self.stalled.set()
+            await asyncio.Future()
+        if chat_id in BLOCKED:
+            raise Forbidden('Forbidden: bot was blocked by the user')
+        self.delivered[chat_id] += 1
+
+
+def deliveries(db_path, broadcast_id):
+    conn = sqlite3.connect(db_path)
+    try:
+        return dict(conn.execute(
+            'SELECT user_id, status FROM broadcast_deliveries WHERE broadcast_id = ?', (broadcast_id,)
+        ))
+    finally:
+        conn.close()
+
+
+def test_interrupted_broadcast_resumes_without_repeats(db_path, monkeypatch):
+    chunks = []
+    next_chunk = bot.BroadcastEngine._next_chunk
+    
+    def record_chunk(conn, broadcast_id, last_user_id, limit):
+        user_ids, delivered = next_chunk(conn, broadcast_id, last_user_id, limit)
+        chunks.append((last_user_id, user_ids, delivered))
+        return user_ids, delivered
+    monkeypatch.setattr(bot.BroadcastEngine, '_next_chunk', staticmethod(record_chunk))
+    
+    async def main():
+        store = bot.UserStore(db_path)
+        try:
+            for user_id in USERS:
+                await store.get_or_create_user(user_id, f'user{user_id}', 'User')
+            await store.flush()
+            
+            first = FakeBroadcastBot(stop_after=10)
+            engine = bot.BroadcastEngine(first, store, chunk_size=4, workers=2)
+            broadcast_id = await engine.start('Hello', ADMIN)
+            await asyncio.wait_for(first.stalled.wait(), 1)
+            # The bot goes down mid-chunk
+            task = engine._running[broadcast_id]
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            
+            _, _, status, last_user_id, sent, failed = await store.read(engine._get, broadcast_id)
+            assert status == 'running' and first.reports == []
+            recorded = deliveries(db_path, broadcast_id)
+            assert len(recorded) == sent + failed == 10
+            assert last_user_id == USERS[7]
+            assert set(first.delivered) | (BLOCKED & set(recorded)) == set(recorded)
+            
+            chunks.clear()
+            second = FakeBroadcastBot()
+            resumed = bot.BroadcastEngine(second, store, chunk_size=4, workers=2)
+            await resumed.resume()
+            await asyncio.gather(*resumed._running.values())
+            
+            # Keyset pages continue after the checkpoint, skipping users already recorded
+            assert chunks[0][0] == last_user_id
+            assert chunks[0][2] == {user_id for user_id in chunks[0][1] if user_id in recorded}
+            pages = [user_ids for _, user_ids, _ in chunks if user_ids]
+            assert all(len(user_ids) == 4 for user_ids in pages[:-1])
+            assert [user_id for user_ids in pages for user_id in user_ids] == USERS[8:]
+            
+            assert not set(first.delivered) & set(second.delivered)
+            assert first.delivered + second.delivered == Counter(u for u in USERS if u not in BLOCKED)
+            # Blocked users are recorded once and not tried again
+            assert second.calls == len(USERS) - len(recorded)
+            statuses = deliveries(db_path, broadcast_id)
+            assert {u for u, status in statuses.items() if status == 'blocked'} == BLOCKED
+            assert len(statuses) == len(USERS)
+            
+            _, _, status, _, sent, failed = await store.read(engine._get, broadcast_id)
+            assert (status, sent, failed) == ('done', len(USERS) - len(BLOCKED), len(BLOCKED))
+            assert second.reports == [f"📣 Broadcast #{broadcast_id} finished: {sent} delivered, {failed} failed."]
+            assert await store.read(engine._unfinished) == []
+        finally:
+            await store.close()
+    
+    asyncio.run(main())
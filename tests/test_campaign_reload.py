@@ -0,0 +1,87 @@
+import asyncio
+import logging
+
+from telegram import Update
+
+import bot
+from benchmark import callback_update, command_update
+
+USER = 5
+
+
+def main_only_config():
+    return bot.compile_config({'tasks': bot.DEFAULT_TASKS, 'admins': bot.DEFAULT_ADMINS})
+
+
+def errors(caplog):
+    return [record.getMessage() for record in caplog.records if record.levelno >= logging.ERROR]
+
+
+def test_reload_removing_the_campaign_mid_click(bot_app, campaign_config, monkeypatch, caplog):
+    monkeypatch.setattr(bot, 'screen_transitions', bot.ScreenTransitions(delay=0.01))
+    check_abuse = bot.check_abuse
+    
+    async def reload_then_check(user_id, action):
+        # The click passed the campaign check, then the config loses the campaign
+        bot.apply_config(main_only_config())
+        return await check_abuse(user_id, action)
+    
+    async def main():
+        async with bot_app() as (application, fake):
+            async def send(data):
+                await application.process_update(Update.de_json(data, application.bot))
+            
+            await send(command_update(1, USER, '/start spring'))
+            await send(callback_update(2, USER, 'spring:start_tasks'))
+            assert await bot.UserManager.get_active_campaign(USER) == 'spring'
+            
+            monkeypatch.setattr(bot, 'check_abuse', reload_then_check)
+            edits = fake.calls['editMessageText']
+            await send(callback_update(3, USER, 'spring:verify_1'))
+            await asyncio.sleep(0.1)
+            # The confirmation and the follow-up screen were both shown
+            assert fake.calls['editMessageText'] == edits + 2
+            
+            # Later clicks on the old buttons are told the campaign is over
+            monkeypatch.setattr(bot, 'check_abuse', check_abuse)
+            answers = fake.calls['answerCallbackQuery']
+            await send(callback_update(4, USER, 'spring:task_2'))
+            assert fake.calls['answerCallbackQuery'] == answers + 1
+            assert await bot.UserManager.get_active_campaign(USER) == bot.MAIN_CAMPAIGN
+    
+    with caplog.at_level(logging.ERROR):
+        asyncio.run(main())
+    assert errors(caplog) == []
+
+
+def test_lookups_of_a_removed_campaign_fall_back_to_main(db_path, campaign_config):
+    async def main():
+        store = bot.UserStore(db_path)
+        try:
+            await store.get_or_create_user(USER, 'user5', 'User')
+            await store.enroll(USER, 'spring')
+            await store.mark_task_completed(USER, 1, 'spring')
+            
+            bot.apply_config(main_only_config())
+            main_tasks = len(bot.CONFIG.tasks)
+            
+            await store.mark_task_completed(USER, 3, 'spring')
+            progress = await store.get_user_progress(USER, 'spring')
+            assert progress['tasks_completed'][:3] == [True, False, True]
+            assert len(progress['tasks_completed']) == main_tasks
+            stats = await store.get_campaign_stats('spring')
+            assert stats['total_users'] == 1
+            assert len(stats['task_completions']) == main_tasks
+        finally:
+            await store.close()
+    
+    asyncio.run(main())
+    
+    # Screens rendered for the removed campaign show the main one
+    text, markup = bot.render_task_screen(3, 0b101, 'spring')
+    assert bot.DEFAULT_TASKS[2]['name'] in text
+    buttons = [button.callback_data for row in markup.inline_keyboard for button in row if button.callback_data]
+    assert buttons and not any(data.startswith('spring:') for data in buttons)
+    text, markup = bot.render_progress_screen(0b101, 9, 'spring')
+    assert 'Task 2 of' in text
+    assert bot.get_campaign('spring') is bot.CONFIG.campaigns[bot.MAIN_CAMPAIGN]
@@ -0,0 +1,153 @@
+import asyncio
+import os
+import re
+
+import pytest
+import yaml
+
+import bot
+
+EXAMPLE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'airdrop_config.example.yaml')
+
+
+def task(task_id, **fields):
+    return {
+        'name': f'Task {task_id}',
+        'description': f'Do task {task_id}',
+        'url': 'https://example.com',
+        'button_text': '✅ Done',
+        'verification_text': 'Click below when done',
+        **fields,
+    }
+
+
+def raw_config(task_count=3, **extra):
+    return {'tasks': [task(task_id) for task_id in range(1, task_count + 1)], 'admins': ['@admin'], **extra}
+
+
+@pytest.fixture(autouse=True)
+def restore_config():
+    original = bot.CONFIG
+    yield
+    bot.apply_config(original)
+    bot.progress_cache.clear()
+
+
+@pytest.fixture
+def example_raw():
+    """airdrop_config.example.yaml with its commented campaigns section switched on"""
+    with open(EXAMPLE_PATH, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    start = lines.index('# campaigns:')
+    for i in range(start, len(lines)):
+        if re.match(r'#( {2,}| ?$|\s*(campaigns|default_campaign):)', lines[i]):
+            lines[i] = lines[i][2:]
+    return yaml.safe_load('\n'.join(lines))
+
+
+def test_example_config_compiles():
+    config = bot.load_config(EXAMPLE_PATH)
+    assert config.path == EXAMPLE_PATH and config.mtime
+    assert [task['id'] for task in config.tasks] == [1, 2, 3, 4, 5]
+    assert config.admins == ('@dallen32', '@joyouschrs')
+    assert config.messages['wallet_saved'].endswith('@dallen32\n@joyouschrs')
+    assert list(config.campaigns) == [bot.MAIN_CAMPAIGN]
+
+
+def test_example_campaigns_compile(example_raw):
+    config = bot.compile_config(example_raw)
+    assert config.default_campaign == 'spring'
+    spring = config.campaigns['spring']
+    assert (spring.name, len(spring.tasks)) == ('Spring Drop', 1)
+    assert spring.messages['welcome'] == '🤖 *Spring Drop* - complete 1 tasks to qualify!'
+    # Not overridden by the campaign, so the top-level template applies
+    assert spring.messages['wallet_saved'] == config.messages['wallet_saved']
+
+
+@pytest.mark.parametrize('change, error', [
+    (lambda raw: raw['tasks'].__setitem__(1, 'Join the group'), 'task 2 must be a mapping'),
+    (lambda raw: raw['tasks'][0].__setitem__('name', 5), 'task 1: missing name'),
+    (lambda raw: raw['tasks'][2].__setitem__('chat_id', ['@group']), 'task 3: chat_id must be'),
+    (lambda raw: raw['tasks'][1].__setitem__('id', 1), 'task 2: id is 1'),
+    (lambda raw: raw['tasks'][0].pop('verification_text'), 'task 1: missing verification_text'),
+    (lambda raw: raw.__setitem__('messages', {'goodbye': 'Bye'}), 'unknown messages: goodbye'),
+    (lambda raw: raw.__setitem__('messages', {'help': 'Ask {owner}'}), "message 'help': invalid placeholder"),
+    (lambda raw: raw.__setitem__('campaigns', {'spring': {'tasks': []}}), 'campaign spring: '),
+    (lambda raw: raw.__setitem__('default_campaign', 'autumn'), "'default_campaign' 'autumn'"),
+    (lambda raw: raw.__setitem__('admins', ['admin']), "'admins' must be"),
+])
+def test_invalid_configs_are_rejected(change, error):
+    raw = raw_config()
+    change(raw)
+    with pytest.raises(bot.ConfigError, match=re.escape(error)):
+        bot.compile_config(raw)
+
+
+def test_invalid_file_keeps_the_current_config(tmp_path):
+    path = tmp_path / 'airdrop_config.yaml'
+    path.write_text('tasks:\n  - name: [unclosed\n', encoding='utf-8')
+    current = bot.CONFIG
+    with pytest.raises(bot.ConfigError, match='cannot parse'):
+        asyncio.run(bot.reload_config(str(path)))
+    assert bot.CONFIG is current
+
+
+def test_reload_invalidates_the_render_cache():
+    bot.apply_config(bot.compile_config(raw_config()))
+    text, _ = bot.render_task_screen(1, 0)
+    assert 'Task 1: Task 1' in text
+    
+    raw = raw_config()
+    raw['tasks'][0]['name'] = 'Renamed task'
+    bot.apply_config(bot.compile_config(raw))
+    text, _ = bot.render_task_screen(1, 0)
+    assert 'Task 1: Renamed task' in text and 'Task 1: Task 1' not in text
+    assert bot.render_task_screen.cache_info().currsize == 1
+
+
+def test_reload_clears_cached_progress_only_when_task_counts_change():
+    bot.apply_config(bot.compile_config(raw_config(3)))
+    bot.progress_cache.put(1, {'current_step': 2, 'tasks_completed': [True, False, False]})
+    
+    raw = raw_config(3)
+    raw['tasks'][2]['name'] = 'Renamed task'
+    bot.apply_config(bot.compile_config(raw))
+    assert 1 in bot.progress_cache
+    
+    bot.apply_config(bot.compile_config(raw_config(4)))
+    assert 1 not in bot.progress_cache
+
+
+@pytest.mark.parametrize('tasks_completed, current_step, expected', [
+    ([True, False, False], 2, 2),
+    ([True, True, False], 5, 3),
+    ([False, True, True], 4, 1),
+    ([True, True, True], 5, 3),
+    ([True, False, True], 0, 2),
+])
+def test_stored_step_is_clamped_to_a_configured_task(tasks_completed, current_step, expected):
+    assert bot.resume_step(tasks_completed, current_step) == expected
+
+
+def test_progress_after_dropping_the_current_task(db_path):
+    bot.apply_config(bot.compile_config(raw_config(5)))
+    
+    async def main():
+        store = bot.UserStore(db_path)
+        try:
+            await store.get_or_create_user(1, 'user1', 'User')
+            for task_num in (1, 2):
+                await store.mark_task_completed(1, task_num)
+            await store.update_user_step(1, 5)
+            
+            bot.apply_config(bot.compile_config(raw_config(3)))
+            progress = await store.get_user_progress(1)
+            assert progress['tasks_completed'] == [True, True, False]
+            assert progress['current_step'] == 3
+        finally:
+            await store.close()
+    
+    asyncio.run(main())
+    text, markup = bot.render_progress_screen(0b11, 5)
+    assert 'Task 3 of 3' in text
+    assert markup.inline_keyboard[0][0].callback_data == 'task_3'
@@ -0,0 +1,91 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+import bot
+
+HOSTILE_NAMES = ['=HYPERLINK("http://evil")', '+1+1', '-2', '@SUM(A1)', '\tTab', '\rReturn']
+
+
+def export_row(user_id, first_name='User', wallet_address=None):
+    return (user_id, f'user{user_id}', first_name, 1, 0, False, wallet_address,
+            '2026-01-01 00:00:00', '2026-01-01 00:00:00', None, None)
+
+
+def parse_csv(data):
+    return list(csv.reader(io.StringIO(data.decode('utf-8'), newline='')))
+
+
+def test_csv_cells_that_look_like_formulas_are_escaped():
+    rows = [export_row(user_id, name) for user_id, name in enumerate(HOSTILE_NAMES, 1)]
+    rows.append(export_row(99, 'Plain name', '0xabc'))
+    table = parse_csv(b''.join(bot.encode_export_rows(rows, 'csv')))
+    
+    assert table[0] == list(bot.EXPORT_COLUMNS)
+    first_names = [row[bot.EXPORT_COLUMNS.index('first_name')] for row in table[1:]]
+    assert first_names == ["'" + name for name in HOSTILE_NAMES] + ['Plain name']
+    # Numbers and other cells are untouched
+    assert table[-1][:2] == ['99', 'user99']
+    assert table[-1][bot.EXPORT_COLUMNS.index('wallet_address')] == '0xabc'
+
+
+def test_jsonl_keeps_values_as_they_are():
+    rows = [export_row(user_id, name) for user_id, name in enumerate(HOSTILE_NAMES, 1)]
+    lines = b''.join(bot.encode_export_rows(rows, 'jsonl')).decode('utf-8').splitlines()
+    records = [json.loads(line) for line in lines]
+    assert [record['first_name'] for record in records] == HOSTILE_NAMES
+    assert records[0]['user_id'] == 1 and records[0]['completed_all'] is False
+
+
+@pytest.mark.parametrize('fmt', bot.EXPORT_FORMATS)
+def test_chunks_split_only_between_rows(fmt):
+    # Quoted newlines inside a cell must not count as row ends
+    rows = [export_row(user_id, f'Name\nwith break {user_id}' if user_id % 7 == 0 else 'User')
+            for user_id in range(1, 301)]
+    chunks = list(bot.encode_export_rows(rows, fmt, chunk_size=512))
+    whole = b''.join(bot.encode_export_rows(rows, fmt, chunk_size=10**9))
+    assert len(chunks) > 10
+    assert b''.join(chunks) == whole
+    
+    if fmt == 'csv':
+        parsed = [parse_csv(chunk) for chunk in chunks]
+        assert parsed[0][0] == list(bot.EXPORT_COLUMNS)
+        assert sum(len(table) for table in parsed) == len(rows) + 1
+        assert all(len(row) == len(bot.EXPORT_COLUMNS) for table in parsed for row in table)
+    else:
+        records = [json.loads(line) for chunk in chunks for line in chunk.decode('utf-8').splitlines()]
+        assert [record['user_id'] for record in records] == list(range(1, 301))
+    assert all(chunk.endswith(b'\n') for chunk in chunks)
+
+
+@pytest.mark.parametrize('fmt', bot.EXPORT_FORMATS)
+def test_gzip_export_decompresses_to_the_full_export(db_path, fmt):
+    async def main():
+        store = bot.UserStore(db_path)
+        try:
+            for user_id in range(1, 2501):
+                await store.get_or_create_user(user_id, f'user{user_id}', '=cmd' if user_id == 5 else 'User')
+            await store.mark_task_completed(5, 1)
+        finally:
+            await store.close()
+    
+    asyncio.run(main())
+    
+    compressed, plain = io.BytesIO(), io.BytesIO()
+    assert bot.write_export(db_path, compressed, fmt, compress=True) == 2500
+    assert bot.write_export(db_path, plain, fmt, compress=False) == 2500
+    assert len(plain.getvalue()) > bot.EXPORT_CHUNK_SIZE
+    assert gzip.decompress(compressed.getvalue()) == plain.getvalue()
+    
+    if fmt == 'csv':
+        table = parse_csv(plain.getvalue())
+        assert len(table) == 2501
+        assert table[5][2] == "'=cmd"
+    else:
+        records = [json.loads(line) for line in plain.getvalue().decode('utf-8').splitlines()]
+        assert records[4]['first_name'] == '=cmd'
+        assert records[4]['tasks_completed'] == 1
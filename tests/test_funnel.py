@@ -0,0 +1,127 @@
+import asyncio
+import math
+import random
+import sqlite3
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+import bot
+
+# Gaps between steps in seconds, spread over the histogram buckets
+GAPS = (0.5, 1.5, 4, 9, 45, 100, 400, 2000, 5000, 50000, 100000)
+
+
+def user_events(rng, user_id, started_at):
+    """A plausible path through the tasks, with repeated clicks, resets and drop-outs"""
+    events, now = [(user_id, 'start', None, started_at)], started_at
+    for task in range(1, len(bot.TASKS) + 1):
+        now += rng.choice(GAPS)
+        events.append((user_id, 'view', task, now))
+        if rng.random() < 0.15:
+            events.append((user_id, 'view', task, now + 1))
+        if rng.random() < 0.1:
+            now += rng.choice(GAPS)
+            events.append((user_id, 'reset', None, now))
+        if rng.random() < 0.2:
+            break
+        now += rng.choice(GAPS)
+        events.append((user_id, 'verify', task, now))
+        if rng.random() < 0.1:
+            now += rng.choice(GAPS)
+            events.append((user_id, 'verify', task, now))
+    return events
+
+
+def generate_events(seed, user_ids, base):
+    rng = random.Random(seed)
+    events = []
+    for user_id in user_ids:
+        events.extend(user_events(rng, user_id, base + rng.uniform(0, 4 * 3600)))
+    return sorted(events, key=lambda event: event[3])
+
+
+def nearest_rank_bucket(durations, q):
+    """Upper bound of the bucket holding the exact q quantile of durations"""
+    if not durations:
+        return None
+    value = sorted(durations)[math.ceil(q * len(durations)) - 1]
+    bucket = bisect_left(bot.DURATION_BUCKETS, value)
+    return bot.DURATION_BUCKETS[bucket] if bucket < len(bot.DURATION_BUCKETS) else float('inf')
+
+
+def recompute(events):
+    """The report built straight from the events, in the shape of FunnelReport.get_report()"""
+    first_seen, clock = {}, {}
+    durations = defaultdict(list)
+    for user_id, kind, step, created_at in events:
+        first_seen.setdefault(user_id, created_at)
+        clock.setdefault(user_id, created_at)
+        if kind == 'reset':
+            clock[user_id] = created_at
+        elif kind == 'verify':
+            durations[step].append(created_at - clock[user_id])
+            clock[user_id] = created_at
+    
+    def users_with(kind, task):
+        return {user_id for user_id, event_kind, step, _ in events if event_kind == kind and step == task}
+    
+    completed = users_with('verify', len(bot.TASKS))
+    cohorts = defaultdict(lambda: [0, 0])
+    for user_id, created_at in first_seen.items():
+        cohorts[int(created_at // 3600)][0] += 1
+        cohorts[int(created_at // 3600)][1] += user_id in completed
+    return {
+        'users': len(first_seen),
+        'starts': sum(1 for event in events if event[1] == 'start'),
+        'resets': sum(1 for event in events if event[1] == 'reset'),
+        'tasks': [
+            {
+                'viewed': len(users_with('view', task)),
+                'verified': len(users_with('verify', task)),
+                'median': nearest_rank_bucket(durations[task], 0.5),
+                'p90': nearest_rank_bucket(durations[task], 0.9),
+            }
+            for task in range(1, len(bot.TASKS) + 1)
+        ],
+        'cohorts': sorted((hour, *counts) for hour, counts in cohorts.items()),
+    }
+
+
+def last_rolled_up_event(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT value FROM stats_counters WHERE name = 'funnel_last_event'").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_report_matches_the_events(db_path):
+    base = time.time() - 12 * 3600
+    first = generate_events(1, range(1, 61), base)
+    # New users plus later steps of existing ones
+    second = generate_events(2, range(41, 91), base + 24 * 3600)
+    
+    async def main():
+        store = bot.UserStore(db_path)
+        report = bot.FunnelReport(store, batch_size=7)
+        try:
+            await store.write(bot.EventLog._insert, first)
+            assert await report.refresh() == len(first)
+            built = await report.get_report(hours=24)
+            assert built == recompute(first)
+            assert built['tasks'][0]['median'] is not None
+            
+            # Only the new rows are folded in, in one more rollup
+            await store.write(bot.EventLog._insert, second)
+            assert await store.write(bot.FunnelReport._rollup, 10**6) == len(second)
+            assert await store.write(bot.FunnelReport._rollup, 10**6) == 0
+            assert await report.get_report(hours=24) == recompute(first + second)
+            
+            conversion = [task['verified'] / task['viewed'] for task in built['tasks'] if task['viewed']]
+            assert all(0 < rate <= 1 for rate in conversion)
+        finally:
+            await store.close()
+    
+    asyncio.run(main())
+    assert last_rolled_up_event(db_path) == len(first) + len(second)
@@ -0,0 +1,128 @@
+import asyncio
+import os
+import sqlite3
+
+import bot
+
+OLD = '2020-01-01 00:00:00'
+
+
+def make_old(conn, user_ids):
+    with conn:
+        conn.executemany('UPDATE users SET last_active = ? WHERE user_id = ?', [(OLD, user_id) for user_id in user_ids])
+
+
+def table_ids(db_path, table):
+    conn = sqlite3.connect(db_path)
+    try:
+        return {row[0] for row in conn.execute(f'SELECT user_id FROM {table}')}
+    finally:
+        conn.close()
+
+
+def users_counter(conn):
+    return conn.execute("SELECT value FROM stats_counters WHERE name = 'users'").fetchone()[0]
+
+
+async def add_users(store, user_ids):
+    for user_id in user_ids:
+        await store.get_or_create_user(user_id, f'user{user_id}', 'User')
+    await store.flush()
+
+
+def test_archive_keeps_users_with_queued_writes(db_path, monkeypatch):
+    async def main():
+        store = bot.UserStore(db_path, batch_delay=60)
+        maintenance = bot.DatabaseMaintenance(store, backup_dir=None, archive_days=30, batch_size=3)
+        try:
+            await add_users(store, range(1, 11))
+            await store.mark_task_completed(9, len(bot.TASKS))
+            await store.save_wallet_address(10, '0xabc', '0xabc')
+            await store.update_user_step(4, 2)
+            await store.flush()
+            await store.write(make_old, range(1, 11))
+            
+            # Coalesced into the next batch, the step write of 2 also makes them active again
+            await store.update_user_step(2, 3)
+            # Queued while the store flushes before a batch, so still pending when it runs
+            flush = store.flush
+            
+            async def flush_then_write():
+                await flush()
+                if not store.has_pending_writes(7):
+                    await store._queue_write(7, [(bot.SQL_ADVANCE_STEP, (4, 7, 1))])
+            monkeypatch.setattr(store, 'flush', flush_then_write)
+            monkeypatch.setattr(bot, 'MIGRATION_BATCH_PAUSE', 0)
+            
+            assert await maintenance.archive_inactive() == 6
+            monkeypatch.setattr(store, 'flush', flush)
+            await store.flush()
+            
+            assert table_ids(db_path, 'users_archive') == {1, 3, 4, 5, 6, 8}
+            assert table_ids(db_path, 'users') == {2, 7, 9, 10}
+            assert (await store.get_user_progress(2))['current_step'] == 3
+            assert (await store.get_user_progress(7))['current_step'] == 4
+            assert await store.read(users_counter) == 10
+            
+            # A returning user gets their progress back
+            assert not await store.get_or_create_user(4, 'user4', 'Back')
+            await store.flush()
+            assert 4 in table_ids(db_path, 'users') and 4 not in table_ids(db_path, 'users_archive')
+            assert (await store.get_user_progress(4))['current_step'] == 2
+            assert await store.read(users_counter) == 10
+        finally:
+            await store.close()
+    
+    asyncio.run(main())
+
+
+def test_backup_keeps_the_newest_snapshots(db_path, tmp_path):
+    backups = tmp_path / 'backups'
+    backups.mkdir()
+    for stamp in ('20200101T000000Z', '20200102T000000Z', '20200103T000000Z'):
+        (backups / f'airdrop_bot-{stamp}.db').write_bytes(b'')
+    
+    async def main():
+        store = bot.UserStore(db_path, batch_delay=60)
+        maintenance = bot.DatabaseMaintenance(store, backup_dir=backups, backup_keep=2)
+        try:
+            await add_users(store, range(1, 6))
+            # Not committed yet, so not in the snapshot
+            await store.update_user_step(1, 4)
+            await maintenance.backup()
+        finally:
+            await store.close()
+    
+    asyncio.run(main())
+    snapshots = sorted(path.name for path in backups.iterdir())
+    assert len(snapshots) == 2 and snapshots[0] == 'airdrop_bot-20200103T000000Z.db'
+    copy = sqlite3.connect(backups / snapshots[1])
+    try:
+        assert copy.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+        assert copy.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 5
+        assert copy.execute('SELECT current_step FROM users WHERE user_id = 1').fetchone()[0] == 1
+    finally:
+        copy.close()
+
+
+def test_checkpoint_truncates_the_wal(db_path):
+    wal = db_path + '-wal'
+    
+    async def main():
+        store = bot.UserStore(db_path)
+        maintenance = bot.DatabaseMaintenance(store, backup_dir=None)
+        try:
+            await add_users(store, range(1, 501))
+            assert os.path.getsize(wal) > 0
+            await maintenance.checkpoint()
+            assert os.path.getsize(wal) == 0
+            
+            # Writes carry on after it
+            await store.update_user_step(500, 2)
+            await store.flush()
+            assert (await store.get_user_progress(500))['current_step'] == 2
+        finally:
+            await store.close()
+    
+    asyncio.run(main())
+    assert table_ids(db_path, 'users') == set(range(1, 501))
@@ -0,0 +1,125 @@
+import asyncio
+
+from telegram.error import BadRequest, NetworkError
+
+import bot
+from benchmark import FakeMembershipBot
+
+GROUP = -100123
+
+
+def verifier(fake, **kwargs):
+    kwargs.setdefault('rate', 1000)
+    kwargs.setdefault('max_concurrent', 100)
+    return bot.MembershipVerifier(fake, **kwargs)
+
+
+class FailingMembershipBot(FakeMembershipBot):
+    """FakeMembershipBot whose get_chat_member raises error"""
+
+    def __init__(self, error):
+        super().__init__(latency=0)
+        self.error = error
+
+    async def get_chat_member(self, chat_id, user_id):
+        self.calls += 1
+        raise self.error
+
+
+def test_caches_members_until_ttl():
+    fake = FakeMembershipBot(latency=0)
+    members = verifier(fake, ttl=0.2, negative_ttl=0.2)
+    
+    async def main():
+        assert await members.is_member(GROUP, 1) is True
+        assert await members.is_member(GROUP, 1) is True
+        assert fake.calls == 1
+        await asyncio.sleep(0.25)
+        assert await members.is_member(GROUP, 1) is True
+        assert fake.calls == 2
+    
+    asyncio.run(main())
+
+
+def test_non_members_expire_after_negative_ttl():
+    fake = FakeMembershipBot(latency=0)
+    members = verifier(fake, ttl=10, negative_ttl=0.1)
+    
+    async def main():
+        # Odd users are members of FakeMembershipBot's chats, even users are not
+        assert await members.is_member(GROUP, 1) is True
+        assert await members.is_member(GROUP, 2) is False
+        assert await members.is_member(GROUP, 2) is False
+        assert fake.calls == 2
+        await asyncio.sleep(0.15)
+        assert await members.is_member(GROUP, 2) is False
+        assert await members.is_member(GROUP, 1) is True
+        assert fake.calls == 3
+    
+    asyncio.run(main())
+
+
+def test_concurrent_checks_share_one_call():
+    fake = FakeMembershipBot(latency=0.05)
+    members = verifier(fake)
+    
+    async def main():
+        return await asyncio.gather(*(members.is_member(GROUP, 1) for _ in range(20)))
+    
+    assert asyncio.run(main()) == [True] * 20
+    assert fake.calls == 1
+    assert members.api_calls == 1
+    assert members.deduplicated == 19
+
+
+def test_concurrent_checks_of_different_users_are_not_shared():
+    fake = FakeMembershipBot(latency=0.05)
+    members = verifier(fake)
+    
+    async def main():
+        return await asyncio.gather(*(members.is_member(chat_id, user_id)
+                                      for chat_id in (GROUP, GROUP - 1) for user_id in (1, 2)))
+    
+    assert asyncio.run(main()) == [True, False, True, False]
+    assert fake.calls == 4
+    assert members.deduplicated == 0
+
+
+def test_cancelled_waiter_does_not_cancel_shared_check():
+    fake = FakeMembershipBot(latency=0.05)
+    members = verifier(fake)
+    
+    async def main():
+        impatient = asyncio.ensure_future(members.is_member(GROUP, 1))
+        patient = asyncio.ensure_future(members.is_member(GROUP, 1))
+        await asyncio.sleep(0.01)
+        impatient.cancel()
+        assert await patient is True
+        assert await members.is_member(GROUP, 1) is True
+    
+    asyncio.run(main())
+    assert fake.calls == 1
+
+
+def test_unknown_user_is_cached_as_non_member():
+    fake = FailingMembershipBot(BadRequest('User not found'))
+    members = verifier(fake)
+    
+    async def main():
+        assert await members.is_member(GROUP, 1) is False
+        assert await members.is_member(GROUP, 1) is False
+    
+    asyncio.run(main())
+    assert fake.calls == 1
+
+
+def test_errors_are_not_cached():
+    fake = FailingMembershipBot(NetworkError('connection reset'))
+    members = verifier(fake)
+    
+    async def main():
+        assert await members.is_member(GROUP, 1) is None
+        assert await members.is_member(GROUP, 1) is None
+    
+    asyncio.run(main())
+    assert fake.calls == 2
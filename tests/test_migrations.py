@@ -0,0 +1,133 @@
+import asyncio
+import sqlite3
+
+import bot
+
+# users table as created by the first release, before schema versioning
+BASELINE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    current_step INTEGER DEFAULT 1,
+    task1_completed INTEGER DEFAULT 0,
+    task2_completed INTEGER DEFAULT 0,
+    task3_completed INTEGER DEFAULT 0,
+    task4_completed INTEGER DEFAULT 0,
+    task5_completed INTEGER DEFAULT 0,
+    wallet_address TEXT,
+    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_user_id ON users(user_id);
+'''
+
+# user_id, current_step, task1..task5 completed, wallet
+LEGACY_USERS = [
+    (1, 1, 0, 0, 0, 0, 0, None),
+    (2, 2, 1, 0, 0, 0, 0, None),
+    (3, 4, 1, 1, 1, 0, 0, None),
+    (4, 5, 1, 1, 1, 1, 1, '0x' + 'ab' * 20),
+    (5, 5, 1, 0, 1, 0, 1, 'not a wallet'),
+    (6, 9, 0, 1, 0, 0, 0, None),
+    (7, 5, 1, 1, 1, 1, 1, '0x' + 'AB' * 20),
+]
+
+
+def legacy_mask(row):
+    return sum(done << i for i, done in enumerate(row[2:7]))
+
+
+def create_baseline_db(path):
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executescript(BASELINE_SCHEMA)
+        conn.executemany(
+            'INSERT INTO users (user_id, username, first_name, current_step, task1_completed, task2_completed,'
+            ' task3_completed, task4_completed, task5_completed, wallet_address) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(row[0], f'user{row[0]}', 'User', *row[1:]) for row in LEGACY_USERS]
+        )
+    conn.close()
+
+
+def schema_of(path):
+    conn = sqlite3.connect(path)
+    try:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        objects = conn.execute('SELECT type, name, sql FROM sqlite_master ORDER BY type, name').fetchall()
+        users = conn.execute('SELECT * FROM users ORDER BY user_id').fetchall()
+        return version, objects, users
+    finally:
+        conn.close()
+
+
+def test_baseline_database_is_migrated_and_backfilled(tmp_path):
+    path = str(tmp_path / 'airdrop_bot.db')
+    create_baseline_db(path)
+    bot.init_db(path)
+    
+    version, objects, _ = schema_of(path)
+    assert version == bot.MIGRATIONS[-1][0]
+    names = {name for _, name, _ in objects}
+    assert {'campaign_progress', 'users_archive', 'stats_counters', 'wallet_flags'} <= names
+    assert 'idx_user_id' not in names
+    
+    async def main():
+        store = bot.UserStore(path)
+        try:
+            # Before the backfill the legacy columns answer for tasks_mask
+            masks = await store.read(lambda conn: conn.execute('SELECT tasks_mask FROM users').fetchall())
+            assert masks == [(None,)] * len(LEGACY_USERS)
+            for row in LEGACY_USERS:
+                progress = await store.get_user_progress(row[0])
+                assert progress['tasks_completed'] == [bool(done) for done in row[2:7]]
+            stats = await store.get_stats()
+            assert stats['total_users'] == len(LEGACY_USERS)
+            assert stats['task_completions'] == [sum(row[2 + i] for row in LEGACY_USERS) for i in range(5)]
+            
+            await bot.run_backfills(store, batch_size=2)
+            
+            rows = await store.read(lambda conn: conn.execute(
+                'SELECT user_id, tasks_mask, current_step, completed_at IS NOT NULL, wallet_normalized'
+                ' FROM users ORDER BY user_id'
+            ).fetchall())
+            for row, (user_id, mask, step, completed, wallet) in zip(LEGACY_USERS, rows):
+                assert (user_id, mask, step) == (row[0], legacy_mask(row), row[1])
+                assert completed == bool(row[6])
+            assert [row[4] for row in rows] == [None, None, None, '0x' + 'ab' * 20, None, None, None]
+            flags = await store.read(lambda conn: conn.execute(
+                'SELECT user_id, reason FROM wallet_flags ORDER BY user_id'
+            ).fetchall())
+            assert flags == [(5, 'invalid'), (7, 'shared')]
+            
+            # Out of range steps resume at the first open task
+            assert (await store.get_user_progress(6))['current_step'] == 1
+            backfilled = await store.get_stats()
+            assert (backfilled['total_users'], backfilled['task_completions']) == (7, stats['task_completions'])
+            assert backfilled['flagged_wallets'] == {'invalid': 1, 'shared': 1}
+            backfills = await store.read(lambda conn: conn.execute('SELECT done FROM schema_backfills').fetchall())
+            assert backfills == [(1,)] * len(bot.BACKFILLS)
+        finally:
+            await store.close()
+    
+    asyncio.run(main())
+    
+    # A second start finds the schema current and changes nothing
+    before = schema_of(path)
+    bot.init_db(path)
+    assert schema_of(path) == before
+
+
+def test_new_database_starts_at_latest_version(tmp_path):
+    path = str(tmp_path / 'airdrop_bot.db')
+    bot.init_db(path)
+    version, _, users = schema_of(path)
+    assert version == bot.MIGRATIONS[-1][0]
+    assert users == []
+    
+    conn = sqlite3.connect(path)
+    try:
+        assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == bot.AUTO_VACUUM_INCREMENTAL
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    finally:
+        conn.close()
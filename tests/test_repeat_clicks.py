@@ -0,0 +1,145 @@
+import asyncio
+import types
+
+import pytest
+from telegram import Update
+from telegram.error import BadRequest
+
+import bot
+from benchmark import callback_update, command_update
+
+USER = 5
+
+
+class FakeQuery:
+    """The parts of a CallbackQuery edit_screen() uses, failing edits with error when set"""
+    
+    def __init__(self, message_id=1, error=None):
+        self.message = types.SimpleNamespace(chat=types.SimpleNamespace(id=USER), message_id=message_id)
+        self.error = error
+        self.edits = []
+    
+    async def edit_message_text(self, text, reply_markup=None, **kwargs):
+        self.edits.append(text)
+        if self.error:
+            raise self.error
+
+
+def skipped_writes(method):
+    return bot.WRITES_SKIPPED._values[(method,)]
+
+
+def test_double_click_within_the_window_is_a_repeat():
+    callbacks = bot.RecentCallbacks(window=2.0)
+    assert not callbacks.is_repeat(USER, 1, 'task_2', now=10)
+    assert callbacks.is_repeat(USER, 1, 'task_2', now=11)
+    # Measured from the first click, not the ignored one
+    assert not callbacks.is_repeat(USER, 1, 'task_2', now=12.5)
+    assert callbacks.repeats == 1
+    
+    # Another button or another message in between is a new click
+    assert not callbacks.is_repeat(USER, 1, 'task_3', now=13)
+    assert not callbacks.is_repeat(USER, 1, 'task_2', now=13.5)
+    assert not callbacks.is_repeat(USER, 2, 'task_2', now=13.5)
+    assert not callbacks.is_repeat(USER + 1, 1, 'task_2', now=13.5)
+
+
+def test_least_recently_clicked_messages_are_forgotten():
+    callbacks = bot.RecentCallbacks(window=60, capacity=2)
+    for message_id in (1, 2):
+        callbacks.is_repeat(USER, message_id, 'task_1', now=0)
+    callbacks.is_repeat(USER, 1, 'task_2', now=1)
+    callbacks.is_repeat(USER, 3, 'task_1', now=2)
+    assert callbacks.is_repeat(USER, 1, 'task_2', now=3)
+    assert not callbacks.is_repeat(USER, 2, 'task_1', now=3)
+
+
+def test_edit_to_the_shown_screen_is_skipped(monkeypatch):
+    monkeypatch.setattr(bot, 'shown_screens', bot.ShownScreens(capacity=10))
+    query = FakeQuery()
+    
+    async def main():
+        await bot.edit_screen(query, 'Task 1')
+        await bot.edit_screen(query, 'Task 1')
+        assert query.edits == ['Task 1']
+        await bot.edit_screen(query, 'Task 2')
+        await bot.edit_screen(FakeQuery(message_id=2), 'Task 2')
+        assert query.edits == ['Task 1', 'Task 2']
+        assert bot.shown_screens.skipped == 1
+        
+        # The message already showed it, edited from elsewhere
+        unmodified = FakeQuery(message_id=3, error=BadRequest('Message is not modified: specified new message content'))
+        await bot.edit_screen(unmodified, 'Task 3')
+        await bot.edit_screen(unmodified, 'Task 3')
+        assert unmodified.edits == ['Task 3']
+        
+        failing = FakeQuery(error=BadRequest('Message to edit not found'))
+        with pytest.raises(BadRequest):
+            await bot.edit_screen(failing, 'Task 4')
+        assert bot.shown_screens.get((USER, 1)) is None
+    
+    asyncio.run(main())
+
+
+def test_double_click_is_only_answered(bot_app, monkeypatch):
+    monkeypatch.setattr(bot, 'recent_callbacks', bot.RecentCallbacks(window=0.2))
+    
+    async def main():
+        async with bot_app() as (application, fake):
+            async def send(data):
+                await application.process_update(Update.de_json(data, application.bot))
+            
+            await send(command_update(1, USER, '/start'))
+            await send(callback_update(2, USER, 'task_2'))
+            assert fake.calls['editMessageText'] == 1
+            
+            answers = fake.calls['answerCallbackQuery']
+            await send(callback_update(3, USER, 'task_2'))
+            assert fake.calls['answerCallbackQuery'] == answers + 1
+            assert fake.calls['editMessageText'] == 1
+            assert bot.recent_callbacks.repeats == 1
+            
+            # After the window the click is handled, but the screen is already shown
+            await asyncio.sleep(0.25)
+            skipped = bot.shown_screens.skipped
+            await send(callback_update(4, USER, 'task_2'))
+            assert fake.calls['editMessageText'] == 1
+            assert bot.shown_screens.skipped == skipped + 1
+            assert bot.recent_callbacks.repeats == 1
+    
+    asyncio.run(main())
+
+
+def test_unchanged_progress_is_not_written(bot_app):
+    async def main():
+        async with bot_app():
+            store = bot.user_store
+            assert await bot.UserManager.get_or_create_user(USER, 'user5', 'User')
+            await store.flush()
+            step_skips = skipped_writes('update_user_step')
+            task_skips = skipped_writes('mark_task_completed')
+            
+            await bot.UserManager.update_user_step(USER, 1)
+            assert skipped_writes('update_user_step') == step_skips + 1
+            assert not store.has_pending_writes(USER)
+            
+            await bot.UserManager.update_user_step(USER, 2)
+            assert skipped_writes('update_user_step') == step_skips + 1
+            assert store.has_pending_writes(USER)
+            await store.flush()
+            
+            await bot.UserManager.mark_task_completed(USER, 2)
+            await bot.UserManager.mark_task_completed(USER, 2)
+            assert skipped_writes('mark_task_completed') == task_skips + 1
+            assert store.pending_writes == 1
+            
+            # A stale record is written even if it looks the same
+            bot.progress_cache.put(USER, await bot.UserManager.get_user_progress(USER), ttl=-1)
+            await store.flush()
+            await bot.UserManager.update_user_step(USER, 3)
+            assert store.has_pending_writes(USER)
+            await store.flush()
+            progress = await store.get_user_progress(USER)
+            assert progress['current_step'] == 3 and progress['tasks_completed'][1]
+    
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+import asyncio
+
+from telegram import Update
+
+import bot
+from benchmark import callback_update, command_update
+
+USER = 5
+DELAY = 0.1
+
+
+def test_command_before_the_follow_up_cancels_it(bot_app, monkeypatch):
+    monkeypatch.setattr(bot, 'screen_transitions', bot.ScreenTransitions(delay=DELAY))
+    
+    async def main():
+        async with bot_app() as (application, fake):
+            async def send(data):
+                await application.process_update(Update.de_json(data, application.bot))
+            
+            await send(command_update(1, USER, '/start'))
+            await send(callback_update(2, USER, 'start_tasks'))
+            
+            # Left alone, the confirmation is followed by the next task
+            edits = fake.calls['editMessageText']
+            await send(callback_update(3, USER, 'verify_1'))
+            assert fake.calls['editMessageText'] == edits + 1
+            assert len(bot.screen_transitions) == 1
+            await asyncio.sleep(DELAY * 3)
+            assert fake.calls['editMessageText'] == edits + 2
+            assert len(bot.screen_transitions) == 0
+            
+            # /progress arrives while the confirmation is up
+            edits, messages = fake.calls['editMessageText'], fake.calls['sendMessage']
+            await send(callback_update(4, USER, 'verify_2', message_id=2))
+            await send(command_update(5, USER, '/progress'))
+            assert fake.calls['sendMessage'] == messages + 1
+            await asyncio.sleep(DELAY * 3)
+            # Task 3 did not replace the confirmation under the progress screen
+            assert fake.calls['editMessageText'] == edits + 1
+            assert (bot.screen_transitions.scheduled, bot.screen_transitions.cancelled) == (2, 1)
+            assert len(bot.screen_transitions) == 0
+            
+            progress = await bot.UserManager.get_user_progress(USER)
+            assert progress['tasks_completed'][:2] == [True, True]
+    
+    asyncio.run(main())
+
+
+def test_cancel_stops_a_follow_up_that_is_already_running():
+    transitions = bot.ScreenTransitions(delay=0)
+    shown = []
+    
+    async def slow_screen(name, started):
+        started.set()
+        await asyncio.sleep(0.2)
+        shown.append(name)
+    
+    async def main():
+        started = asyncio.Event()
+        transitions.schedule(USER, slow_screen, 'task 2', started)
+        await asyncio.wait_for(started.wait(), 1)
+        transitions.cancel(USER)
+        await asyncio.sleep(0)
+        assert len(transitions) == 0
+        
+        # A newer schedule replaces the pending one, flush() shows it at once
+        transitions.delay = 60
+        transitions.schedule(USER, slow_screen, 'task 3', asyncio.Event())
+        transitions.schedule(USER, slow_screen, 'task 4', asyncio.Event())
+        await asyncio.wait_for(transitions.flush(), 2)
+        assert shown == ['task 4']
+        assert transitions.cancelled == 2
+    
+    asyncio.run(main())
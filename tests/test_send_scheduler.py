@@ -0,0 +1,163 @@
+import asyncio
+import json
+import time
+from collections import defaultdict
+
+import pytest
+from telegram.error import RetryAfter
+from telegram.ext import ExtBot
+
+import bot
+from benchmark import FAKE_TOKEN, FakeTelegram
+
+
+class FloodingTelegram(FakeTelegram):
+    """FakeTelegram that answers 429 to the next floods[chat_id] sends to a chat
+
+    Every delivered message is recorded per chat with its send time.
+    """
+
+    def __init__(self, floods=None, retry_after=0.05):
+        super().__init__(retry_after=retry_after)
+        self.floods = defaultdict(int, floods or {})
+        self.attempts = defaultdict(int)
+        self.delivered = defaultdict(list)
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        if endpoint != 'sendMessage':
+            return await super().do_request(url, method, request_data)
+        params = request_data.parameters
+        chat_id = params['chat_id']
+        self.attempts[chat_id] += 1
+        if self.floods[chat_id]:
+            self.floods[chat_id] -= 1
+            return 429, json.dumps({
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after},
+            }).encode()
+        self.delivered[chat_id].append((params['text'], time.monotonic()))
+        return 200, json.dumps({'ok': True, 'result': self._message(params)}).encode()
+
+
+def run_sends(scheduler, request, sends):
+    """Run sends(bot) against an ExtBot using scheduler and request"""
+    async def main():
+        ext_bot = ExtBot(FAKE_TOKEN, request=request, rate_limiter=scheduler)
+        await ext_bot.initialize()
+        try:
+            return await sends(ext_bot)
+        finally:
+            await ext_bot.shutdown()
+    return asyncio.run(main())
+
+
+def test_retries_each_flood_wait_until_delivered():
+    request = FloodingTelegram(floods={1: 2})
+    scheduler = bot.SendScheduler(global_rate=1000, per_chat_rate=1000, per_chat_burst=10, max_retries=3)
+    
+    run_sends(scheduler, request, lambda b: b.send_message(1, 'hello'))
+    
+    assert request.attempts[1] == 3
+    assert scheduler.flood_waits == 2
+    assert [text for text, _ in request.delivered[1]] == ['hello']
+
+
+def test_waits_retry_after_before_retrying():
+    request = FloodingTelegram(floods={1: 1}, retry_after=0.2)
+    scheduler = bot.SendScheduler(global_rate=1000, per_chat_rate=1000, per_chat_burst=10, max_retries=3)
+    
+    start = time.monotonic()
+    run_sends(scheduler, request, lambda b: b.send_message(1, 'hello'))
+    
+    assert request.delivered[1][0][1] - start >= 0.2
+
+
+def test_gives_up_after_max_retries():
+    request = FloodingTelegram(floods={1: 10})
+    scheduler = bot.SendScheduler(global_rate=1000, per_chat_rate=1000, per_chat_burst=10, max_retries=2)
+    
+    with pytest.raises(RetryAfter):
+        run_sends(scheduler, request, lambda b: b.send_message(1, 'hello'))
+    
+    assert request.attempts[1] == 3
+    assert scheduler.flood_waits == 2
+    assert not request.delivered[1]
+
+
+def test_keeps_per_chat_order_through_flood_waits():
+    request = FloodingTelegram(floods={1: 1, 3: 2})
+    scheduler = bot.SendScheduler(global_rate=1000, per_chat_rate=1000, per_chat_burst=10, max_retries=3)
+    
+    async def conversation(ext_bot, chat_id):
+        # Handlers send one message after the other within a chat
+        for i in range(5):
+            await ext_bot.send_message(chat_id, f'message {i}')
+    
+    async def sends(ext_bot):
+        await asyncio.gather(*(conversation(ext_bot, chat_id) for chat_id in (1, 2, 3)))
+    
+    run_sends(scheduler, request, sends)
+    
+    for chat_id in (1, 2, 3):
+        assert [text for text, _ in request.delivered[chat_id]] == [f'message {i}' for i in range(5)]
+    assert scheduler.flood_waits == 3
+
+
+def test_paces_sends_to_one_chat():
+    request = FloodingTelegram()
+    scheduler = bot.SendScheduler(global_rate=1000, per_chat_rate=20, per_chat_burst=2, max_retries=3)
+    
+    async def sends(ext_bot):
+        await asyncio.gather(*(ext_bot.send_message(1, f'message {i}') for i in range(8)))
+    
+    start = time.monotonic()
+    run_sends(scheduler, request, sends)
+    
+    times = [sent for _, sent in request.delivered[1]]
+    assert len(times) == 8
+    # The burst goes out at once, the remaining six at 20 per second
+    assert times[-1] - start >= 6 / 20 * 0.9
+    assert scheduler.throttled > 0
+
+
+def test_paces_sends_across_chats():
+    request = FloodingTelegram()
+    scheduler = bot.SendScheduler(global_rate=25, per_chat_rate=1000, per_chat_burst=10, max_retries=3)
+    
+    async def sends(ext_bot):
+        await asyncio.gather(*(ext_bot.send_message(chat_id, 'hello') for chat_id in range(1, 11)))
+    
+    start = time.monotonic()
+    run_sends(scheduler, request, sends)
+    
+    times = sorted(sent for messages in request.delivered.values() for _, sent in messages)
+    assert len(times) == 10
+    assert times[-1] - start >= 9 / 25 * 0.9
+    gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+    assert min(gaps) >= 1 / 25 * 0.5
+
+
+def test_flood_wait_pauses_only_that_chat():
+    request = FloodingTelegram(floods={1: 1}, retry_after=0.5)
+    scheduler = bot.SendScheduler(global_rate=1000, per_chat_rate=1000, per_chat_burst=10, max_retries=3)
+    
+    async def sends(ext_bot):
+        await ext_bot.send_message(1, 'flooded')
+    
+    async def both(ext_bot):
+        flooded = asyncio.ensure_future(sends(ext_bot))
+        await asyncio.sleep(0.05)
+        await ext_bot.send_message(2, 'other chat')
+        other_sent = time.monotonic()
+        await flooded
+        return other_sent
+    
+    start = time.monotonic()
+    other_sent = run_sends(scheduler, request, both)
+    
+    assert other_sent - start < 0.5
+    assert request.delivered[1][0][1] - start >= 0.5
@@ -0,0 +1,119 @@
+import asyncio
+import os
+
+import pytest
+
+import bot
+
+TOKEN = 'test-token'
+
+
+def run_remote(tmp_path, scenario, token=TOKEN):
+    """Run scenario(remote, local) against a StateServer on an ephemeral port"""
+    async def main():
+        db_path = os.path.join(tmp_path, 'state.db')
+        bot.init_db(db_path)
+        local = bot.UserStore(db_path)
+        server = bot.StateServer(local, listen='127.0.0.1', port=0, token=TOKEN)
+        await server.start()
+        remote = bot.RemoteStore(f'http://127.0.0.1:{server.port}', token=token)
+        try:
+            return await scenario(remote, local)
+        finally:
+            await remote.close()
+            await server.stop()
+            await local.close()
+    return asyncio.run(main())
+
+
+def test_progress_round_trip(tmp_path):
+    async def scenario(remote, local):
+        assert await remote.get_or_create_user(1, 'alice', 'Alice') is True
+        assert await remote.get_or_create_user(1, 'alice', 'Alice') is False
+        
+        progress = await remote.get_user_progress(1)
+        assert progress['current_step'] == 1
+        assert not any(progress['tasks_completed'])
+        
+        await remote.mark_task_completed(1, 1)
+        await remote.mark_task_completed(1, 2)
+        progress = await remote.get_user_progress(1)
+        assert progress['tasks_completed'][:3] == [True, True, False]
+        assert progress['current_step'] == 3
+        
+        await remote.update_user_step(1, 2)
+        assert (await remote.get_user_progress(1))['current_step'] == 2
+        
+        await remote.reset_user_progress(1)
+        progress = await remote.get_user_progress(1)
+        assert progress['current_step'] == 1
+        assert not any(progress['tasks_completed'])
+        
+        # The server's own store sees the same state
+        assert await local.get_user_progress(1) == progress
+    
+    run_remote(tmp_path, scenario)
+
+
+def test_wallets_through_the_server(tmp_path):
+    address = '0x5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAed'
+    
+    async def scenario(remote, local):
+        await remote.get_or_create_user(1, 'alice', 'Alice')
+        await remote.get_or_create_user(2, 'bob', 'Bob')
+        assert await remote.save_wallet_address(1, address, address.lower()) is None
+        assert (await remote.get_user_progress(1))['wallet_address'] == address
+        # A second account cannot register the same wallet
+        assert await remote.save_wallet_address(2, address, address.lower()) == 1
+        assert (await remote.get_user_progress(2))['wallet_address'] is None
+    
+    run_remote(tmp_path, scenario)
+
+
+def test_stats_and_queries_through_the_server(tmp_path):
+    async def scenario(remote, local):
+        for user_id in (1, 2, 3):
+            await remote.get_or_create_user(user_id, f'user{user_id}', 'User')
+        await remote.mark_task_completed(2, 1)
+        await remote.flush()
+        assert await remote.get_stats() == await local.get_stats()
+        
+        broadcast_id = await remote.write(bot.BroadcastEngine._create, 'hello', 'admin')
+        # Tuples come back as lists
+        assert await remote.read(bot.BroadcastEngine._get, broadcast_id) == list(
+            await local.read(bot.BroadcastEngine._get, broadcast_id)
+        )
+    
+    run_remote(tmp_path, scenario)
+
+
+def test_rejects_unregistered_queries(tmp_path):
+    def not_a_state_query(conn):
+        return conn.execute('DELETE FROM users')
+    
+    async def scenario(remote, local):
+        with pytest.raises(ValueError):
+            await remote.write(not_a_state_query)
+        with pytest.raises(bot.StateBackendError):
+            await remote._call('drop_everything')
+    
+    run_remote(tmp_path, scenario)
+
+
+def test_rejects_a_wrong_token(tmp_path):
+    async def scenario(remote, local):
+        with pytest.raises(bot.StateBackendError, match='403'):
+            await remote.get_stats()
+    
+    run_remote(tmp_path, scenario, token='wrong')
+
+
+def test_backends_must_implement_the_interface():
+    class PartialStore(bot.StateBackend):
+        async def read(self, fn, *args):
+            return None
+    
+    with pytest.raises(TypeError):
+        PartialStore()
+    assert bot.StateBackend.has_pending_writes(bot.RemoteStore('http://localhost'), 1) is False
+    assert bot.RemoteStore('http://localhost').pending_writes == 0
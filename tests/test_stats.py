@@ -0,0 +1,133 @@
+import asyncio
+import random
+
+import bot
+
+MAIN_TASKS = len(bot.DEFAULT_TASKS)
+SPRING_TASKS = 3
+
+
+def recount(conn):
+    """The /stats numbers computed from scratch, archived users included"""
+    everyone = 'SELECT tasks_mask, joined_at FROM users UNION ALL SELECT tasks_mask, joined_at FROM users_archive'
+    total, today = conn.execute(
+        f"SELECT COUNT(*), TOTAL(date(joined_at) = date('now')) FROM ({everyone})"
+    ).fetchone()
+    main = [
+        int(conn.execute(f'SELECT TOTAL((tasks_mask >> ?) & 1) FROM ({everyone})', (bit,)).fetchone()[0])
+        for bit in range(MAIN_TASKS)
+    ]
+    participants = conn.execute("SELECT COUNT(*) FROM campaign_progress WHERE campaign = 'spring'").fetchone()[0]
+    spring = [
+        int(conn.execute(
+            "SELECT TOTAL((tasks_mask >> ?) & 1) FROM campaign_progress WHERE campaign = 'spring'", (bit,)
+        ).fetchone()[0])
+        for bit in range(SPRING_TASKS)
+    ]
+    return {'total_users': total, 'today_users': int(today), 'main': main, 'participants': participants, 'spring': spring}
+
+
+async def aggregates(store):
+    await store.flush()
+    stats = await store.get_stats()
+    spring = await store.get_campaign_stats('spring')
+    return {
+        'total_users': stats['total_users'],
+        'today_users': stats['today_users'],
+        'main': stats['task_completions'],
+        'participants': spring['total_users'],
+        'spring': spring['task_completions'],
+    }
+
+
+async def assert_aggregates_match(store):
+    await store.flush()
+    expected = await store.read(recount)
+    assert await aggregates(store) == expected
+    return expected
+
+
+async def random_activity(store, user_ids, rng):
+    for user_id in user_ids:
+        for _ in range(rng.randrange(8)):
+            operation = rng.choice(['mark', 'mark', 'mark', 'reset', 'spring', 'spring_reset', 'wallet', 'step'])
+            if operation == 'mark':
+                await store.mark_task_completed(user_id, rng.randint(1, MAIN_TASKS))
+            elif operation == 'reset':
+                await store.reset_user_progress(user_id)
+            elif operation == 'spring':
+                await store.enroll(user_id, 'spring')
+                await store.mark_task_completed(user_id, rng.randint(1, SPRING_TASKS), 'spring')
+            elif operation == 'spring_reset':
+                await store.reset_user_progress(user_id, 'spring')
+            elif operation == 'wallet':
+                wallet = f'0x{user_id:040x}'
+                await store.save_wallet_address(user_id, wallet, wallet)
+            else:
+                await store.update_user_step(user_id, rng.randint(1, MAIN_TASKS))
+
+
+def test_counters_match_a_recount(db_path, campaign_config):
+    async def main():
+        store = bot.UserStore(db_path)
+        rng = random.Random(4)
+        try:
+            for user_id in range(1, 61):
+                await store.get_or_create_user(user_id, f'user{user_id}', 'User')
+            await random_activity(store, range(1, 61), rng)
+            # Some users finish everything
+            for user_id in range(1, 61, 7):
+                for task_num in range(1, MAIN_TASKS + 1):
+                    await store.mark_task_completed(user_id, task_num)
+            counts = await assert_aggregates_match(store)
+            assert counts['total_users'] == 60
+            assert counts['main'][-1] >= 9
+            
+            # Interleaved more activity, new users and repeated marks
+            for user_id in range(61, 81):
+                await store.get_or_create_user(user_id, f'user{user_id}', 'User')
+            await random_activity(store, range(1, 81), rng)
+            for user_id in range(1, 81, 5):
+                await store.mark_task_completed(user_id, 1)
+                await store.mark_task_completed(user_id, 1)
+            await assert_aggregates_match(store)
+        finally:
+            await store.close()
+    
+    asyncio.run(main())
+
+
+def test_archiving_and_restoring_keeps_the_counters(db_path, campaign_config):
+    async def main():
+        store = bot.UserStore(db_path)
+        rng = random.Random(7)
+        try:
+            for user_id in range(1, 41):
+                await store.get_or_create_user(user_id, f'user{user_id}', 'User')
+            await random_activity(store, range(1, 41), rng)
+            await store.flush()
+            
+            def backdate(conn):
+                with conn:
+                    conn.execute("UPDATE users SET last_active = '2020-01-01 00:00:00' WHERE user_id <= 30")
+            await store.write(backdate)
+            before = await assert_aggregates_match(store)
+            
+            maintenance = bot.DatabaseMaintenance(store, backup_dir=None, archive_days=30, batch_size=7)
+            archived = await maintenance.archive_inactive()
+            assert archived > 0
+            assert await store.read(lambda conn: conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]) == 40 - archived
+            assert await assert_aggregates_match(store) == before
+            
+            # Returning users come back without being counted twice
+            for user_id in range(1, 31):
+                await store.get_or_create_user(user_id, f'user{user_id}', 'User')
+            assert await assert_aggregates_match(store) == before
+            assert await store.read(lambda conn: conn.execute('SELECT COUNT(*) FROM users_archive').fetchone()[0]) == 0
+            
+            await random_activity(store, range(1, 41), rng)
+            await assert_aggregates_match(store)
+        finally:
+            await store.close()
+    
+    asyncio.run(main())
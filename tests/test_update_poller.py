@@ -0,0 +1,182 @@
+import asyncio
+import types
+
+from telegram import Update
+
+import bot
+
+
+class FakeUpdatesBot:
+    """getUpdates over a list of waiting updates, dropping the confirmed ones like Telegram"""
+    
+    def __init__(self, update_ids=(), renumbered=False):
+        self.updates = [Update(update_id) for update_id in update_ids]
+        # The waiting updates were numbered anew and come back whatever the offset
+        self.renumbered = renumbered
+        self.offsets = []
+    
+    def push(self, *update_ids):
+        self.updates.extend(Update(update_id) for update_id in update_ids)
+    
+    async def get_updates(self, offset=None, limit=100, timeout=0, allowed_updates=None):
+        self.offsets.append(offset)
+        if self.renumbered:
+            self.renumbered = False
+            return self.updates[:limit]
+        self.updates = [update for update in self.updates if update.update_id >= offset]
+        if not self.updates and timeout:
+            await asyncio.sleep(timeout)
+        return self.updates[:limit]
+
+
+def make_poller(store, fake, **kwargs):
+    application = types.SimpleNamespace(bot=fake, update_queue=asyncio.Queue())
+    poller = bot.UpdatePoller(application, store, timeout=0.01, save_interval=60, **kwargs)
+    poller.offsets = bot.UpdateOffsets()
+    return poller
+
+
+async def queued_ids(poller, count, timeout=1):
+    """Ids of the next count updates the poller hands to the application"""
+    return [
+        (await asyncio.wait_for(poller.application.update_queue.get(), timeout)).update_id
+        for _ in range(count)
+    ]
+
+
+def test_watermark_stays_below_unfinished_updates():
+    offsets = bot.UpdateOffsets()
+    offsets.reset(10)
+    assert [offsets.received(update_id) for update_id in (11, 12, 13, 14)] == [True] * 4
+    offsets.finished(12)
+    offsets.finished(13)
+    assert (offsets.watermark, len(offsets), offsets.unconfirmed) == (10, 2, 4)
+    
+    # Fetched again before it was confirmed
+    assert not offsets.received(12)
+    assert offsets.refetched == 1
+    
+    offsets.finished(11)
+    assert (offsets.watermark, offsets.unconfirmed) == (13, 1)
+    offsets.finished(14)
+    assert (offsets.watermark, offsets.unconfirmed) == (14, 0)
+
+
+def test_polling_pauses_instead_of_confirming_running_updates(db_path):
+    async def main():
+        store = bot.UserStore(db_path)
+        fake = FakeUpdatesBot(range(1, 8))
+        poller = make_poller(store, fake, max_unconfirmed=3)
+        await poller.start()
+        try:
+            assert await queued_ids(poller, 3) == [1, 2, 3]
+            await asyncio.sleep(0.05)
+            assert poller.application.update_queue.empty()
+            assert set(fake.offsets) == {1}
+            
+            # Handling a later update does not free the slot of a running one
+            poller.offsets.finished(2)
+            await asyncio.sleep(0.05)
+            assert poller.application.update_queue.empty()
+            
+            poller.offsets.finished(1)
+            assert await queued_ids(poller, 2) == [4, 5]
+            assert max(fake.offsets) == 3
+            
+            for update_id in (3, 4, 5):
+                poller.offsets.finished(update_id)
+            assert await queued_ids(poller, 2) == [6, 7]
+            assert [update.update_id for update in fake.updates] == [6, 7]
+        finally:
+            await poller.stop()
+            await store.close()
+    
+    asyncio.run(main())
+
+
+def test_refetch_waits_for_a_running_update(db_path):
+    async def main():
+        store = bot.UserStore(db_path)
+        fake = FakeUpdatesBot([1, 2])
+        poller = make_poller(store, fake)
+        await poller.start()
+        try:
+            assert await queued_ids(poller, 2) == [1, 2]
+            calls = len(fake.offsets)
+            await asyncio.sleep(bot.POLL_REFETCH_DELAY / 2)
+            # Nothing new came back, so it waits instead of asking again
+            assert len(fake.offsets) - calls <= 1
+            
+            fake.push(3)
+            calls = len(fake.offsets)
+            poller.offsets.finished(1)
+            assert await queued_ids(poller, 1, timeout=bot.POLL_REFETCH_DELAY / 2) == [3]
+            assert fake.offsets[calls] == 2
+            assert poller.offsets.refetched >= 1
+        finally:
+            await poller.stop()
+            await store.close()
+    
+    asyncio.run(main())
+
+
+def test_update_ids_restart_below_the_saved_watermark(db_path):
+    async def main():
+        store = bot.UserStore(db_path)
+        await store.write(bot.UpdatePoller._save_offset, bot.UpdatePoller.OFFSET_KEY, 1000)
+        fake = FakeUpdatesBot([5, 6], renumbered=True)
+        poller = make_poller(store, fake)
+        await poller.start()
+        try:
+            assert await queued_ids(poller, 2) == [5, 6]
+            assert fake.offsets[0] == 1001
+            poller.offsets.finished(5)
+            poller.offsets.finished(6)
+            await poller.save()
+            assert await store.read(bot.UpdatePoller._load_offset, bot.UpdatePoller.OFFSET_KEY) == 6
+        finally:
+            await poller.stop()
+            await store.close()
+    
+    asyncio.run(main())
+
+
+def test_watermark_is_committed_with_the_writes(db_path):
+    async def main():
+        store = bot.UserStore(db_path, batch_delay=60)
+        await store.get_or_create_user(7, 'user7', 'User')
+        fake = FakeUpdatesBot([1, 2, 3])
+        poller = make_poller(store, fake)
+        await poller.start()
+        try:
+            assert await queued_ids(poller, 3) == [1, 2, 3]
+            
+            # Update 1 wrote something and is handled, 2 is still running
+            await store.mark_task_completed(7, 1)
+            poller.offsets.finished(1)
+            saved = await store.read(bot.UpdatePoller._load_offset, bot.UpdatePoller.OFFSET_KEY)
+            assert saved == 0
+            await store.flush()
+            saved = await store.read(bot.UpdatePoller._load_offset, bot.UpdatePoller.OFFSET_KEY)
+            assert saved == 1
+            
+            poller.offsets.finished(3)
+            poller.offsets.finished(2)
+        finally:
+            await poller.stop()
+        # Updates that wrote nothing are saved on shutdown
+        await poller.finish()
+        assert fake.offsets[-1] == 4
+        
+        # The next run resumes after them
+        fake.push(4)
+        restarted = make_poller(store, fake)
+        await restarted.start()
+        try:
+            assert await queued_ids(restarted, 1) == [4]
+            assert restarted.saved == 3
+        finally:
+            await restarted.stop()
+            await store.close()
+    
+    asyncio.run(main())
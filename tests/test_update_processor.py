@@ -0,0 +1,99 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import ExtBot
+
+import bot
+from benchmark import FAKE_TOKEN, FakeTelegram, callback_update, text_update
+
+
+class AnsweringTelegram(FakeTelegram):
+    """FakeTelegram that records the callback query answers it gets"""
+
+    def __init__(self):
+        super().__init__()
+        self.answers = {}
+
+    async def answer(self, endpoint, params):
+        if endpoint == 'answerCallbackQuery':
+            self.answers[params['callback_query_id']] = params.get('text')
+        return await super().answer(endpoint, params)
+
+
+def run_updates(processor, updates, handle):
+    """Feed updates to processor at once, handle(update) being each one's handler coroutine"""
+    request = AnsweringTelegram()
+    
+    async def main():
+        ext_bot = ExtBot(FAKE_TOKEN, request=request)
+        await ext_bot.initialize()
+        try:
+            parsed = [Update.de_json(data, ext_bot) for data in updates]
+            await asyncio.gather(*(processor.process_update(update, handle(update)) for update in parsed))
+        finally:
+            await ext_bot.shutdown()
+    
+    asyncio.run(main())
+    return request
+
+
+def test_keeps_each_users_updates_in_order():
+    handled = []
+    
+    async def handle(update):
+        await asyncio.sleep(0.01)
+        handled.append(update.update_id)
+    
+    processor = bot.PerUserUpdateProcessor(max_queued_callbacks=10)
+    run_updates(processor, [text_update(update_id, 7, f'message {update_id}') for update_id in range(1, 6)], handle)
+    
+    assert handled == [1, 2, 3, 4, 5]
+    assert processor.dropped_updates == 0
+
+
+def test_answers_and_counts_repeated_clicks():
+    handled = []
+    
+    async def handle(update):
+        await asyncio.sleep(0.05)
+        handled.append(update.update_id)
+    
+    processor = bot.PerUserUpdateProcessor(max_queued_callbacks=10)
+    request = run_updates(processor, [callback_update(update_id, 7, 'verify_1') for update_id in range(1, 4)], handle)
+    
+    assert handled == [1]
+    assert processor.repeated_callbacks == 2
+    assert processor.overflowed_callbacks == 0
+    # Handlers answer the clicks they handle, the processor the ones it drops
+    assert request.answers == {'2': None, '3': None}
+
+
+def test_answers_and_counts_clicks_beyond_the_queue():
+    handled = []
+    
+    async def handle(update):
+        await asyncio.sleep(0.05)
+        handled.append(update.update_id)
+    
+    processor = bot.PerUserUpdateProcessor(max_queued_callbacks=2)
+    updates = [callback_update(update_id, 7, f'task_{update_id}') for update_id in range(1, 6)]
+    request = run_updates(processor, updates, handle)
+    
+    # One click runs, two wait and the rest find the queue full
+    assert handled == [1, 2, 3]
+    assert processor.repeated_callbacks == 0
+    assert processor.overflowed_callbacks == 2
+    assert request.answers == {'4': bot.BUSY_CALLBACK_NOTICE, '5': bot.BUSY_CALLBACK_NOTICE}
+
+
+def test_messages_are_never_dropped():
+    handled = []
+    
+    async def handle(update):
+        await asyncio.sleep(0.01)
+        handled.append(update.update_id)
+    
+    processor = bot.PerUserUpdateProcessor(max_queued_callbacks=1)
+    run_updates(processor, [text_update(update_id, 7, 'same text') for update_id in range(1, 5)], handle)
+    
+    assert handled == [1, 2, 3, 4]
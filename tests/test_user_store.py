@@ -0,0 +1,132 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import bot
+
+
+def committed_progress(db_path, user_id):
+    """(current_step, tasks_mask) of user_id as another process would read it"""
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute('SELECT current_step, tasks_mask FROM users WHERE user_id = ?', (user_id,)).fetchone()
+    finally:
+        conn.close()
+
+
+def test_repeated_writes_commit_as_one_statement(db_path, monkeypatch):
+    batches = []
+    apply_batch = bot.UserStore._apply_batch
+    
+    def record_batch(conn, batch):
+        batches.append(batch)
+        return apply_batch(conn, batch)
+    monkeypatch.setattr(bot.UserStore, '_apply_batch', staticmethod(record_batch))
+    
+    async def main():
+        store = bot.UserStore(db_path, batch_delay=60)
+        try:
+            await store.get_or_create_user(1, 'user1', 'User')
+            await store.get_or_create_user(2, 'user2', 'User')
+            await store.flush()
+            batches.clear()
+            
+            for step in range(1, 6):
+                await store.update_user_step(1, step)
+            await store.update_user_step(2, 3)
+            assert store.pending_writes == 2
+            assert store.coalesced_writes == 4
+            assert store.has_pending_writes(1)
+            
+            await store.flush()
+            assert [[user_id for user_id, _ in batch] for batch in batches] == [[1, 2]]
+            assert [len(ops) for _, ops in batches[0]] == [1, 1]
+            assert not store.has_pending_writes(1)
+            assert committed_progress(db_path, 1)[0] == 5
+            assert committed_progress(db_path, 2)[0] == 3
+            
+            # A different kind of write in between is not merged over
+            await store.update_user_step(1, 2)
+            await store.mark_task_completed(1, 1)
+            await store.update_user_step(1, 4)
+            assert store.pending_writes == 3
+            await store.flush()
+            assert committed_progress(db_path, 1) == (4, 1)
+        finally:
+            await store.close()
+    
+    asyncio.run(main())
+
+
+def test_strict_durability_commits_every_write(db_path):
+    async def main():
+        store = bot.UserStore(db_path, durability='strict', batch_delay=60)
+        try:
+            await store.get_or_create_user(1, 'user1', 'User')
+            await store.mark_task_completed(1, 2)
+            assert store.pending_writes == 0
+            assert committed_progress(db_path, 1) == (1, 2)
+            await store.update_user_step(1, 5)
+            assert committed_progress(db_path, 1) == (5, 2)
+            synchronous = await store.write(lambda conn: conn.execute('PRAGMA synchronous').fetchone()[0])
+            assert synchronous == 2
+        finally:
+            await store.close()
+    
+    asyncio.run(main())
+
+
+def test_failing_statement_only_rolls_back_its_write(db_path):
+    async def main():
+        store = bot.UserStore(db_path, batch_delay=60)
+        try:
+            for user_id in (1, 2, 3):
+                await store.get_or_create_user(user_id, f'user{user_id}', 'User')
+            await store.flush()
+            
+            await store.mark_task_completed(1, 1)
+            await store._queue_write(2, [
+                (bot.SQL_UPDATE_STEP, (4, 2)),
+                ('UPDATE no_such_table SET value = ? WHERE user_id = ?', (1, 2)),
+            ])
+            await store.mark_task_completed(3, 2)
+            bot.progress_cache.put(2, {'current_step': 4})
+            await store.flush()
+            
+            assert store.failed_writes == 1
+            assert store.failed_batches == 0
+            assert committed_progress(db_path, 1) == (2, 1)
+            assert committed_progress(db_path, 2) == (1, 0)
+            assert committed_progress(db_path, 3) == (1, 2)
+            assert not store.has_pending_writes(2)
+            assert 2 not in bot.progress_cache
+        finally:
+            await store.close()
+    
+    asyncio.run(main())
+
+
+def test_failed_batch_is_counted_and_reported(db_path, monkeypatch):
+    async def main():
+        store = bot.UserStore(db_path, batch_delay=60)
+        try:
+            await store.get_or_create_user(1, 'user1', 'User')
+            await store.flush()
+            
+            def disk_error(conn, batch):
+                raise sqlite3.OperationalError('disk I/O error')
+            monkeypatch.setattr(bot.UserStore, '_apply_batch', staticmethod(disk_error))
+            await store.update_user_step(1, 3)
+            bot.progress_cache.put(1, {'current_step': 3})
+            with pytest.raises(sqlite3.OperationalError):
+                await store.flush()
+            assert (store.failed_batches, store.failed_writes) == (1, 1)
+            assert not store.has_pending_writes(1)
+            assert 1 not in bot.progress_cache
+            # Nothing left to commit, the failure is not raised again
+            await store.flush()
+        finally:
+            await store.close()
+    
+    asyncio.run(main())
@@ -0,0 +1,139 @@
+import pytest
+
+import bot
+
+# EIP-55 checksummed addresses from the EIP
+EIP55_ADDRESSES = [
+    '0x5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAed',
+    '0xfB6916095ca1df60bB79Ce92cE3Ea74c37c5d359',
+    '0xdbF03B407c01E7cD3CBea99509d93f8DDDC8C6FB',
+    '0xD1220A0cf47c7B9Be7A2E6BA89F429762e7b9aDb',
+]
+
+
+# The BIP-173 P2WPKH program as 5-bit groups
+P2WPKH_DATA = [
+    14, 20, 15, 7, 13, 26, 0, 25, 18, 6, 11, 13, 8, 21, 4, 20, 3, 17, 2, 29, 3, 12, 29, 3, 4, 15, 24, 20, 6, 14, 30, 22,
+]
+
+
+def bech32_encode(hrp, data, constant):
+    expanded_hrp = [ord(char) >> 5 for char in hrp] + [0] + [ord(char) & 31 for char in hrp]
+    checksum = bot._bech32_polymod(expanded_hrp + data + [0] * 6) ^ constant
+    data = data + [(checksum >> 5 * (5 - i)) & 31 for i in range(6)]
+    return hrp + '1' + ''.join(bot._BECH32_CHARSET[value] for value in data)
+
+
+def swap_case_at(text, index):
+    return text[:index] + text[index].swapcase() + text[index + 1:]
+
+
+def replace_at(text, index, char):
+    return text[:index] + char + text[index + 1:]
+
+
+def test_keccak256_matches_ethereum():
+    assert bot.keccak256(b'').hex() == 'c5d2460186f7233c927e7db2dcc703c0e500b653ca82273b7bfad8045d85a470'
+
+
+@pytest.mark.parametrize('address', EIP55_ADDRESSES)
+def test_accepts_eip55_checksums(address):
+    assert bot.parse_wallet_address(address) == ('evm', address.lower())
+
+
+@pytest.mark.parametrize('address', EIP55_ADDRESSES)
+def test_rejects_broken_eip55_checksums(address):
+    letter = next(i for i, char in enumerate(address) if i > 1 and char.isalpha())
+    assert bot.parse_wallet_address(swap_case_at(address, letter)) is None
+
+
+@pytest.mark.parametrize('address', [
+    '0x' + EIP55_ADDRESSES[0][2:].lower(),
+    '0x' + EIP55_ADDRESSES[0][2:].upper(),
+])
+def test_accepts_evm_addresses_without_checksum(address):
+    assert bot.parse_wallet_address(address) == ('evm', address.lower())
+
+
+@pytest.mark.parametrize('address', [
+    '0x5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAe',
+    '0x5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAedd',
+    '0x5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAeg',
+])
+def test_rejects_malformed_evm_addresses(address):
+    assert bot.parse_wallet_address(address) is None
+
+
+@pytest.mark.parametrize('address', [
+    # BIP-173 P2WPKH and P2WSH
+    'BC1QW508D6QEJXTDG4Y5R3ZARVARY0C5XW7KV8F3T4',
+    'bc1qrp33g0q5c5txsp9arysrx4k6zdkfs4nce4xj0gdcccefvpysxf3qccfmv3',
+    # BIP-350 taproot, bech32m
+    'bc1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7vqzk5jj0',
+])
+def test_accepts_segwit_addresses(address):
+    assert bot.parse_wallet_address(address) == ('btc', address.lower())
+
+
+@pytest.mark.parametrize('address', [
+    # Last checksum character changed
+    'bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t5',
+    'bc1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7vqzk5jj1',
+    # Mixed case
+    'bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3T4',
+    # 'b' is not in the bech32 alphabet
+    'bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3tb',
+])
+def test_rejects_invalid_segwit_addresses(address):
+    assert bot.parse_wallet_address(address) is None
+
+
+def test_rejects_segwit_addresses_with_the_wrong_checksum_variant():
+    # Witness v0 must use bech32 and later versions bech32m
+    assert bot.parse_wallet_address(bech32_encode('bc', [0] + P2WPKH_DATA, bot._BECH32_CONST))
+    assert bot.parse_wallet_address(bech32_encode('bc', [0] + P2WPKH_DATA, bot._BECH32M_CONST)) is None
+    assert bot.parse_wallet_address(bech32_encode('bc', [1] + P2WPKH_DATA, bot._BECH32M_CONST))
+    assert bot.parse_wallet_address(bech32_encode('bc', [1] + P2WPKH_DATA, bot._BECH32_CONST)) is None
+
+
+def test_rejects_other_bech32_networks():
+    assert bot.parse_wallet_address(bech32_encode('tb', [0] + P2WPKH_DATA, bot._BECH32_CONST)) is None
+
+
+def test_accepts_cardano_shelley_addresses():
+    # CIP-19 base address, longer than the 90 characters BIP-173 allows
+    address = 'addr1qx2fxv2umyhttkxyxp8x0dlpdt3k6cwng5pxj3jhsydzer3n0d3vllmyqwsx5wktcd8cc3sq835lu7drv2xwl2wywfgse35a3x'
+    assert bot.parse_wallet_address(address) == ('cardano', address)
+    assert bot.parse_wallet_address(replace_at(address, len(address) - 1, 'y')) is None
+
+
+@pytest.mark.parametrize('address, chain', [
+    ('1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa', 'btc'),
+    ('3J98t1WpEZ73CNmQviecrnyiWrnqRhWNLy', 'btc'),
+    ('TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t', 'tron'),
+])
+def test_accepts_base58check_addresses(address, chain):
+    assert bot.parse_wallet_address(address) == (chain, address)
+
+
+@pytest.mark.parametrize('address', [
+    # Checksum broken by one character
+    '1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNb',
+    'TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6u',
+    # Base58 has no 0, O, I or l
+    '1A1zP1eP5QGefi2DMPTfTL5SLmv7Div0Na',
+    '1A1zP1eP5QGefi2DMPTfTL5SLmv7DivlNa',
+    # Too short
+    '1A1zP1eP5QGefi2DMPTf',
+])
+def test_rejects_invalid_base58check_addresses(address):
+    assert bot.parse_wallet_address(address) is None
+
+
+@pytest.mark.parametrize('text', ['', 'hello', 'not a wallet 0x123', 'Xyz1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa'])
+def test_rejects_other_text(text):
+    assert bot.parse_wallet_address(text) is None
+
+
+def test_strips_surrounding_whitespace():
+    assert bot.parse_wallet_address('  1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa\n') == ('btc', '1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa')